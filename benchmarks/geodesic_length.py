@@ -0,0 +1,75 @@
+"""
+Geodesic length benchmark
+
+Measures segments/second of the client-side ellipsoidal length
+(Geodesic, NumPy and pure Python) on synthetic tracks. If Database
+credentials are given, lengths are also compared to PostGIS's
+ST_LengthSpheroid, the value the line table's length used to hold:
+
+python -m benchmarks.geodesic_length --db tracks --user postgres --credentials ***
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import time
+import lib.geodesic
+from lib.geodesic import Geodesic
+from lib.track import Track
+from benchmarks.synthetic import synthetic_track
+
+
+def measure(track: Track, repeats: int=3) -> dict:
+    """Measures the track with either implementation
+    :return: (dict) segments/second and length per implementation"""
+    results = {}
+    numpy = lib.geodesic.numpy
+    implementations = {'numpy': numpy, 'python': None} if numpy is not None\
+        else {'python': None}
+    try:
+        for name, module in implementations.items():
+            lib.geodesic.numpy = module
+            start = time.perf_counter()
+            for _ in range(repeats):
+                length = Geodesic().length(track.longitudes, track.latitudes)
+            elapsed = (time.perf_counter() - start) / repeats
+            results[name] = ((len(track) - 1) / elapsed, length)
+    finally:
+        lib.geodesic.numpy = numpy
+    return results
+
+
+def compare(tracks: list, db_name: str, user: str, credentials: str) -> float:
+    """Compares client-side lengths to ST_LengthSpheroid
+    :return: (float) largest absolute difference, meters"""
+    from lib.db_connector import DBConnector
+
+    connection = DBConnector(db_name=db_name, user=user,
+                             credentials=credentials).connect()
+    worst = 0.0
+    with connection.cursor() as cur:
+        for track in tracks:
+            cur.execute("""SELECT ST_LengthSpheroid(ST_GeomFromEWKB(%s),
+                           'SPHEROID["WGS 84",6378137,298.257223563]');""",
+                        (track.to_wkb(),))
+            worst = max(worst, abs(cur.fetchone()[0] - track.length()))
+    connection.close()
+    return worst
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--credentials')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--tracks', type=int, default=20)
+    arguments = parser.parse_args()
+
+    track = Track.from_points(synthetic_track(arguments.count, seed=0))
+    for name, (rate, length) in measure(track).items():
+        print(f"{name:>8}: {rate:,.0f} segments/s ({length:,.3f} m)")
+    if arguments.db:
+        tracks = [Track.from_points(synthetic_track(arguments.count // 10, seed=seed))
+                  for seed in range(arguments.tracks)]
+        difference = compare(tracks, arguments.db, arguments.user, arguments.credentials)
+        print(f"Largest difference to ST_LengthSpheroid: {difference * 1000:.4f} mm")
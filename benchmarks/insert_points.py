@@ -0,0 +1,77 @@
+"""
+Point insertion benchmark
+
+Compares rows/second of the legacy per-row INSERT loop against
+the COPY-based DBPacker.insert_points on a synthetic track.
+Runs against a local Postgres Database with PostGIS enabled:
+
+python -m benchmarks.insert_points --db tracks --user postgres --credentials ***
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import time
+from lib.db_connector import DBConnector
+from lib.db_packer import DBPacker
+from lib.track import Track
+from benchmarks.synthetic import synthetic_track
+
+
+def legacy_insert(packer: DBPacker, connection, table_name: str) -> None:
+    """Pre-COPY insertion loop: one statement and one commit per point"""
+    identifier = packer.default_video_alias
+    for point in packer.parsed_data:
+        query = f"""
+            INSERT INTO public.{table_name}(video, longitude, latitude, altitude, geom)
+            VALUES('{identifier}', {point[0]}, {point[1]}, {point[2]},
+            ST_GeomFromText('POINT({point[0]} {point[1]})', 4326));"""
+        with connection.cursor() as cur:
+            cur.execute(query)
+            connection.commit()
+
+
+def run(db_name: str, user: str, credentials: str,
+        count: int, table_name: str) -> dict:
+    """Runs both insertion paths on the same track into a scratch table
+    :return: (dict) rows/second per insertion path"""
+    packer = DBPacker(video='')
+    packer.default_video_alias = 'VID_benchmark'
+    packer.parsed_data = Track.from_points([[p[0], p[1], int(p[2])]
+                                            for p in synthetic_track(count)],
+                                           alias=packer.default_video_alias)
+    connection = DBConnector(db_name=db_name, user=user,
+                             credentials=credentials).connect()
+    with connection.cursor() as cur:
+        cur.execute(f'DROP TABLE IF EXISTS public.{table_name};')
+    packer.create_columns(connection=connection, table_names=[table_name],
+                          geometry='Point')
+
+    results = {}
+    paths = {'insert loop': lambda: legacy_insert(packer, connection, table_name),
+             'copy text': lambda: packer.insert_points(connection, table_name,
+                                                      verbose=False, binary=False),
+             'copy binary': lambda: packer.insert_points(connection, table_name,
+                                                        verbose=False, binary=True)}
+    for name, insert in paths.items():
+        start = time.perf_counter()
+        insert()
+        results[name] = count / (time.perf_counter() - start)
+
+    with connection.cursor() as cur:
+        cur.execute(f'DROP TABLE public.{table_name};')
+    connection.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--credentials', required=True)
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--table', default='benchmark_points')
+    arguments = parser.parse_args()
+
+    for path, rate in run(arguments.db, arguments.user, arguments.credentials,
+                          arguments.count, arguments.table).items():
+        print(f"{path:>12}: {rate:,.0f} rows/s")
@@ -0,0 +1,82 @@
+"""
+Native reader validation and benchmark
+
+Extracts the same videos with both engines (ExifTool and the native
+QuickTime reader), reports mismatching points and files/second per engine:
+
+python -m benchmarks.native_reader D://SampleData/video_1 D://SampleData/video_2
+
+Without arguments synthetic videos are generated and read with
+the native engine only
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from lib.exif_extractor import EXIFExtractor
+from lib.quicktime_reader import QuickTimeReader
+from benchmarks.synthetic import synthetic_track, write_mp4
+
+
+def measure(engine, folders: list) -> tuple:
+    """Extracts all folders with the given engine
+    :return: (tuple) extraction results and files/second"""
+    start = time.perf_counter()
+    results = [engine(folder).extract() for folder in folders]
+    return results, len(folders) / (time.perf_counter() - start)
+
+
+def compare(reference: list, candidate: list, tolerance: float=1e-7) -> list:
+    """Compares extraction results pairwise
+    :return: (list) mismatch descriptions"""
+    mismatches = []
+    for expected, actual in zip(reference, candidate):
+        if expected.alias != actual.alias:
+            mismatches.append(f"{expected.source}: alias {expected.alias} != {actual.alias}")
+        if len(expected.points) != len(actual.points):
+            mismatches.append(f"{expected.source}: {len(expected.points)} points"
+                              f" != {len(actual.points)} points")
+            continue
+        for index, (a, b) in enumerate(zip(expected.points, actual.points)):
+            if abs(a[0] - b[0]) > tolerance or abs(a[1] - b[1]) > tolerance\
+                    or a[2] != b[2]:
+                mismatches.append(f"{expected.source}: point {index} {a} != {b}")
+                break
+    return mismatches
+
+
+def synthetic_folders(root: str, count: int, points: int) -> list:
+    """Writes synthetic videos, one per folder
+    :return: (list) generated folders"""
+    folders = []
+    for index in range(count):
+        folder = os.path.join(root, f"video_{index}")
+        os.makedirs(folder)
+        write_mp4(f"{folder}/origin_6_lrv.mp4", synthetic_track(points, seed=index),
+                  datetime(2024, 5, 1, 10, index % 60))
+        folders.append(folder)
+    return folders
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('folders', nargs='*')
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--points', type=int, default=1800)
+    arguments = parser.parse_args()
+
+    if arguments.folders:
+        exiftool_results, exiftool_rate = measure(EXIFExtractor, arguments.folders)
+        native_results, native_rate = measure(QuickTimeReader, arguments.folders)
+        for mismatch in compare(exiftool_results, native_results):
+            print(mismatch)
+        print(f"exiftool: {exiftool_rate:,.1f} files/s")
+        print(f"  native: {native_rate:,.1f} files/s")
+    else:
+        with tempfile.TemporaryDirectory() as root:
+            folders = synthetic_folders(root, arguments.count, arguments.points)
+            _, native_rate = measure(QuickTimeReader, folders)
+            print(f"  native: {native_rate:,.1f} files/s")
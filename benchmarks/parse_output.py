@@ -0,0 +1,78 @@
+"""
+ExifTool output parsing micro-benchmark
+
+Parses the same synthetic track rendered as each ExifTool output format
+the extractor understands: legacy per-line print format (parse_data),
+JSON (parse_json) and numeric print format (parse_columns, with NumPy
+and with the array('d') fallback). Reports points/second per parser:
+
+python -m benchmarks.parse_output --points 100000
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+import lib.exif_extractor as exif_extractor
+from lib.exif_extractor import EXIFExtractor
+from benchmarks.synthetic import synthetic_track, write_mp4
+
+
+def render(track: list, create_date: str) -> dict:
+    """Renders track as ExifTool would print it in each output format
+    :return: (dict) raw output per format"""
+    legacy = '\n'.join(f"{abs(lon):.8f} {'E' if lon >= 0 else 'W'}, "
+                       f"{abs(lat):.8f} {'N' if lat >= 0 else 'S'}, {alt:.1f}"
+                       for lon, lat, alt in track)
+    record = {'SourceFile': 'origin_6_lrv.mp4', 'Main:CreateDate': create_date}
+    for index, (lon, lat, alt) in enumerate(track, start=1):
+        record[f'Doc{index}:GPSLongitude'] = lon
+        record[f'Doc{index}:GPSLatitude'] = lat
+        record[f'Doc{index}:GPSAltitude'] = alt
+    numeric = f"CreateDate={create_date}\n" +\
+        ''.join(f"{lon} {lat} {alt}\n" for lon, lat, alt in track)
+    return {'legacy': legacy.encode(),
+            'json': json.dumps([record]).encode(),
+            'numeric': numeric.encode()}
+
+
+def run(points: int, repeat: int=3) -> dict:
+    """Times every parser on the same track, best of the repeats
+    :return: (dict) points/second per parser"""
+    outputs = render(synthetic_track(points, seed=0), '2024:05:01 10:20:30')
+    with tempfile.TemporaryDirectory() as folder:
+        write_mp4(os.path.join(folder, 'origin_6_lrv.mp4'),
+                  synthetic_track(1, seed=0), datetime(2024, 5, 1))
+        extractor = EXIFExtractor(input_path=folder)
+        numpy = exif_extractor.numpy
+        parsers = {'parse_data': lambda: extractor.parse_data(
+                       outputs['legacy'].decode().splitlines()),
+                   'parse_json': lambda: extractor.parse_json(outputs['json']),
+                   'parse_columns (array)': lambda: extractor.parse_columns(outputs['numeric'])}
+        if numpy is not None:
+            parsers['parse_columns (numpy)'] = lambda: extractor.parse_columns(outputs['numeric'])
+
+        results = {}
+        for name, parse in parsers.items():
+            exif_extractor.numpy = numpy if name.endswith('(numpy)') else None
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parse()
+                timings.append(time.perf_counter() - start)
+            results[name] = points / min(timings)
+        exif_extractor.numpy = numpy
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    arguments = parser.parse_args()
+
+    for name, rate in run(arguments.points, arguments.repeat).items():
+        print(f"{name:>22}: {rate:,.0f} points/s")
@@ -0,0 +1,198 @@
+"""
+End-to-end scale harness
+
+Builds a synthetic archive (thousands of folders, each one holding a small
+MP4 with a generated GPS track) and ingests it via the full
+DBPacker.pack_data flow into a local PostGIS Database, step by step.
+Reports videos/minute, rows/second, peak RSS and Database size per step,
+along with the rows already in the point table, hence it shows how
+ingestion scales as the tables grow.
+
+Videos are read either natively (camm track of the synthetic MP4s) or
+through the ExifTool stub replaying generated output (see stub_exiftool):
+
+python -m benchmarks.scale --db scale_test --credentials *** --videos 5000 --steps 10
+python -m benchmarks.scale --db scale_test --credentials *** --engine stub --report scale.json
+python -m benchmarks.scale --db scale_test --credentials *** --videos 500 --profile
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from lib.db_connector import DBConnector
+from lib.db_packer import DBPacker
+from benchmarks.synthetic import synthetic_track, write_mp4
+
+
+def build_corpus(root: str, count: int, points: int, recordings: str=None,
+                 per_folder: int=500) -> list:
+    """Writes the synthetic archive. Videos are nested by batches of
+    per_folder, each one recorded an hour after the previous one (unique
+    default aliases, date partitions spanning several months)
+    :param root: (str) archive's root directory
+    :param count: (int) amount of videos
+    :param points: (int) GPS samples per video
+    :param recordings: (str) directory of the stub's recordings to be
+    written along. None (native reading only) by default
+    :param per_folder: (int) amount of video folders per batch folder. 500 by default
+    :return: (list) video folders"""
+    from benchmarks.parse_output import render
+    from benchmarks.stub_exiftool import write_recordings
+
+    folders = []
+    started = datetime(2024, 1, 1)
+    for index in range(count):
+        folder = os.path.join(root, f"batch_{index // per_folder:03d}", f"video_{index:05d}")
+        os.makedirs(folder)
+        track = synthetic_track(points, seed=index)
+        created = started + timedelta(hours=index)
+        write_mp4(os.path.join(folder, 'origin_6_lrv.mp4'), track, created)
+        if recordings:
+            outputs = render(track, f"{created:%Y:%m:%d %H:%M:%S}")
+            write_recordings(recordings, f"video_{index:05d}",
+                             {'json': outputs['json'], 'numeric': outputs['numeric']})
+        folders.append(folder.replace('\\', '/'))
+    return folders
+
+
+def peak_rss() -> float:
+    """Reads process' peak resident set size
+    :return: (float) peak RSS in MB, None if it can't be read"""
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:  # Windows
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset / 1024 ** 2
+        except (ImportError, AttributeError):
+            return None
+
+
+def database_state(connector: DBConnector, table_name: str) -> tuple:
+    """Reads point table's row count and Database's size
+    :return: (tuple) rows and size in MB"""
+    with connector.connection() as connection:
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM public.{table_name};")
+            rows = cur.fetchone()[0]
+            cur.execute("SELECT pg_database_size(current_database());")
+            size = cur.fetchone()[0] / 1024 ** 2
+    return rows, size
+
+
+def ingest(folders: list, arguments: argparse.Namespace, new: bool) -> int:
+    """Packs videos one by one via DBPacker.pack_data
+    :return: (int) inserted points"""
+    points = 0
+    for index, folder in enumerate(folders):
+        packer = DBPacker(video=folder)
+        packer.extraction_engine = 'native' if arguments.engine == 'native' else 'exiftool'
+        packer.pack_data(new=new and index == 0, db_name=arguments.db,
+                         user=arguments.user, credentials=arguments.credentials,
+                         table_names=arguments.tables, geometry=arguments.geometry,
+                         verbose=False)
+        points += len(packer.parsed_data) if packer.parsed_data is not None\
+            else packer.streamed_points
+    return points
+
+
+def run(arguments: argparse.Namespace, folders: list) -> list:
+    """Ingests the archive in steps, measuring each one
+    :return: (list) per-step reports"""
+    connector = DBConnector(db_name=arguments.db, user=arguments.user,
+                            credentials=arguments.credentials)
+    step_size = -(-len(folders) // arguments.steps)
+    reports = []
+    for step in range(arguments.steps):
+        batch = folders[step * step_size:(step + 1) * step_size]
+        if not batch:
+            break
+        new = arguments.new and step == 0
+        existing = database_state(connector, arguments.tables[0])[0] if not new else 0
+        start = time.perf_counter()
+        points = ingest(batch, arguments, new=new)
+        elapsed = time.perf_counter() - start
+        rows, size = database_state(connector, arguments.tables[0])
+        reports.append({'step': step + 1,
+                        'existing_rows': existing,
+                        'videos': len(batch),
+                        'points': points,
+                        'seconds': round(elapsed, 3),
+                        'videos_per_minute': round(len(batch) / elapsed * 60, 1),
+                        'rows_per_second': round(points / elapsed, 1),
+                        'peak_rss_mb': peak_rss(),
+                        'table_rows': rows,
+                        'database_mb': round(size, 1)})
+        print(f"step {step + 1:>3}: {existing:>10,} existing rows,"
+              f" {reports[-1]['videos_per_minute']:>8,.1f} videos/min,"
+              f" {reports[-1]['rows_per_second']:>10,.0f} rows/s,"
+              f" peak RSS {reports[-1]['peak_rss_mb'] or 0:,.0f} MB,"
+              f" Database {reports[-1]['database_mb']:,.1f} MB")
+    return reports
+
+
+if __name__ == "__main__":
+    import contextlib
+    from lib.exiftool_session import ExifToolSession
+    from lib.profiler import IngestProfiler
+    from lib.settings_reader import Reader
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', required=True, help="scratch Database of a local PostGIS")
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--credentials', default=os.environ.get('PGPASSWORD'))
+    parser.add_argument('--append', dest='new', action='store_false',
+                        help="ingest into the existing Database and tables instead of new ones")
+    parser.add_argument('--tables', nargs=2, default=['scale_points', 'scale_lines'])
+    parser.add_argument('--geometry', choices=['Point', 'Line', 'Both'], default='Both')
+    parser.add_argument('--engine', choices=['native', 'stub'], default='native')
+    parser.add_argument('--videos', type=int, default=2000)
+    parser.add_argument('--points', type=int, default=600, help="GPS samples per video")
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--root', help="archive's directory, kept. Temporary by default")
+    parser.add_argument('--report', help="JSON report's path")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the ingestion (see lib.profiler)")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        root = arguments.root or scratch
+        recordings = os.path.join(root, 'recordings') if arguments.engine == 'stub' else None
+        started = time.perf_counter()
+        folders = build_corpus(root, arguments.videos, arguments.points, recordings)
+        print(f"Built {len(folders)} videos in {time.perf_counter() - started:.1f} s")
+        if recordings:
+            from benchmarks.suite import StubSession
+
+            # Packers use the shared session of the ExifTool executable
+            ExifToolSession._shared['lib/exiftool.exe'] = StubSession(recordings)
+        # Archive's root is temporary, inputs are tagged relative to it
+        profiler = IngestProfiler.from_settings(
+            Reader().get_settings(), enabled=arguments.profile, label='scale',
+            inputs=[os.path.relpath(folder, root) for folder in folders],
+            parameters={key: value for key, value in vars(arguments).items()
+                        if key != 'credentials'})
+        try:
+            with profiler or contextlib.nullcontext():
+                reports = run(arguments, folders)
+        finally:
+            if recordings:
+                ExifToolSession._shared.pop('lib/exiftool.exe').close()
+    if profiler:
+        print(f"Profile written to {', '.join(profiler.paths)}")
+
+    if arguments.report:
+        with open(arguments.report, 'w') as report_file:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'),
+                       'arguments': {k: v for k, v in vars(arguments).items()
+                                     if k != 'credentials'},
+                       'steps': reports}, report_file, indent=2)
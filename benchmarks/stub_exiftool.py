@@ -0,0 +1,149 @@
+"""
+Stub ExifTool
+
+Replays recorded ExifTool output instead of reading videos, hence
+extraction can be benchmarked offline and deterministically. Speaks
+ExifTool's -stay_open protocol (commands read from stdin, framed with
+-executeN and answered with {readyN}) and runs single commands too.
+Recordings are read from the QTD_STUB_RECORDINGS directory, one file per
+video's folder name and output format: <folder>.json, <folder>.numeric,
+<folder>.legacy and <folder>.createdate. Real videos are recorded with:
+
+python -m benchmarks.stub_exiftool record D://SampleData/video_1 --out recordings
+
+Standard library only, hence it runs as a plain script as well
+
+© 2024 Kirill Romashchenko
+"""
+import json
+import os
+import sys
+
+
+def output_format(args: list) -> str:
+    """Detects the output format requested by ExifTool arguments
+    :param args: (list) command line arguments
+    :return: (str) json, numeric, legacy or createdate"""
+    if '-j' in args:
+        return 'json'
+    if '-p' in args:
+        return 'numeric' if args[args.index('-p') + 1].endswith('.fmt') else 'legacy'
+    return 'createdate'
+
+
+def input_files(args: list) -> list:
+    """Picks input files out of ExifTool arguments (values of the
+    options taking one are skipped)
+    :param args: (list) command line arguments
+    :return: (list) input file paths"""
+    files = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in ('-p', '-api'):
+            skip = True
+        elif not arg.startswith('-'):
+            files.append(arg)
+    return files
+
+
+def recording_path(directory: str, video_path: str, output: str) -> str:
+    """Builds recording's path of the video
+    :param directory: (str) recordings directory
+    :param video_path: (str) path to the video
+    :param output: (str) output format
+    :return: (str) recording's path"""
+    folder = os.path.basename(os.path.dirname(os.path.abspath(video_path)))
+    return os.path.join(directory, f"{folder}.{output}")
+
+
+def reply(args: list, directory: str) -> bytes:
+    """Replays recorded output of a single command. JSON records of
+    several input files are merged into one array, like ExifTool does
+    :param args: (list) command line arguments
+    :param directory: (str) recordings directory
+    :return: (bytes) command's stdout, empty for missing recordings"""
+    output = output_format(args)
+    records = []
+    chunks = []
+    for video_path in input_files(args):
+        try:
+            with open(recording_path(directory, video_path, output), 'rb') as recording:
+                data = recording.read()
+        except OSError:
+            continue
+        if output == 'json':
+            for record in json.loads(data):
+                record['SourceFile'] = video_path
+                records.append(record)
+        else:
+            chunks.append(data)
+    if output == 'json':
+        return json.dumps(records).encode() if records else b''
+    return b''.join(chunks)
+
+
+def serve(directory: str) -> None:
+    """Serves -stay_open commands from stdin until '-stay_open False'
+    :param directory: (str) recordings directory"""
+    args = []
+    for line in sys.stdin.buffer:
+        line = line.decode('utf-8').rstrip('\r\n')
+        if line.startswith('-execute'):
+            sys.stdout.buffer.write(reply(args, directory) +
+                                    f"\n{{ready{line[len('-execute'):]}}}\n".encode())
+            sys.stdout.buffer.flush()
+            args = []
+        elif args[-1:] == ['-stay_open'] and line == 'False':
+            return
+        else:
+            args.append(line)
+
+
+def write_recordings(directory: str, name: str, outputs: dict) -> None:
+    """Stores outputs of a video as its recordings
+    :param directory: (str) recordings directory
+    :param name: (str) video's folder name
+    :param outputs: (dict) raw output (bytes) per format"""
+    os.makedirs(directory, exist_ok=True)
+    for output, data in outputs.items():
+        with open(os.path.join(directory, f"{name}.{output}"), 'wb') as recording:
+            recording.write(data)
+
+
+def record(folders: list, directory: str) -> None:
+    """Records real ExifTool's output of the videos (lib/exiftool.exe)
+    in every format the extractor requests
+    :param folders: (list) absolute paths to the folders containing target videos
+    :param directory: (str) recordings directory"""
+    from lib.exif_extractor import EXIFExtractor
+
+    for folder in folders:
+        extractor = EXIFExtractor(input_path=folder)
+        session = extractor.session
+        outputs = {
+            'json': session.execute(*extractor.build_query(), extractor.video_path),
+            'numeric': session.execute(*extractor.build_numeric_query(),
+                                       extractor.video_path),
+            'createdate': session.execute('-G1', '-a', '-s', '-createdate',
+                                          '-api', 'largefilesupport=1',
+                                          extractor.video_path)}
+        write_recordings(directory, os.path.basename(os.path.normpath(folder)), outputs)
+        print(f"Recorded {folder}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['record']:
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Records ExifTool's output for the stub")
+        parser.add_argument('folders', nargs='+')
+        parser.add_argument('--out', required=True, help="recordings directory")
+        arguments = parser.parse_args(sys.argv[2:])
+        record(arguments.folders, arguments.out)
+    elif '-stay_open' in sys.argv:
+        serve(os.environ.get('QTD_STUB_RECORDINGS', 'recordings'))
+    else:
+        sys.stdout.buffer.write(reply(sys.argv[1:],
+                                      os.environ.get('QTD_STUB_RECORDINGS', 'recordings')))
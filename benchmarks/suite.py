@@ -0,0 +1,234 @@
+"""
+Benchmark suite
+
+Runs the micro-benchmarks offline and compares them to a JSON baseline:
+-parse: ExifTool output parsers (see parse_output)
+-extract: EXIFExtractor.extract_data over synthetic videos, ExifTool being
+replaced with the stub replaying recorded output (see stub_exiftool)
+-line: line building of insert_line, legacy WKT string against the
+EWKB parameters (DBPacker.line_rows)
+-insert: point insertion paths (see insert_points), only if Database
+credentials of a locally started PostgreSQL/PostGIS are given
+
+Rates (higher is better) dropping below the baseline by more than the
+threshold fail the run (exit code 1). --save stores the results as the
+new baseline:
+
+python -m benchmarks.suite --save
+python -m benchmarks.suite --threshold 0.15 --db benchmarks --credentials ***
+
+--profile (or 'Profiling' setting) profiles the run (see lib.profiler).
+Rates are lower then, hence profiled results are never saved as the baseline
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from lib.exiftool_session import ExifToolSession
+from benchmarks.synthetic import synthetic_track, write_mp4
+
+
+class StubSession(ExifToolSession):
+    """
+    ExifTool session running the stub (see stub_exiftool) with
+    the current interpreter instead of the ExifTool executable
+    """
+    def __init__(self, recordings: str) -> None:
+        """Session's constructor method
+        :param recordings: (str) recordings directory"""
+        super().__init__(exe_path=os.path.join(os.path.dirname(__file__), 'stub_exiftool.py'))
+        self.recordings = recordings
+
+    def start(self) -> None:
+        """Starts the stub in the -stay_open mode"""
+        self.process = subprocess.Popen(args=[sys.executable, self.exe_path,
+                                              '-stay_open', 'True', '-@', '-'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        env=dict(os.environ,
+                                                 QTD_STUB_RECORDINGS=self.recordings))
+        self.counter = 0
+
+
+def best_rate(amount: int, action, repeat: int) -> float:
+    """Times the action, best of the repeats
+    :param amount: (int) amount of processed units per action's call
+    :param action: (callable) timed action
+    :param repeat: (int) amount of repeats
+    :return: (float) units/second"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    return amount / min(timings)
+
+
+def parse_target(points: int, repeat: int) -> dict:
+    """Parsers' points/second"""
+    from benchmarks import parse_output
+
+    return {f"parse/{name}": rate
+            for name, rate in parse_output.run(points, repeat).items()}
+
+
+def extract_target(videos: int, points: int, repeat: int) -> dict:
+    """Extractor's videos/second per ExifTool output format, via the stub"""
+    from lib.exif_extractor import EXIFExtractor
+    from benchmarks.parse_output import render
+    from benchmarks.stub_exiftool import write_recordings
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        recordings = os.path.join(root, 'recordings')
+        extractors = []
+        for index in range(videos):
+            folder = os.path.join(root, f"video_{index}")
+            os.makedirs(folder)
+            track = synthetic_track(points, seed=index)
+            write_mp4(os.path.join(folder, 'origin_6_lrv.mp4'), track[:1], datetime(2024, 5, 1))
+            outputs = render(track, '2024:05:01 10:20:30')
+            write_recordings(recordings, f"video_{index}",
+                             {'json': outputs['json'], 'numeric': outputs['numeric']})
+            extractors.append(EXIFExtractor(input_path=folder))
+
+        with StubSession(recordings) as session:
+            for output in ['json', 'numeric']:
+                for extractor in extractors:
+                    extractor.session = session
+                    extractor.cache = None  # Each repeat extracts again
+                    extractor.output_format = output
+
+                def extract_all() -> None:
+                    for extractor in extractors:
+                        extractor.extract_data()
+
+                results[f"extract/{output}"] = best_rate(videos, extract_all, repeat)
+    return results
+
+
+def line_target(points: int, repeat: int) -> dict:
+    """Line building's points/second: WKT string against EWKB parameters"""
+    from lib.db_packer import DBPacker
+    from lib.track import Track
+
+    packer = DBPacker(video='')
+    packer.line_tolerance = 0
+    packer.lod_tolerances = []
+    packer.parsed_data = Track.from_points(synthetic_track(points, seed=0))
+
+    def build_wkt() -> str:
+        """insert_line's former geometry string"""
+        geometry_string = ','.join([f"{longitude} {latitude}" for longitude, latitude
+                                    in zip(packer.parsed_data.longitudes.tolist(),
+                                           packer.parsed_data.latitudes.tolist())])
+        return f"LINESTRING({geometry_string})"
+
+    return {'line/wkt': best_rate(points, build_wkt, repeat),
+            'line/ewkb': best_rate(points, lambda: packer.line_rows('lines', 'VID'), repeat)}
+
+
+def insert_target(points: int, db_name: str, user: str, credentials: str) -> dict:
+    """Insertion paths' rows/second (see insert_points)"""
+    from benchmarks import insert_points
+
+    return {f"insert/{name}": rate for name, rate in
+            insert_points.run(db_name, user, credentials, points,
+                              'benchmark_suite_points').items()}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Compares results to the baseline
+    :param results: (dict) current rates per benchmark
+    :param baseline: (dict) baseline rates per benchmark
+    :param threshold: (float) tolerated relative slowdown, e.g. 0.2 for 20 %
+    :return: (list) tuples of benchmark name, baseline rate, current rate,
+    relative change (None if not in the baseline) and regression flag"""
+    rows = []
+    for name, rate in results.items():
+        reference = baseline.get(name)
+        change = (rate - reference) / reference if reference else None
+        rows.append((name, reference, rate, change,
+                     change is not None and change < -threshold))
+    return rows
+
+
+def run(arguments: argparse.Namespace) -> dict:
+    """Runs the selected targets
+    :return: (dict) rates per benchmark"""
+    results = {}
+    if 'parse' in arguments.targets:
+        results.update(parse_target(arguments.points, arguments.repeat))
+    if 'extract' in arguments.targets:
+        results.update(extract_target(arguments.videos, arguments.points // 10,
+                                      arguments.repeat))
+    if 'line' in arguments.targets:
+        results.update(line_target(arguments.points, arguments.repeat))
+    if 'insert' in arguments.targets and arguments.db:
+        results.update(insert_target(arguments.insert_points, arguments.db,
+                                     arguments.user, arguments.credentials))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--targets', nargs='+', default=['parse', 'extract', 'line', 'insert'],
+                        choices=['parse', 'extract', 'line', 'insert'])
+    parser.add_argument('--baseline', default=os.path.join('benchmarks', 'baseline.json'))
+    parser.add_argument('--save', action='store_true', help="store results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="tolerated relative slowdown. 0.2 by default")
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--videos', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--db', help="Database of a local PostgreSQL/PostGIS (insert target)")
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--credentials', default=os.environ.get('PGPASSWORD'))
+    parser.add_argument('--insert-points', type=int, default=5000)
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the run (see lib.profiler)")
+    arguments = parser.parse_args()
+
+    import contextlib
+    from lib.profiler import IngestProfiler
+    from lib.settings_reader import Reader
+
+    profiler = IngestProfiler.from_settings(
+        Reader().get_settings(), enabled=arguments.profile, label='suite',
+        inputs=arguments.targets,
+        parameters={key: value for key, value in vars(arguments).items()
+                    if key != 'credentials'})
+    with profiler or contextlib.nullcontext():
+        results = run(arguments)
+    if profiler:
+        print(f"Profile written to {', '.join(profiler.paths)}")
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    rows = compare(results, baseline, arguments.threshold)
+    for name, reference, rate, change, regressed in rows:
+        reference = f"{reference:,.0f}" if reference else '-'
+        change = f"{change:+.1%}" if change is not None else 'new'
+        print(f"{name:>30}: {rate:>14,.0f} /s (baseline {reference}, {change})"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    if arguments.save and profiler:
+        print("Profiled results are not saved as the baseline")
+    elif arguments.save:
+        with open(arguments.baseline, 'w') as baseline_file:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': dict(baseline, **results)}, baseline_file, indent=2)
+        print(f"Baseline saved to {arguments.baseline}")
+    sys.exit(1 if any(row[4] for row in rows) else 0)
@@ -0,0 +1,95 @@
+"""
+Synthetic Insta360-style data generator
+
+Generates random-walk GPS tracks and writes minimal MP4 files carrying
+them as a camera motion metadata ('camm', type 6) track, so extraction
+can be exercised without real footage
+
+© 2024 Kirill Romashchenko
+"""
+import random
+import struct
+from datetime import datetime
+
+
+def synthetic_track(count: int, seed: int=None,
+                    origin: tuple=(37.61729900, 55.75582600, 150.0)) -> list:
+    """Generates a random walk resembling an Insta360 GPS track
+    (roughly walking speed at 1 Hz)
+    :param count: (int) amount of points
+    :param seed: (int) random seed. None by default
+    :param origin: (tuple) starting longitude, latitude and altitude
+    :return: (list) nested lists of longitude, latitude and altitude"""
+    generator = random.Random(seed)
+    longitude, latitude, altitude = origin
+    track = []
+    for _ in range(count):
+        longitude += generator.uniform(-0.00002, 0.00002)
+        latitude += generator.uniform(-0.00002, 0.00002)
+        altitude += generator.uniform(-0.5, 0.5)
+        track.append([round(longitude, 8), round(latitude, 8), round(altitude, 1)])
+    return track
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    """Wraps payload into an MP4 box"""
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes, version: int=0) -> bytes:
+    """Wraps payload into an MP4 full box (version and flags)"""
+    return box(box_type, struct.pack('>I', version << 24) + payload)
+
+
+def build_mp4(track: list, create_date: datetime, padding: int=0) -> bytes:
+    """Builds a minimal MP4 with a single camm track, one GPS sample per chunk
+    :param track: (list) nested lists of longitude, latitude and altitude
+    :param create_date: (datetime) movie header's creation time
+    :param padding: (int) extra mdat bytes standing in for the video payload
+    :return: (bytes) file's content"""
+    # camm type 6 layout: reserved, type, time, fix type (3D), latitude, longitude,
+    # altitude (float32), accuracies and velocities
+    samples = [struct.pack('<HHdiddf6f', 0, 6, float(i), 3, point[1], point[0],
+                           point[2], 0, 0, 0, 0, 0, 0)
+               for i, point in enumerate(track)]
+    return build_camm_mp4(samples, create_date, padding)
+
+
+def build_camm_mp4(samples: list, create_date: datetime, padding: int=0) -> bytes:
+    """Builds a minimal MP4 with a single camm track of the given samples,
+    one sample per chunk, one second each
+    :param samples: (list) packed camm samples (bytes), all of the same size
+    :param create_date: (datetime) movie header's creation time
+    :param padding: (int) extra mdat bytes standing in for the video payload
+    :return: (bytes) file's content"""
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2mp41')
+    mdat_payload = b''.join(samples) + b'\x00' * padding
+    mdat = box(b'mdat', mdat_payload)
+    data_offset = len(ftyp) + 8
+
+    created = int((create_date - datetime(1904, 1, 1)).total_seconds())
+    mvhd = full_box(b'mvhd', struct.pack('>IIII', created, created, 1000,
+                                         len(samples) * 1000) + b'\x00' * 80)
+    sample_size = len(samples[0]) if samples else 0
+    stsd = full_box(b'stsd', struct.pack('>I', 1) +
+                    box(b'camm', b'\x00' * 6 + struct.pack('>H', 1)))
+    stsz = full_box(b'stsz', struct.pack('>II', sample_size, len(samples)))
+    stsc = full_box(b'stsc', struct.pack('>IIII', 1, 1, 1, 1))
+    stco = full_box(b'stco', struct.pack(f'>I{len(samples)}I', len(samples),
+                                         *[data_offset + i * sample_size
+                                           for i in range(len(samples))]))
+    stbl = box(b'stbl', stsd + stsz + stsc + stco)
+    hdlr = full_box(b'hdlr', b'\x00' * 4 + b'camm' + b'\x00' * 13)
+    trak = box(b'trak', box(b'mdia', hdlr + box(b'minf', stbl)))
+    moov = box(b'moov', mvhd + trak)
+    return ftyp + mdat + moov
+
+
+def write_mp4(path: str, track: list, create_date: datetime, padding: int=0) -> None:
+    """Writes a synthetic MP4 file
+    :param path: (str) output file's path
+    :param track: (list) nested lists of longitude, latitude and altitude
+    :param create_date: (datetime) movie header's creation time
+    :param padding: (int) extra mdat bytes standing in for the video payload"""
+    with open(path, 'wb') as video:
+        video.write(build_mp4(track, create_date, padding))
@@ -0,0 +1,145 @@
+"""
+Package's headless entry point
+
+Scans a root directory for target videos and ingests them via the
+ingest pipeline. Does not import any GUI dependency, hence starts
+quickly on servers without a display:
+
+python cli.py D://SampleData --db tracks2024 --tables track_points track_lines
+
+© 2024 Kirill Romashchenko
+"""
+import argparse
+import contextlib
+import os
+import sys
+
+
+def scan_folders(root: str, filename: str) -> list:
+    """Recursively finds folders containing the target video
+    :param root: (str) root directory
+    :param filename: (str) target video's file name
+    :return: (list) sorted absolute paths to the matching folders"""
+    folders = []
+    for folder, _, files in os.walk(root):
+        if filename in files:
+            folders.append(os.path.abspath(folder).replace('\\', '/'))
+    return sorted(folders)
+
+
+def parse_arguments(argv: list, settings: dict) -> argparse.Namespace:
+    """Parses command line arguments. Defaults are read from settings
+    :param argv: (list) command line arguments
+    :param settings: (dict) settings dictionary
+    :return: (argparse.Namespace) parsed arguments"""
+    parser = argparse.ArgumentParser(description="Headless QuickTime Data to PostGIS ingest")
+    parser.add_argument('root', help="root directory to scan for target videos")
+    parser.add_argument('--db', required=True, help="target Database name")
+    parser.add_argument('--new', action='store_true',
+                        help="create a new Database (and tables) instead of appending")
+    parser.add_argument('--user', default=settings["Default user"])
+    parser.add_argument('--credentials', default=os.environ.get('PGPASSWORD'),
+                        help="user's password. PGPASSWORD environment variable by default")
+    parser.add_argument('--geometry', choices=['Point', 'Line', 'Both'], default='Both')
+    parser.add_argument('--tables', nargs='+', default=settings["Default table names"],
+                        help="one or two target table names, depending on the geometry")
+    parser.add_argument('--filename', default=settings["Default filename"],
+                        help="target video's file name")
+    parser.add_argument('--extract-workers', type=int,
+                        default=settings.get("Extraction workers", 4))
+    parser.add_argument('--write-workers', type=int,
+                        default=settings.get("Database writers", 2))
+    parser.add_argument('--queue-size', type=int,
+                        default=settings.get("Pipeline queue size", 8))
+    parser.add_argument('--engine', choices=['threads', 'asyncio'],
+                        default=settings.get("Ingest engine", "threads"),
+                        help="run the batch on worker threads or on a single asyncio event loop")
+    parser.add_argument('--batch-size', type=int,
+                        default=settings.get("ExifTool batch size", 1),
+                        help="videos per ExifTool command (threads engine, no streaming)")
+    parser.add_argument('--processes', action='store_true',
+                        help="extract in worker processes instead of threads")
+    parser.add_argument('--reingest', action='store_true',
+                        help="ingest videos again even if they're recorded in the manifest")
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction,
+                        default=settings.get("Streaming extraction", False),
+                        help="copy points to the Database chunk by chunk while extracting")
+    parser.add_argument('--defer-indexes', action=argparse.BooleanOptionalAction,
+                        default=settings.get("Defer index maintenance", False),
+                        help="drop indexes before the batch and rebuild them after it")
+    parser.add_argument('--verbose', action='store_true',
+                        help="print a line per processed video")
+    parser.add_argument('--profile', action=argparse.BooleanOptionalAction,
+                        default=settings.get("Profiling", False),
+                        help="profile the run (cProfile, sampled stacks, allocations)")
+    arguments = parser.parse_args(argv)
+
+    expected = 2 if arguments.geometry == 'Both' else 1  # Point and line tables
+    if arguments.tables == settings["Default table names"]:  # Not set, defaults are trimmed
+        arguments.tables = arguments.tables[:expected]
+    if len(arguments.tables) != expected:
+        parser.error(f"--geometry {arguments.geometry} takes {expected} table "
+                     f"name{'s' if expected > 1 else ''}, {len(arguments.tables)} given")
+    return arguments
+
+
+def main(argv: list=None) -> int:
+    """Runs headless ingest
+    :param argv: (list) command line arguments. None (sys.argv) by default
+    :return: (int) exit code, 1 if any video failed"""
+    from lib.settings_reader import Reader
+    from lib.ingest_pipeline import IngestPipeline
+    from lib.async_pipeline import AsyncIngestPipeline
+    from lib.profiler import IngestProfiler
+
+    settings = Reader().get_settings()
+    arguments = parse_arguments(argv, settings)
+    folders = scan_folders(arguments.root, arguments.filename)
+    print(f"Found {len(folders)} videos in {arguments.root}")
+    if not folders:
+        return 0
+
+    def on_event(event: str, video: str, detail) -> None:
+        """Prints processing events"""
+        if event == 'failed':
+            print(f"FAILED {video}: {detail}", file=sys.stderr)
+        elif event in ['prepared', 'indexed']:
+            print(detail)
+        elif event == 'written' and arguments.verbose:
+            print(f"{video}: {', '.join(detail)}")
+        elif event == 'skipped' and arguments.verbose:
+            print(f"{video}: already ingested, skipped")
+
+    pipeline_class = AsyncIngestPipeline if arguments.engine == 'asyncio' else IngestPipeline
+    pipeline = pipeline_class(db_name=arguments.db,
+                              user=arguments.user,
+                              credentials=arguments.credentials,
+                              table_names=arguments.tables,
+                              geometry=arguments.geometry,
+                              extract_workers=arguments.extract_workers,
+                              write_workers=arguments.write_workers,
+                              queue_size=arguments.queue_size,
+                              processes=arguments.processes,
+                              skip_ingested=not arguments.reingest and
+                              settings.get("Skip ingested videos", True),
+                              streaming=arguments.stream,
+                              defer_indexes=arguments.defer_indexes,
+                              batch_size=arguments.batch_size,
+                              on_event=on_event)
+    profiler = IngestProfiler.from_settings(settings, enabled=arguments.profile,
+                                            label='cli', inputs=folders,
+                                            parameters={key: value for key, value
+                                                        in vars(arguments).items()
+                                                        if key != 'credentials'})
+    with profiler or contextlib.nullcontext():
+        report = pipeline.run(videos=[(folder, None) for folder in folders],
+                              new=arguments.new)
+    for line in pipeline.summary():
+        print(line)
+    if profiler:
+        print(f"Profile written to {', '.join(profiler.paths)}")
+    return 1 if report['failures'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
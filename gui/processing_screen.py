@@ -9,12 +9,14 @@ Controls all processing operations:
 
 © 2024 Kirill Romashchenko
 """
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import *
 from PIL import ImageTk, Image
 import ttkbootstrap as ttk
 import customtkinter as ctk
-from typing import Union
 from qtd_to_postgis.lib.settings_reader import Reader
 from qtd_to_postgis.lib.db_connector import DBConnector
 
@@ -87,6 +89,13 @@ class ProcessingScreen:
 
         self.console_box = None  # Console
         self.launch_button = None
+        self.controls_Frame = None
+        self.pause_button = None
+        self.cancel_button = None
+
+        self.pipeline = None  # Background processing
+        self.events = None
+        self.progress = {}
 
         self.all_aliasses = []  # Processing related
         self.packed_input = []
@@ -302,13 +311,30 @@ class ProcessingScreen:
                                          height=420,
                                          fg_color="#121212",
                                          corner_radius=0)
-        self.launch_button = ctk.CTkButton(self.console_Frame,
+        self.controls_Frame = ctk.CTkFrame(master=self.console_Frame,
+                                           fg_color="#121212",
+                                           corner_radius=0)
+        self.launch_button = ctk.CTkButton(self.controls_Frame,
                                                text="Launch processing",
                                                font=('Corbel', 18),
                                                fg_color="#f2b60f",
                                                text_color="#000000",
                                                corner_radius=0,
                                            command=lambda: self.launch_processing())
+        self.pause_button = ctk.CTkButton(self.controls_Frame,
+                                          text="Pause",
+                                          width=70,
+                                          font=('Corbel', 18),
+                                          corner_radius=0,
+                                          state='disabled',
+                                          command=lambda: self.pause_processing())
+        self.cancel_button = ctk.CTkButton(self.controls_Frame,
+                                           text="Cancel",
+                                           width=70,
+                                           font=('Corbel', 18),
+                                           corner_radius=0,
+                                           state='disabled',
+                                           command=lambda: self.cancel_processing())
         self.console_box = ctk.CTkTextbox(master=self.console_Frame,
                                           width=(int(self.dimensions[0]/2)-2),
                                           height=382,
@@ -320,7 +346,10 @@ class ProcessingScreen:
                                           activate_scrollbars=False)
         self.console_box.bind("<Button-3>",
                               command=lambda event: self.console_rmb_menu(event))
-        self.launch_button.grid(row=0, column=0, padx=135, sticky='w')
+        self.launch_button.grid(row=0, column=0, padx=(50, 5))
+        self.pause_button.grid(row=0, column=1, padx=5)
+        self.cancel_button.grid(row=0, column=2, padx=5)
+        self.controls_Frame.grid(row=0, column=0, sticky='w')
         self.console_box.grid(row=1, column=0, sticky="sw")
         self.console_Frame.grid_propagate(0)
         self.console_Frame.grid(row=4, column=0, sticky='nsew')
@@ -500,13 +529,15 @@ class ProcessingScreen:
             self.db_combo_box.grid(row=0, column=1, sticky='ew', padx=35)
             connector_instance = DBConnector(db_name="postgres",
                                              user=self.credentials[0],
-                                             credentials=self.credentials[1])
+                                             credentials=self.credentials[1],
+                                             pooled=True)
             exising_dbs = connector_instance.list_data(structure="databases")
             self.db_combo_box.configure(values=exising_dbs)
 
             connector_instance = DBConnector(db_name=self.existing_db_name.get(),
                                              user=self.credentials[0],
-                                             credentials=self.credentials[1])
+                                             credentials=self.credentials[1],
+                                             pooled=bool(self.existing_db_name.get()))
             tables = connector_instance.list_data(structure="tables")
 
             counter = 0
@@ -552,7 +583,17 @@ class ProcessingScreen:
         selected_db = self.existing_db_name.get()
         connector_instance = DBConnector(db_name=selected_db,
                                         user=self.credentials[0],
-                                        credentials=self.credentials[1])
+                                        credentials=self.credentials[1],
+                                        pooled=True)
+        # Rows are routed by the partitioned parent, partitions aren't valid targets
+        partitions = connector_instance.list_data(structure="partitions") or []
+        selected_tables = {"Point": [self.point_table_combobox.get()],
+                           "Line": [self.line_table_combobox.get()],
+                           "Both": [self.point_table_combobox.get(),
+                                    self.line_table_combobox.get()]}[self.geometry_type.get()]
+        if any(table in partitions for table in selected_tables):
+            self.to_console("Partition selected, select its partitioned parent table instead")
+            return False
         if self.geometry_type.get() == "Point":
             table = self.point_table_combobox.get()
             columns_list = connector_instance.list_data(structure="columns", name=table)
@@ -602,9 +643,8 @@ class ProcessingScreen:
 
     def launch_processing(self) -> None:
         """Launches processing and controls the related logic"""
-        from lib.db_packer import DBPacker
-        from CTkMessagebox import CTkMessagebox
-        import sys
+        from lib.ingest_pipeline import IngestPipeline
+        from lib.async_pipeline import AsyncIngestPipeline
 
         if not self.input_folders:
             self.to_console('No input provided')
@@ -640,65 +680,87 @@ class ProcessingScreen:
             target_tables = [self.point_table_combobox.get(),
                              self.line_table_combobox.get()]
 
-        def console_messages(message: Union[str, tuple]) -> None:
-            """Prints informational message(s) to console,
-            followed by the separator
-            :param message: a string (or a tuple of strings) with
-            informational message(s)"""
-            self.to_console('Data extracted')
-            if self.geometry_type.get() == 'Both' or new_db or \
-                    (self.geometry_type.get() == 'Both' and new_db):
-                for statement in message:
-                    if type(statement) != tuple:
-                        self.to_console(statement)
-                    else:
-                        for substatement in statement:
-                            self.to_console(substatement)
-            else:
-                self.to_console(message)
-
-            self.to_console(separator=True, message='')
-
-        output_count = len(output)
-        if output_count < 2:
-            for video in output:
-                packer_instance = DBPacker(video=video[0])
-                message = packer_instance.pack_data(new=new_db,
-                                         db_name=target_db,
-                                         user=self.credentials[0],
-                                         credentials=self.credentials[1],
-                                         table_names=target_tables,
-                                         alias=video[1],
-                                         to_console=True,
-                                         verbose=False,
-                                         geometry=self.geometry_type.get())
-                console_messages(message=message)
-        elif output_count >= 2 and self.new_database_yn.get() == "New":
-            initial_folder = output[0]
-            packer_instance = DBPacker(video=initial_folder[0])
-            message = packer_instance.pack_data(new=True,
-                                                db_name=target_db,
-                                                user=self.credentials[0],
-                                                credentials=self.credentials[1],
-                                                alias=initial_folder[1],
-                                                table_names=target_tables,
-                                                to_console=True,
-                                                verbose=False,
-                                                geometry=self.geometry_type.get())
-            console_messages(message=message)
-
-            for video in output[1:]:
-                packer_instance = DBPacker(video=video[0])
-                message = packer_instance.pack_data(new=False,
-                                                    db_name=target_db,
-                                                    user=self.credentials[0],
-                                                    credentials=self.credentials[1],
-                                                    table_names=target_tables,
-                                                    alias=video[1],
-                                                    to_console=True,
-                                                    verbose=False,
-                                                    geometry=self.geometry_type.get())
-                console_messages(message=message)
+        self.events = queue.Queue()
+        pipeline_class = AsyncIngestPipeline\
+            if self.settings.get("Ingest engine", "threads") == "asyncio" else IngestPipeline
+        self.pipeline = pipeline_class(db_name=target_db,
+                                       user=self.credentials[0],
+                                       credentials=self.credentials[1],
+                                       table_names=target_tables,
+                                       geometry=self.geometry_type.get(),
+                                       extract_workers=self.settings.get("Extraction workers", 4),
+                                       write_workers=self.settings.get("Database writers", 2),
+                                       queue_size=self.settings.get("Pipeline queue size", 8),
+                                       skip_ingested=self.settings.get("Skip ingested videos", True),
+                                       streaming=self.settings.get("Streaming extraction", False),
+                                       defer_indexes=self.settings.get("Defer index maintenance", False),
+                                       batch_size=self.settings.get("ExifTool batch size", 1),
+                                       on_event=lambda *event: self.events.put(event))
+        self.progress = {'total': len(output), 'done': 0, 'started': time.perf_counter()}
+
+        def run_pipeline(pipeline, videos: list, new: bool) -> None:
+            """Runs the pipeline in the background thread and reports its outcome"""
+            try:
+                pipeline.run(videos=videos, new=new)
+                self.events.put(('finished', '', None))
+            except Exception as error:
+                self.events.put(('finished', '', repr(error)))
+
+        self.launch_button.configure(state='disabled')
+        self.pause_button.configure(state='normal', text='Pause')
+        self.cancel_button.configure(state='normal')
+        threading.Thread(target=run_pipeline, args=(self.pipeline, output, new_db),
+                         daemon=True).start()
+        self.master.after(100, self.drain_events)
+
+    def drain_events(self) -> None:
+        """Prints pending processing events to console. Reschedules itself
+        via after() until the background processing is finished"""
+        import os
+        import sys
+        from CTkMessagebox import CTkMessagebox
+
+        finished = None
+        while True:
+            try:
+                event, video, detail = self.events.get_nowait()
+            except queue.Empty:
+                break
+            name = os.path.basename(video)
+            if event in ['prepared', 'indexed']:
+                self.to_console(detail)
+            elif event == 'started':
+                self.to_console(f"{name}: started")
+            elif event == 'extracted':
+                self.to_console(f"{name}: {detail} points extracted")
+            elif event in ['written', 'failed']:
+                if event == 'written':
+                    for statement in detail:
+                        self.to_console(f"{name}: {statement}")
+                else:
+                    self.to_console(f"{name} failed: {detail}")
+                self.progress['done'] += 1
+                self.to_console(self.progress_message())
+                self.to_console(separator=True, message='')
+            elif event == 'skipped':
+                self.progress['done'] += 1
+                self.to_console(f"{name}: already ingested, skipped")
+            elif event == 'cancelled':
+                self.to_console(f"{name}: skipped")
+            elif event == 'finished':
+                finished = (detail,)
+
+        if not finished:
+            self.master.after(100, self.drain_events)
+            return
+
+        if finished[0]:
+            self.to_console(f"Processing failed: {finished[0]}")
+        for line in self.pipeline.summary():
+            self.to_console(line)
+        self.launch_button.configure(state='normal')
+        self.pause_button.configure(state='disabled', text='Pause')
+        self.cancel_button.configure(state='disabled')
 
         message_box = CTkMessagebox(message="Processing complete",
                                 icon="check",
@@ -712,6 +774,36 @@ class ProcessingScreen:
         elif response == 'Continue processing':
             message_box.destroy()
 
+    def progress_message(self) -> str:
+        """Formats batch progress with elapsed time and ETA
+        :return: (str) progress message"""
+        done, total = self.progress['done'], self.progress['total']
+        elapsed = time.perf_counter() - self.progress['started']
+        eta = elapsed / done * (total - done) if done else 0
+        return f"{done}/{total} done, {elapsed:.0f} s elapsed, ETA {eta:.0f} s"
+
+    def pause_processing(self) -> None:
+        """Pauses/resumes background processing between videos"""
+        if not self.pipeline:
+            return
+        if self.pipeline.resumed.is_set():
+            self.pipeline.pause()
+            self.pause_button.configure(text='Resume')
+            self.to_console('Pausing after the current video(s)')
+        else:
+            self.pipeline.resume()
+            self.pause_button.configure(text='Pause')
+            self.to_console('Processing resumed')
+
+    def cancel_processing(self) -> None:
+        """Cancels background processing after the current video(s)"""
+        if not self.pipeline:
+            return
+        self.pipeline.cancel()
+        self.pause_button.configure(state='disabled', text='Pause')
+        self.cancel_button.configure(state='disabled')
+        self.to_console('Cancelling after the current video(s)')
+
     def verify_input(self) -> bool:
         """Verifies input folders in terms of containing target videos
         (default is set to "origin_6_lrv.mp4" in the settings).
@@ -0,0 +1,365 @@
+"""
+Async PostGIS Database Packer module
+
+asyncio counterpart of the packing path. Extraction (ExifTool's stay_open
+session and parsing) runs in threads and the extracted data is written via
+psycopg's AsyncConnection, hence many videos overlap on the event loop: while
+some of them are being extracted, others wait for Postgres. Concurrency is
+bounded by the extraction and writing semaphores shared by the packers of a batch.
+Event loops are run by run_loop, which picks a loop psycopg supports on Windows
+
+© 2024 Kirill Romashchenko
+"""
+import asyncio
+import contextlib
+import sys
+import time
+import psycopg
+from typing import Union
+from lib.db_connector import DBConnector
+from lib.db_packer import DBPacker
+from lib.metrics import Metrics
+
+class AsyncDBPacker(DBPacker):
+    """
+    Async packer class. Class instance extracts and inserts a single video
+    without blocking the event loop. Queries, COPY rows and lines are built
+    by the DBPacker's methods, only the I/O is asynchronous.
+    pack_data_async method performs module's functionality
+    """
+    @staticmethod
+    def run_loop(coroutine):
+        """Runs the coroutine on a new event loop, like asyncio.run. psycopg's
+        asynchronous connections don't work on Windows' default (Proactor) loop,
+        hence a selector loop is used there. Nothing else needs the Proactor loop,
+        ExifTool being run in threads (see extract_data_async)
+        :param coroutine: (coroutine) coroutine to run
+        :return: coroutine's result"""
+        if sys.platform != 'win32':
+            return asyncio.run(coroutine)
+        if sys.version_info >= (3, 11):
+            with asyncio.Runner(loop_factory=asyncio.SelectorEventLoop) as runner:
+                return runner.run(coroutine)
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        return asyncio.run(coroutine)
+
+    async def extract_data_async(self, session=None) -> None:
+        """Extracts video's spatial data and creation date (see extract_data) in
+        a thread, hence neither ExifTool's output nor its parsing blocks the event
+        loop, and the track cache is used like in extract_data. Context variables
+        (the measured video) are passed to the thread
+        :param session: (ExifToolSession) ExifTool session to extract with, e.g.
+        one of the pipeline's sessions. None by default. If no session provided,
+        the shared one is used (concurrent packers take turns on it then)"""
+        await asyncio.to_thread(self.extract_data, session)
+
+    @contextlib.asynccontextmanager
+    async def transaction_async(self, connection: psycopg.AsyncConnection):
+        """Transaction block of the video's writes (see transaction). Blocks nest,
+        the outermost block's commit is timed as the 'commit' stage
+        :param connection: (psycopg.AsyncConnection) Database connection"""
+        outermost = connection.info.transaction_status == psycopg.pq.TransactionStatus.IDLE
+        async with connection.transaction():
+            yield
+            committing = time.perf_counter()
+        if outermost:
+            self.metrics.record('commit', time.perf_counter() - committing)
+
+    async def create_columns_async(self, connection: psycopg.AsyncConnection,
+                                   table_names: list, geometry: str='Both') -> None:
+        """Creates target tables (see create_columns)
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_names: (list) a list with either one or two
+        target table names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default"""
+        async with connection.cursor() as cur:
+            with self.metrics.timer('create_tables'):
+                for query in self.schema_queries(table_names=table_names, geometry=geometry):
+                    await cur.execute(query)
+        with self.metrics.timer('commit'):
+            await connection.commit()
+        self.partition_strategies.pop((connection.info.dbname, self.schema, table_names[0]), None)
+
+    async def partition_strategy_async(self, connection: psycopg.AsyncConnection,
+                                       table_name: str) -> Union[str, None]:
+        """Reads point table's partitioning from the catalog (see partition_strategy).
+        Shares the cache with the synchronous packers
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_name: (str) point table's name
+        :return: (str) 'date', 'hash' or None for a regular table"""
+        key = (connection.info.dbname, self.schema, table_name)
+        if key not in self.partition_strategies:
+            async with connection.cursor() as cur:
+                await cur.execute(self.partition_catalog_query, (self.schema, table_name))
+                row = await cur.fetchone()
+            self.partition_strategies[key] = self.partition_keys.get(tuple(row)) if row else None
+        return self.partition_strategies[key]
+
+    async def route_points_async(self, connection: psycopg.AsyncConnection,
+                                 table_name: str) -> None:
+        """Prepares insertion into the point table (see route_points)
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_name: (str) point table's name"""
+        self.recorded_on = None
+        if await self.partition_strategy_async(connection, table_name) != 'date':
+            return
+        try:
+            with self.metrics.timer('create_partition'):
+                async with connection.transaction():
+                    async with connection.cursor() as cur:
+                        await cur.execute(self.partition_query(table_name=table_name))
+        except (psycopg.errors.DuplicateTable, psycopg.errors.InvalidObjectDefinition):
+            pass  # Created concurrently by another writer
+
+    async def insert_points_async(self, connection: psycopg.AsyncConnection,
+                                  table_name: str, alias: str=None,
+                                  verbose: bool=True, to_console: bool=False,
+                                  binary: bool=False) -> Union[str, None]:
+        """Inserts spatial data into the point table via a single COPY
+        (see insert_points)
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_name: (str) point table's name
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational message for to print to GUI's console.
+        False by default
+        :param binary: (bool) enables/disables binary COPY format. False by
+        default: the text payload is built in one pass, while binary rows are
+        dumped one by one by psycopg (see benchmarks.insert_points). Falls back
+        to the text format if the server rejects the binary representation"""
+        identifier = alias if alias else self.default_video_alias
+        await self.route_points_async(connection=connection, table_name=table_name)
+        try:
+            await self.copy_points_async(connection=connection, table_name=table_name,
+                                         identifier=identifier, binary=binary)
+        except psycopg.errors.InvalidBinaryRepresentation:
+            if not binary:
+                raise
+            await self.copy_points_async(connection=connection, table_name=table_name,
+                                         identifier=identifier, binary=False)
+
+        message = 'Point data inserted'
+        if verbose:
+            print(message)
+        if to_console:
+            return message
+
+    async def copy_points_async(self, connection: psycopg.AsyncConnection,
+                                table_name: str, identifier: str,
+                                binary: bool=False) -> None:
+        """Streams parsed points to the point table via COPY
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_name: (str) point table's name
+        :param identifier: (str) video identifier written to each row
+        :param binary: (bool) enables/disables binary COPY format.
+        False by default"""
+        async with self.transaction_async(connection):
+            with self.metrics.timer('copy_points'):
+                async with connection.cursor() as cur:
+                    async with cur.copy(self.copy_query(table_name, binary)) as copy:
+                        self.prepare_copy(copy=copy, binary=binary)
+                        if not binary:
+                            await copy.write(self.copy_payload(track=self.parsed_data,
+                                                               identifier=identifier))
+                        else:
+                            for row in self.copy_rows(track=self.parsed_data,
+                                                      identifier=identifier):
+                                await copy.write_row(row)
+
+    async def insert_line_async(self, connection: psycopg.AsyncConnection,
+                                table_name: str, alias: str=None,
+                                verbose: bool=True,
+                                to_console: bool=False) -> Union[str, None]:
+        """Inserts spatial data into the line table and the level
+        of detail line tables, if any (see insert_line)
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_name: (str) line table's name
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational message.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational message for to print to GUI's console.
+        False by default"""
+        identifier = alias if alias else self.default_video_alias
+        with self.metrics.timer('build_lines'):
+            rows = self.line_rows(table_name=table_name, identifier=identifier)
+        async with self.transaction_async(connection), connection.cursor() as cur:
+            if self.lod_tolerances:
+                with self.metrics.timer('create_lod_tables'):
+                    await cur.execute(self.lod_tables_query(line_table=table_name))
+            for query, parameters in rows:
+                with self.metrics.timer('insert_line'):
+                    await cur.execute(query, parameters)
+
+        message = 'Line data inserted'
+        if verbose:
+            print(message)
+        if to_console:
+            return message
+
+    async def insert_data_async(self, connection: psycopg.AsyncConnection,
+                                table_names: list, geometry: str='Both',
+                                alias: str=None, verbose: bool=True,
+                                to_console: bool=False,
+                                db_message: str=None) -> Union[str, tuple, None]:
+        """Inserts extracted data according to the geometry type. Return
+        values match the insert_data method's ones
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :param table_names: (list) a list with either one or two target table
+        names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational messages for to print to GUI's console.
+        False by default
+        :param db_message: (str) Database creation message to be returned
+        along with the insertion messages. None by default"""
+        messages = []
+        if geometry in ['Point', 'Both']:
+            messages.append(await self.insert_points_async(connection=connection,
+                                                           table_name=table_names[0],
+                                                           alias=alias, verbose=verbose,
+                                                           to_console=to_console))
+        if geometry in ['Line', 'Both']:
+            messages.append(await self.insert_line_async(
+                connection=connection,
+                table_name=table_names[0 if geometry == 'Line' else 1],
+                alias=alias, verbose=verbose, to_console=to_console))
+        if not to_console:
+            return None
+        messages = tuple(messages) if geometry == 'Both' else messages[0]
+        return (db_message, messages) if db_message else messages
+
+    async def pack_data_async(self, new: bool, db_name: str, user: str,
+                              credentials: str, table_names: list,
+                              geometry: str='Both', alias: str=None,
+                              verbose: bool=True, to_console: bool=False,
+                              skip_ingested: bool=False, pool=None,
+                              extract_limit: asyncio.Semaphore=None,
+                              write_limit: asyncio.Semaphore=None) -> Union[str, tuple, None]:
+        """Packs processed data to the Database (either new or the existing
+        one), see pack_data. Awaiting many packers at once (e.g. with
+        asyncio.gather) overlaps their extraction and insertion
+        :param new: (bool) flag, enables/disables new Database creation/appending
+        to the existing one
+        :param db_name: (str) Database name
+        :param user: (str) username
+        :param credentials: (str) user's password
+        :param table_names: (list) a list with either one or two target table
+        names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational messages for to print to GUI's console.
+        False by default
+        :param skip_ingested: (bool) enables/disables skipping of the video
+        if it's been ingested into the target tables already (see ingest
+        manifest). Ingested video is recorded to the manifest. False by default
+        :param pool: (psycopg_pool.AsyncConnectionPool) opened pool to check
+        the connection out of. None by default. If no pool provided,
+        a connection is opened for the video
+        :param extract_limit: (asyncio.Semaphore) semaphore bounding concurrent
+        extractions. None (unbounded) by default
+        :param write_limit: (asyncio.Semaphore) semaphore bounding concurrent
+        insertions. None (unbounded) by default"""
+        from lib.ingest_manifest import IngestManifest
+
+        # Measurements are attributed to the video, its record is exported once packed
+        with self.metrics.measure(self.video, status='written') as record:
+            connector = DBConnector(db_name=db_name, user=user, credentials=credentials,
+                                    autocommit=True)
+            manifest = IngestManifest(table_names=table_names) if skip_ingested else None
+            entry = await asyncio.to_thread(manifest.fingerprint, self.video)\
+                if manifest else None
+            if entry and not new:
+                async with self.connection(connector, pool) as connection:
+                    await manifest.create_table_async(connection=connection)
+                    ingested = await self.lookup_async(manifest, entry, connection)
+                if ingested:
+                    message = 'Video has been ingested already, skipped'
+                    if verbose:
+                        print(message)
+                    record['status'] = 'skipped'
+                    if to_console:
+                        return message
+                    return None
+
+            async with extract_limit or contextlib.nullcontext():
+                await self.extract_data_async()
+
+            db_message = None
+            if new:
+                postgres = await DBConnector(db_name='postgres', user=user,
+                                             credentials=credentials,
+                                             autocommit=True).connect_async()
+                async with postgres:
+                    await postgres.execute(f'CREATE DATABASE {db_name}')
+                db_message = f"{db_name} Database created"
+                if verbose:
+                    print(db_message)
+
+            async with write_limit or contextlib.nullcontext():
+                async with self.connection(connector, pool) as connection:
+                    if new:
+                        await self.create_columns_async(connection=connection,
+                                                        table_names=table_names,
+                                                        geometry=geometry)
+                        if entry:
+                            await manifest.create_table_async(connection=connection)
+                    # Points, lines and the manifest entry are committed at once
+                    async with self.transaction_async(connection):
+                        messages = await self.insert_data_async(connection=connection,
+                                                                table_names=table_names,
+                                                                geometry=geometry,
+                                                                alias=alias,
+                                                                verbose=verbose,
+                                                                to_console=to_console,
+                                                                db_message=db_message)
+                        if entry:
+                            entry['video'] = alias if alias else self.default_video_alias
+                            with self.metrics.timer('manifest_record'):
+                                await manifest.record_async(entries=[entry],
+                                                            connection=connection)
+            if entry and manifest.mirror_path:
+                await asyncio.to_thread(manifest.record, [entry])  # Local mirror
+            return messages
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def connection(connector: DBConnector, pool=None):
+        """Context-managed asynchronous connection. Checks connection out
+        of the pool (if provided), otherwise opens a new one
+        :param connector: (DBConnector) target Database's connector
+        :param pool: (psycopg_pool.AsyncConnectionPool) opened pool. None by default
+        :return: (psycopg.AsyncConnection) Database connection"""
+        if pool is not None:
+            started = time.perf_counter()
+            async with pool.connection() as connection:
+                Metrics.shared().record('pool_checkout', time.perf_counter() - started)
+                yield connection
+        else:
+            async with await connector.connect_async() as connection:
+                yield connection
+
+    @staticmethod
+    async def lookup_async(manifest, entry: dict,
+                           connection: psycopg.AsyncConnection) -> bool:
+        """Checks whether the video is recorded in the ingest manifest
+        :param manifest: (IngestManifest) target tables' manifest
+        :param entry: (dict) video's manifest entry
+        :param connection: (psycopg.AsyncConnection) Database connection
+        :return: (bool) True if the video has been ingested already"""
+        async with connection.cursor() as cur:
+            await cur.execute(f"""SELECT 1 FROM {manifest.schema}.{manifest.table_name}
+                                  WHERE target = %s AND fingerprint = %s;""",
+                              (manifest.target, entry['fingerprint']))
+            return await cur.fetchone() is not None
@@ -0,0 +1,217 @@
+"""
+Async ingest pipeline module
+
+Runs the ingest pipeline's batch with asyncio: each video is an AsyncDBPacker
+task, extraction (threads, each one on an ExifTool session of the pipeline) and
+writing (asynchronous connections of a shared pool) are bounded by semaphores and
+the amount of videos in flight is bounded as well, hence extracted tracks
+don't pile up in memory while waiting for the writers. Events, controls
+and reports match the threaded pipeline's ones
+
+© 2024 Kirill Romashchenko
+"""
+import asyncio
+import time
+import psycopg
+from typing import Union
+from lib.async_packer import AsyncDBPacker
+from lib.db_connector import DBConnector
+from lib.exiftool_session import ExifToolSession
+from lib.ingest_pipeline import IngestPipeline
+
+class AsyncIngestPipeline(IngestPipeline):
+    """
+    Async pipeline class. Class instance runs extraction and insertion
+    of a batch of videos concurrently on an event loop. extract_workers
+    and write_workers bound concurrent ExifTool sessions (stay_open processes
+    kept for the batch) and Database connections. Streaming extraction and
+    worker processes are not used
+    """
+    def __init__(self, db_name: str, user: str, credentials: str,
+                 table_names: list, geometry: str='Both',
+                 extract_workers: int=8, write_workers: int=4,
+                 queue_size: int=8, processes: bool=False,
+                 skip_ingested: bool=False, streaming: bool=False,
+                 defer_indexes: bool=False, batch_size: int=1,
+                 on_event=None) -> None:
+        """Pipeline's constructor method. Parameters match IngestPipeline's ones,
+        hence either pipeline can be instantiated by the same caller
+        :param extract_workers: (int) amount of concurrent extractions. 8 by default
+        :param write_workers: (int) amount of concurrent insertions (i.e. pooled
+        connections). 4 by default
+        :param queue_size: (int) amount of extracted videos waiting for
+        a writer. 8 by default
+        :param processes: (bool) ignored, extraction runs in threads
+        :param streaming: (bool) ignored, tracks are extracted whole
+        :param batch_size: (int) ignored, each video is a task of its own
+        :param on_event: (callable) callback receiving (event, video, detail).
+        Called from the event loop's thread. None by default"""
+        super().__init__(db_name=db_name, user=user, credentials=credentials,
+                         table_names=table_names, geometry=geometry,
+                         extract_workers=extract_workers, write_workers=write_workers,
+                         queue_size=queue_size, processes=False,
+                         skip_ingested=skip_ingested, streaming=False,
+                         defer_indexes=defer_indexes, on_event=on_event)
+
+    def run(self, videos: list, new: bool=False) -> dict:
+        """Processes a batch of videos on a new event loop (see
+        AsyncDBPacker.run_loop). Blocks until the batch is complete
+        :param videos: (list) tuples of video's folder and alias (None for
+        the default alias)
+        :param new: (bool) flag, enables/disables new Database creation. False by default
+        :return: (dict) per-stage throughput report"""
+        return AsyncDBPacker.run_loop(self.run_async(videos=videos, new=new))
+
+    async def run_async(self, videos: list, new: bool=False) -> dict:
+        """Processes a batch of videos on the running event loop
+        :param videos: (list) tuples of video's folder and alias
+        :param new: (bool) flag, enables/disables new Database creation. False by default
+        :return: (dict) per-stage throughput report"""
+        start = time.perf_counter()
+        self.metrics.reset()
+        # Batch set-up and tear-down are one-off, they run on the synchronous connections
+        for message in await asyncio.to_thread(self.prepare, new):
+            self.emit('prepared', '', message)
+        if self.manifest and not new:
+            videos = await asyncio.to_thread(self.filter_ingested, videos)
+        if self.defer_indexes and videos:
+            await asyncio.to_thread(self.drop_indexes)
+
+        extract_limit = asyncio.Semaphore(self.extract_workers)
+        write_limit = asyncio.Semaphore(self.write_workers)
+        in_flight = asyncio.Semaphore(self.extract_workers + self.queue_size
+                                      + self.write_workers)
+        # A session per concurrent extraction, checked out by the extracting task
+        sessions = [ExifToolSession() for _ in range(self.extract_workers)]
+        connector = DBConnector(db_name=self.db_name, user=self.user,
+                                credentials=self.credentials,
+                                max_size=self.write_workers)
+        try:
+            async with connector.async_pool() as pool:
+                outcomes = await asyncio.gather(*(self.process(video=video, alias=alias,
+                                                               pool=pool,
+                                                               sessions=sessions,
+                                                               extract_limit=extract_limit,
+                                                               write_limit=write_limit,
+                                                               in_flight=in_flight)
+                                                  for video, alias in videos),
+                                                return_exceptions=True)
+            # Errors escaping a video's task (e.g. raised by the event callback)
+            # are its failures, they neither cancel nor hide the other videos
+            failed = {video for video, _ in self.failures}
+            for (video, _), outcome in zip(videos, outcomes):
+                if isinstance(outcome, Exception) and video not in failed:
+                    self.failures.append((video, repr(outcome)))
+        finally:
+            for session in sessions:
+                await asyncio.to_thread(session.close)
+            if self.defer_indexes and videos:
+                await asyncio.to_thread(self.rebuild_indexes)
+
+        self.wall_time = time.perf_counter() - start
+        return self.report()
+
+    async def proceed_async(self) -> bool:
+        """Waits while the run is paused, without blocking the event loop
+        :return: (bool) False if the run has been cancelled"""
+        while not self.resumed.is_set():
+            await asyncio.sleep(0.1)
+        return not self.cancelled.is_set()
+
+    async def process(self, video: str, alias: str, pool, sessions: list,
+                      extract_limit: asyncio.Semaphore,
+                      write_limit: asyncio.Semaphore,
+                      in_flight: asyncio.Semaphore) -> None:
+        """Extracts and inserts a single video
+        :param video: (str) video's folder
+        :param alias: (str) video's alias, None for the default one
+        :param pool: (psycopg_pool.AsyncConnectionPool) writers' connection pool
+        :param sessions: (list) idle ExifTool sessions, one per concurrent extraction
+        :param extract_limit: (asyncio.Semaphore) concurrent extractions' bound
+        :param write_limit: (asyncio.Semaphore) concurrent insertions' bound
+        :param in_flight: (asyncio.Semaphore) bound of the videos being processed"""
+        async with in_flight:
+            if not await self.proceed_async():
+                self.emit('cancelled', video)
+                return
+            # Each video is a task of its own, hence the measured video is task-local
+            with self.metrics.measure(video) as record:
+                record['status'] = await self.pack(video=video, alias=alias, pool=pool,
+                                                   sessions=sessions,
+                                                   extract_limit=extract_limit,
+                                                   write_limit=write_limit)
+
+    async def pack(self, video: str, alias: str, pool, sessions: list,
+                   extract_limit: asyncio.Semaphore,
+                   write_limit: asyncio.Semaphore) -> str:
+        """Extracts and inserts a single video, see process
+        :param video: (str) video's folder
+        :param alias: (str) video's alias, None for the default one
+        :param pool: (psycopg_pool.AsyncConnectionPool) writers' connection pool
+        :param sessions: (list) idle ExifTool sessions, one per concurrent extraction
+        :param extract_limit: (asyncio.Semaphore) concurrent extractions' bound
+        :param write_limit: (asyncio.Semaphore) concurrent insertions' bound
+        :return: (str) video's status: 'written', 'failed' or 'cancelled'"""
+        packer = AsyncDBPacker(video=video, alias=alias)
+        async with extract_limit:
+            self.emit('started', video)
+            started = time.perf_counter()
+            session = sessions.pop()  # Semaphore's holders never run out of sessions
+            try:
+                await packer.extract_data_async(session=session)
+            except Exception as error:
+                self.extraction.record(0, time.perf_counter() - started, failed=True)
+                self.failures.append((video, repr(error)))
+                self.emit('failed', video, repr(error))
+                return 'failed'
+            finally:
+                sessions.append(session)
+        self.extraction.record(len(packer.parsed_data), time.perf_counter() - started)
+        self.emit('extracted', video, len(packer.parsed_data))
+
+        async with write_limit:
+            if not await self.proceed_async():
+                self.emit('cancelled', video)
+                return 'cancelled'
+            started = time.perf_counter()
+            status, points, detail, entry = 'failed', 0, None, None
+            try:
+                async with packer.connection(None, pool) as connection:
+                    # Points, lines and the manifest entry are committed at once
+                    async with packer.transaction_async(connection):
+                        messages = await packer.insert_data_async(
+                            connection=connection, table_names=self.table_names,
+                            geometry=self.geometry, alias=alias, verbose=False,
+                            to_console=True)
+                        if self.manifest:
+                            entry = await self.record_ingested_async(packer=packer,
+                                                                     connection=connection)
+                if entry and self.manifest.mirror_path:
+                    await asyncio.to_thread(self.manifest.record, [entry])  # Local mirror
+                points, status = len(packer.parsed_data), 'written'
+                detail = list(messages) if isinstance(messages, tuple) else [messages]
+            except Exception as error:
+                # Any failure is the video's one, the batch goes on (see write_loop)
+                detail = repr(error)
+                self.failures.append((video, detail))
+            finally:
+                self.writing.record(points, time.perf_counter() - started,
+                                    failed=status == 'failed')
+        self.emit(status, video, detail)
+        return status
+
+    async def record_ingested_async(self, packer: AsyncDBPacker,
+                                    connection: psycopg.AsyncConnection) -> Union[dict, None]:
+        """Records written video to the ingest manifest within the video's
+        transaction (see record_ingested)
+        :param packer: (AsyncDBPacker) packer holding video's data
+        :param connection: (psycopg.AsyncConnection) writer's connection
+        :return: (dict) recorded manifest entry or None if the video is not readable"""
+        entry = self.fingerprints.get(packer.video)\
+            or await asyncio.to_thread(self.manifest.fingerprint, packer.video)
+        if entry:
+            entry = dict(entry, video=packer.alias if packer.alias
+                         else packer.default_video_alias)
+            with self.metrics.timer('manifest_record'):
+                await self.manifest.record_async(entries=[entry], connection=connection)
+        return entry
@@ -5,28 +5,47 @@ Establishes connection with the target Database.
 Verifies PostGIS extension being enabled for the target Database.
 Enables PostGIS extension for the target Database.
 Retrieves list of existing Databases, tables and columns within them.
+Optionally reuses connections via a shared connection pool.
+Opens asynchronous connections and pools for the asyncio engine.
 
 © 2024 Kirill Romashchenko
 """
+import atexit
+import threading
+import time
 import psycopg
+from contextlib import contextmanager
 from typing import Union
+from lib.metrics import Metrics
 
 class DBConnector:
     """Database connector class. Establishes connection with the
     target Database. Verifies PostGIS extension being enabled
     for the target Database. Includes four core methods"""
+    _pools = {}  # Shared pools, one per connection parameters and pool sizes
+    _pools_lock = threading.Lock()
+
     def __init__(self, db_name: str, user: str, credentials: str,
-                 autocommit: bool=True) -> None:
+                 autocommit: bool=True, pooled: bool=False,
+                 min_size: int=1, max_size: int=4) -> None:
         """Coonector's constructor method
         :param db_name: (str) target Database name
         :param user: (str) username
         :param credentials: (str) user's password
         :param autocommit: (bool) enables/disables psycopg's
-        autocommit option. True by default"""
+        autocommit option. True by default
+        :param pooled: (bool) enables/disables checking connections out
+        of the shared connection pool (see connection method). False by default
+        :param min_size: (int) minimum amount of pooled connections. 1 by default
+        :param max_size: (int) maximum amount of pooled connections. 4 by default.
+        Connectors of different sizes don't share a pool"""
         self.db_name = db_name
         self.user = user
         self.credentials = credentials
         self.autocommit = autocommit
+        self.pooled = pooled
+        self.min_size = min_size
+        self.max_size = max_size
 
     def connect(self, verbose: bool=False)\
             -> psycopg.Connection:
@@ -34,12 +53,13 @@ class DBConnector:
         :param verbose: (bool) enables/disables informational
         messages being shown. False by default"""
         try:
-            connection = psycopg.connect(host="localhost",
-                                         port=5432,
-                                         dbname=self.db_name,
-                                         user=self.user,
-                                         password=self.credentials,
-                                         autocommit=self.autocommit)
+            with Metrics.shared().timer('connect'):
+                connection = psycopg.connect(host="localhost",
+                                             port=5432,
+                                             dbname=self.db_name,
+                                             user=self.user,
+                                             password=self.credentials,
+                                             autocommit=self.autocommit)
             if verbose:
                 print(f"Connected to {self.db_name}")
             return connection
@@ -47,12 +67,96 @@ class DBConnector:
             if verbose:
                 print(f"Failed to establish connection with {self.db_name} Database")
 
+    def pool(self):
+        """Returns the shared connection pool for the target Database,
+        creating it on the first call. Connectors differing in credentials,
+        autocommit mode or pool sizes get pools of their own. Pooled connections
+        are health-checked on checkout. Pools are closed at exit
+        :return: (psycopg_pool.ConnectionPool) connection pool"""
+        from psycopg_pool import ConnectionPool
+
+        key = (self.db_name, self.user, self.credentials, self.autocommit,
+               self.min_size, self.max_size)
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None or pool.closed:
+                pool = ConnectionPool(conninfo=self.conninfo(),
+                                      min_size=self.min_size,
+                                      max_size=max(self.min_size, self.max_size),
+                                      kwargs={'autocommit': self.autocommit},
+                                      check=ConnectionPool.check_connection,
+                                      timeout=10,
+                                      name=f"{self.db_name}_{self.user}",
+                                      open=True)
+                atexit.register(pool.close)
+                self._pools[key] = pool
+            return pool
+
+    def conninfo(self) -> str:
+        """Builds connection string of the target Database
+        :return: (str) libpq connection string"""
+        return psycopg.conninfo.make_conninfo(host="localhost",
+                                              port=5432,
+                                              dbname=self.db_name,
+                                              user=self.user,
+                                              password=self.credentials)
+
+    async def connect_async(self) -> psycopg.AsyncConnection:
+        """Establishes asynchronous connection with the target Database
+        :return: (psycopg.AsyncConnection) Database connection"""
+        with Metrics.shared().timer('connect'):
+            return await psycopg.AsyncConnection.connect(self.conninfo(),
+                                                         autocommit=self.autocommit)
+
+    def async_pool(self):
+        """Creates asynchronous connection pool for the target Database.
+        Unlike the shared pools, it's bound to the caller's event loop, hence
+        it's neither shared nor opened here: use it as an async context manager
+        :return: (psycopg_pool.AsyncConnectionPool) connection pool"""
+        from psycopg_pool import AsyncConnectionPool
+
+        return AsyncConnectionPool(conninfo=self.conninfo(),
+                                   min_size=self.min_size,
+                                   max_size=max(self.min_size, self.max_size),
+                                   kwargs={'autocommit': self.autocommit},
+                                   check=AsyncConnectionPool.check_connection,
+                                   timeout=10,
+                                   name=f"{self.db_name}_{self.user}_async",
+                                   open=False)
+
+    @classmethod
+    def close_pools(cls) -> None:
+        """Closes all shared connection pools"""
+        with cls._pools_lock:
+            while cls._pools:
+                cls._pools.popitem()[1].close()
+
+    @contextmanager
+    def connection(self):
+        """Context-managed connection. Checks connection out of the shared pool
+        (and returns it back on exit) in the pooled mode, otherwise opens
+        a new connection and closes it on exit. Checkouts are timed as the
+        'pool_checkout' stage, new connections as the 'connect' one
+        :return: (psycopg.Connection) Database connection"""
+        if self.pooled:
+            started = time.perf_counter()
+            with self.pool().connection() as connection:
+                Metrics.shared().record('pool_checkout', time.perf_counter() - started)
+                yield connection
+        else:
+            connection = self.connect()
+            if connection is None:
+                raise psycopg.OperationalError(f"Failed to establish connection"
+                                               f" with {self.db_name} Database")
+            with connection:
+                yield connection
+
     def check_postgis(self, verbose: bool=False) -> bool:
         """Verifies if PostGIS extension is enabled for the
         target Database. Returns either True of False depending on the result.
         :param verbose: (bool) enables/disables informational
         messages being shown. False by default"""
-        with self.connect() as connection:
+        with self.connection() as connection:
             with connection.cursor() as cur:
                 try:
                     cur.execute("""SELECT PostGIS_Full_Version();""")
@@ -72,7 +176,7 @@ class DBConnector:
         """Enables PostGIS extension for the target Database
         :param verbose: (bool) enables/disables informational
         messages being shown. False by default"""
-        with self.connect() as connection:
+        with self.connection() as connection:
             try:
                 with connection.cursor() as cur:
                     cur.execute("""CREATE EXTENSION postgis;""")
@@ -90,7 +194,8 @@ class DBConnector:
             -> Union[list, None]:
         """Returns a list of either:
         -existing Postgres Databases
-        -tables within Database
+        -tables within Database (partitions excluded, partitioned parents included)
+        -partitions within Database
         -columns within table
         :param structure: (str) a flag indicating what type of data should
         de retrieved
@@ -103,9 +208,17 @@ class DBConnector:
                 WHERE datistemplate = false;""",
             "tables": """
                 SELECT tablename
-                FROM pg_catalog.pg_tables
+                FROM pg_catalog.pg_tables t
+                JOIN pg_catalog.pg_class c ON c.relname = t.tablename
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                AND n.nspname = t.schemaname
                 WHERE schemaname != 'pg_catalog' AND 
-                schemaname != 'information_schema';""",
+                schemaname != 'information_schema' AND
+                NOT c.relispartition;""",
+            "partitions": """
+                SELECT c.relname
+                FROM pg_catalog.pg_class c
+                WHERE c.relispartition;""",
             "columns": f"""
                 SELECT column_name
                 FROM information_schema.columns
@@ -115,7 +228,7 @@ class DBConnector:
         query = queries[structure]
         output = []
 
-        with self.connect() as connection:
+        with self.connection() as connection:
             try:
                 with connection.cursor() as cur:
                     result = cur.execute(query)
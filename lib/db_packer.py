@@ -7,7 +7,11 @@ Spatial Database
 © 2024 Kirill Romashchenko
 """
 from lib.db_connector import DBConnector
+from lib.metrics import Metrics
+import itertools
+import time
 import psycopg
+from contextlib import closing, contextmanager
 from typing import Union
 
 class DBPacker:
@@ -16,6 +20,16 @@ class DBPacker:
     data into the target Postgres Database. Geometry type
     options are either/both points or polyline (Linestring)
     """
+    partition_strategies = {}  # Point tables' partitioning, cached per Database
+    partition_catalog_query = """
+                    SELECT p.partstrat, a.attname
+                    FROM pg_partitioned_table p
+                    JOIN pg_class c ON c.oid = p.partrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    JOIN pg_attribute a ON a.attrelid = p.partrelid
+                    AND a.attnum = p.partattrs[0]
+                    WHERE n.nspname = %s AND c.relname = %s;"""
+    partition_keys = {('r', 'recorded_on'): 'date', ('h', 'video'): 'hash'}
     def __init__(self, video: str,
                  alias: str=None) -> None:
         """Packer's constructor method.
@@ -29,7 +43,7 @@ class DBPacker:
 
         self.video = video
         self.alias = alias
-        self.parsed_data = None
+        self.parsed_data = None  # Track
         self.default_video_alias = None
 
         self.settings = Reader().get_settings()
@@ -39,12 +53,67 @@ class DBPacker:
         self.id_column_length = self.settings["Identifier field length"]
         self.coordinate_precision = self.settings['Coordinate precision']
         self.altitude_data_type = self.settings['Altitude data type']
+        self.extraction_engine = self.settings.get('Extraction engine', 'exiftool')
+        self.streaming = self.settings.get('Streaming extraction', False)
+        self.chunk_size = self.settings.get('Streaming chunk size', 10000)
+        self.line_tolerance = self.settings.get('Line simplification (m)', 0)
+        self.lod_tolerances = self.settings.get('Level of detail tolerances (m)', [])
+        self.rebuild_seconds = None  # Duration of the last index rebuild
+        self.prefix = self.settings["Default prefix"]
+        self.partitioning = self.settings.get('Point table partitioning')  # None, date or hash
+        self.hash_partitions = self.settings.get('Hash partitions', 8)
+        self.recorded_on = None  # Recording date of the date partitioned point table's rows
+        self.streamed_points = 0  # Points written by the last stream_points call
+        self.streamed_after = 0  # Point table's last id before the streaming
+        self.streamed_length = 0.0  # Ellipsoidal length (meters) of the streamed points
+        self.metrics = Metrics.shared()
 
-    def extract_data(self) -> None:
-        """Extract video's spatial data and creation date"""
-        from lib.exif_extractor import EXIFExtractor
-        (self.parsed_data,
-         self.default_video_alias) = EXIFExtractor(self.video).extract_data()
+    def extract_data(self, session=None) -> None:
+        """Extract video's spatial data and creation date with the
+        extraction engine selected in settings ('exiftool' or 'native')
+        :param session: (ExifToolSession) ExifTool session to extract with.
+        None by default. If no session provided, the shared one is used"""
+        with self.metrics.timer('extract'):
+            (self.parsed_data,
+             self.default_video_alias) = self.extractor(session=session).extract_data()
+        self.metrics.count('points', len(self.parsed_data))
+
+    def extractor(self, session=None):
+        """Instantiates the extraction engine selected in settings
+        :param session: (ExifToolSession) ExifTool session to extract with.
+        None by default. If no session provided, the shared one is used
+        :return: (EXIFExtractor) extractor instance, QuickTimeReader for
+        the 'native' engine"""
+        if self.extraction_engine == 'native':
+            from lib.quicktime_reader import QuickTimeReader as Extractor
+        else:
+            from lib.exif_extractor import EXIFExtractor as Extractor
+        return Extractor(self.video, session=session)
+
+    @staticmethod
+    def filter_ingested(connection: psycopg.Connection, folders: list,
+                        table_names: list, workers: int=8) -> tuple:
+        """Filters out already ingested (unchanged) videos. Videos are fingerprinted
+        concurrently, then all fingerprints are looked up in the ingest manifest
+        with a single query
+        :param connection: (psycopg.Connection) Database connection. If None,
+        the local manifest mirror (if set) is queried instead
+        :param folders: (list) absolute paths to the folders containing target videos
+        :param table_names: (list) target table names
+        :param workers: (int) amount of fingerprinting threads. 8 by default
+        :return: (tuple) a list of folders to be ingested and a dictionary of
+        manifest entries (None for unreadable videos) per folder"""
+        from concurrent.futures import ThreadPoolExecutor
+        from lib.ingest_manifest import IngestManifest
+
+        manifest = IngestManifest(table_names=table_names)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = dict(zip(folders, executor.map(manifest.fingerprint, folders)))
+        ingested = manifest.lookup([e['fingerprint'] for e in entries.values() if e],
+                                   connection=connection)
+        pending = [folder for folder in folders if not entries[folder]
+                   or entries[folder]['fingerprint'] not in ingested]
+        return pending, entries
 
     @staticmethod
     def create_database(connection: psycopg.Connection, database_name: str,
@@ -76,6 +145,21 @@ class DBPacker:
         :param geometry: (str) geometry type(s) flag as a string.
         Possible values:
         'Point', 'Line', 'Both'. 'Both' is the default"""
+        with connection.cursor() as cur:
+            with self.metrics.timer('create_tables'):
+                for query in self.schema_queries(table_names=table_names, geometry=geometry):
+                    cur.execute(query)
+            with self.metrics.timer('commit'):
+                connection.commit()
+        self.partition_strategies.pop((connection.info.dbname, self.schema, table_names[0]), None)
+
+    def schema_queries(self, table_names: list, geometry: str='Both') -> list:
+        """Builds target tables' creation queries (see create_columns)
+        :param table_names: (list) a list with either one or two
+        target table names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :return: (list) PostGIS extension, tables and indexes statements"""
         altitude_type = "integer" if self.altitude_data_type == "integer"\
             else "decimal(6,1)"
         point_query = f"""
@@ -86,6 +170,9 @@ class DBPacker:
                         latitude decimal({self.coordinate_precision + 4},{self.coordinate_precision}),
                         altitude {altitude_type},
                         geom geometry(Point, 4326));"""
+        if self.partitioning:
+            point_query = self.partitioned_point_query(table_name=table_names[0],
+                                                       altitude_type=altitude_type)
         line_query = f"""
                         CREATE TABLE {self.schema}.{table_names[0]}
                         (id SERIAL PRIMARY KEY,
@@ -102,20 +189,216 @@ class DBPacker:
         if geometry == 'Point':
             query = point_query
         elif geometry == "Line":
-            query = line_query
+            query = line_query + self.lod_tables_query(line_table=table_names[0])
         elif geometry == "Both":
-            query = both_query
+            query = both_query + self.lod_tables_query(line_table=table_names[1])
+
+        return ['CREATE EXTENSION IF NOT EXISTS postgis;', query,
+                self.index_query(self.indexed_tables(table_names, geometry))]
+
+    def partitioned_point_query(self, table_name: str, altitude_type: str) -> str:
+        """Builds creation query of the declaratively partitioned point table.
+        Partitioning key is part of the primary key:
+        -'date': range partitions by the recording date (recorded_on column,
+        derived from the CreateDate alias), one per month, created on demand
+        (see route_points)
+        -'hash': hash partitions by the video identifier ('Hash partitions'
+        of them), created along with the parent table
+        :param table_name: (str) point table's name
+        :param altitude_type: (str) altitude column's SQL type
+        :return: (str) CREATE TABLE statements"""
+        if self.partitioning == 'date':
+            key_column = "recorded_on date NOT NULL,"
+            partition_clause = "PRIMARY KEY (id, recorded_on)) PARTITION BY RANGE (recorded_on);"
+        else:
+            key_column = ""
+            partition_clause = "PRIMARY KEY (id, video)) PARTITION BY HASH (video);"
+        query = f"""
+                        CREATE TABLE {self.schema}.{table_name}
+                        (id SERIAL,
+                        "video" varchar({self.id_column_length}) NOT NULL,
+                        longitude decimal({self.coordinate_precision + 4},{self.coordinate_precision}),
+                        latitude decimal({self.coordinate_precision + 4},{self.coordinate_precision}),
+                        altitude {altitude_type},
+                        geom geometry(Point, 4326),
+                        {key_column}
+                        {partition_clause}"""
+        if self.partitioning == 'hash':
+            query += ''.join(f"""
+                        CREATE TABLE {self.schema}.{table_name}_p{remainder}
+                        PARTITION OF {self.schema}.{table_name}
+                        FOR VALUES WITH (MODULUS {self.hash_partitions}, REMAINDER {remainder});"""
+                             for remainder in range(self.hash_partitions))
+        return query
+
+    def partition_strategy(self, connection: psycopg.Connection,
+                           table_name: str) -> Union[str, None]:
+        """Reads point table's partitioning from the catalog (cached)
+        :param connection: (psycopg.Connection) Database connection
+        :param table_name: (str) point table's name
+        :return: (str) 'date' for the recording date range partitioning,
+        'hash' for the video identifier hash partitioning or None for
+        a regular (not partitioned) table"""
+        key = (connection.info.dbname, self.schema, table_name)
+        if key not in self.partition_strategies:
+            with connection.cursor() as cur:
+                cur.execute(self.partition_catalog_query, (self.schema, table_name))
+                row = cur.fetchone()
+            self.partition_strategies[key] = self.partition_keys.get(tuple(row)) if row else None
+        return self.partition_strategies[key]
+
+    def recording_date(self):
+        """Derives recording date from the default (CreateDate) alias
+        :return: (datetime.date) recording date, QuickTime's epoch
+        (1904-01-01) if the creation date is unknown"""
+        from datetime import date
+
+        parts = (self.default_video_alias or '')[len(self.prefix) + 1:].split('_')
+        try:
+            return date(int(parts[0]), int(parts[1]), int(parts[2]))
+        except (ValueError, IndexError):
+            return date(1904, 1, 1)
+
+    def route_points(self, connection: psycopg.Connection, table_name: str,
+                     session=None) -> None:
+        """Prepares insertion into the point table. Rows are routed to their
+        partitions by Postgres, date partitioned table's monthly partition
+        is created here if it doesn't exist yet
+        :param connection: (psycopg.Connection) Database connection
+        :param table_name: (str) point table's name
+        :param session: (ExifToolSession) ExifTool session to read the creation
+        date with, if it's not known yet, e.g. the streamed video has no points.
+        None by default"""
+        self.recorded_on = None
+        if self.partition_strategy(connection, table_name) != 'date':
+            return
+        if self.default_video_alias is None:
+            self.default_video_alias = self.extractor(session=session).extract_default_name()
+        try:
+            with self.metrics.timer('create_partition'), connection.transaction():
+                with connection.cursor() as cur:
+                    cur.execute(self.partition_query(table_name=table_name))
+        except (psycopg.errors.DuplicateTable, psycopg.errors.InvalidObjectDefinition):
+            pass  # Created concurrently by another writer
+
+    def partition_query(self, table_name: str) -> str:
+        """Sets the recording date of the rows and builds creation query
+        of its monthly partition of the date partitioned point table
+        :param table_name: (str) point table's name
+        :return: (str) CREATE TABLE IF NOT EXISTS ... PARTITION OF statement"""
+        self.recorded_on = self.recording_date()
+        start = self.recorded_on.replace(day=1)
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        return f"""
+                        CREATE TABLE IF NOT EXISTS {self.schema}.{table_name}_{start:%Y%m}
+                        PARTITION OF {self.schema}.{table_name}
+                        FOR VALUES FROM ('{start}') TO ('{end}');"""
+
+    def indexed_tables(self, table_names: list, geometry: str='Both') -> list:
+        """Lists tables holding ingested geometries: point and/or line
+        table and level of detail line tables
+        :param table_names: (list) a list with either one or two target table
+        names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :return: (list) table names"""
+        if geometry == 'Point':
+            return [table_names[0]]
+        line_table = table_names[0] if geometry == 'Line' else table_names[1]
+        lod_tables = [self.lod_table(line_table, tolerance)
+                      for tolerance in self.lod_tolerances]
+        return table_names[:2 if geometry == 'Both' else 1] + lod_tables
+
+    def index_query(self, tables: list) -> str:
+        """Builds creation query of the GIST (geometry) and btree (video
+        identifier) indexes
+        :param tables: (list) indexed table names
+        :return: (str) CREATE INDEX IF NOT EXISTS statements"""
+        return ''.join(f"""
+                        CREATE INDEX IF NOT EXISTS {table}_geom_idx
+                        ON {self.schema}.{table} USING GIST (geom);
+                        CREATE INDEX IF NOT EXISTS {table}_video_idx
+                        ON {self.schema}.{table} (video);"""
+                       for table in tables)
 
+    def drop_indexes(self, connection: psycopg.Connection, tables: list) -> None:
+        """Drops geometry and video identifier indexes ahead of a bulk load,
+        hence they aren't maintained row by row (see rebuild_indexes)
+        :param connection: (psycopg.Connection) Database connection
+        :param tables: (list) indexed table names"""
+        with connection.cursor() as cur:
+            for table in tables:
+                cur.execute(f"DROP INDEX IF EXISTS {self.schema}.{table}_geom_idx;")
+                cur.execute(f"DROP INDEX IF EXISTS {self.schema}.{table}_video_idx;")
+            connection.commit()
+
+    def rebuild_indexes(self, connection: psycopg.Connection, tables: list,
+                        verbose: bool=True, to_console: bool=False) -> Union[str, None]:
+        """(Re)builds geometry and video identifier indexes after a bulk load
+        and refreshes planner statistics of the tables
+        :param connection: (psycopg.Connection) Database connection
+        :param tables: (list) indexed table names
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the informational
+        message for to print to GUI's console. False by default"""
+        started = time.perf_counter()
         with connection.cursor() as cur:
-            cur.execute('CREATE EXTENSION postgis;')
-            cur.execute(query)
+            cur.execute(self.index_query(tables))
+            for table in tables:
+                cur.execute(f"ANALYZE {self.schema}.{table};")
             connection.commit()
+        self.rebuild_seconds = round(time.perf_counter() - started, 3)
+
+        message = f"Indexes rebuilt in {self.rebuild_seconds} s"
+        if verbose:
+            print(message)
+        if to_console:
+            return message
+
+    def lod_table(self, line_table: str, tolerance: float) -> str:
+        """Returns level of detail line table's name
+        :param line_table: (str) full resolution line table's name
+        :param tolerance: (float) simplification tolerance, meters
+        :return: (str) table name, e.g. tracklines_10m"""
+        return f"{line_table}_{str(tolerance).replace('.', '_')}m"
+
+    def lod_tables_query(self, line_table: str) -> str:
+        """Builds creation query of the level of detail line tables
+        ('Level of detail tolerances (m)' setting)
+        :param line_table: (str) full resolution line table's name
+        :return: (str) CREATE TABLE IF NOT EXISTS statements, empty if no LOD is set"""
+        return ''.join(f"""
+                        CREATE TABLE IF NOT EXISTS {self.schema}.{self.lod_table(line_table, tolerance)}
+                        (id SERIAL PRIMARY KEY,
+                        video varchar({self.id_column_length}),
+                        length decimal(8,3),
+                        geom geometry(Linestring, 4326));"""
+                       for tolerance in self.lod_tolerances)
+
+    @contextmanager
+    def transaction(self, connection: psycopg.Connection):
+        """Transaction block of the video's writes. Blocks nest: inner ones are
+        savepoints of the enclosing transaction, hence points, lines and the
+        manifest entry wrapped together are committed (or rolled back) at once.
+        Outermost block's commit is timed as the 'commit' stage
+        :param connection: (psycopg.Connection) Database connection"""
+        outermost = connection.info.transaction_status == psycopg.pq.TransactionStatus.IDLE
+        with connection.transaction():
+            yield
+            committing = time.perf_counter()
+        if outermost:
+            self.metrics.record('commit', time.perf_counter() - committing)
 
     def insert_points(self, connection: psycopg.Connection,
                       table_name: str, alias: str=None,
                       verbose: bool=True,
-                      to_console: bool=False) -> Union[str, None]:
-        """Inserts spatial data into the point table
+                      to_console: bool=False,
+                      binary: bool=False) -> Union[str, None]:
+        """Inserts spatial data into the point table. All points of the
+        video are streamed via a single COPY ... FROM STDIN within one
+        transaction. Geometries are encoded to EWKB on the client side,
+        hence no per-row SQL function call is needed
         :param connection: (psycopg.Connection) Database connection
         :param table_name: (str) point table's name
         :param alias: (str) video identifier (alias). None by default.
@@ -125,31 +408,325 @@ class DBPacker:
         True by default
         :param to_console: (bool) enables/disables return of the
         informational message for to print to GUI's console.
-        False by default"""
+        False by default
+        :param binary: (bool) enables/disables binary COPY format. False by
+        default: the text payload is built in one pass, while binary rows are
+        dumped one by one by psycopg (see benchmarks.insert_points). Falls back
+        to the text format if the server rejects the binary representation"""
         identifier = alias if alias else self.default_video_alias
-        for point in self.parsed_data:
-            longitude = point[0]
-            latitude = point[1]
-            altitude = point[2]
-            query = f"""
-                INSERT INTO public.{table_name}(video, longitude, latitude, altitude, geom)
-                VALUES('{identifier}', {longitude}, {latitude}, {altitude},
-                ST_GeomFromText('POINT({longitude} {latitude})', 4326));"""
+        self.route_points(connection=connection, table_name=table_name)
+        try:
+            self.copy_points(connection=connection, table_name=table_name,
+                             identifier=identifier, binary=binary)
+        except psycopg.errors.InvalidBinaryRepresentation:
+            if not binary:
+                raise
+            self.copy_points(connection=connection, table_name=table_name,
+                             identifier=identifier, binary=False)
+
+        message = 'Point data inserted'
+        if verbose:
+            print(message)
+        if to_console:
+            return message
+
+    def copy_points(self, connection: psycopg.Connection, table_name: str,
+                    identifier: str, binary: bool=False) -> None:
+        """Streams parsed points to the point table via COPY
+        :param connection: (psycopg.Connection) Database connection
+        :param table_name: (str) point table's name
+        :param identifier: (str) video identifier written to each row
+        :param binary: (bool) enables/disables binary COPY format.
+        False by default"""
+        with self.transaction(connection):
+            with self.metrics.timer('copy_points'), connection.cursor() as cur:
+                with cur.copy(self.copy_query(table_name, binary)) as copy:
+                    self.prepare_copy(copy=copy, binary=binary)
+                    self.write_track(copy=copy, track=self.parsed_data,
+                                     identifier=identifier, binary=binary)
+
+    def copy_query(self, table_name: str, binary: bool=False) -> str:
+        """Builds point table's COPY statement
+        :param table_name: (str) point table's name
+        :param binary: (bool) enables/disables binary COPY format. False by default
+        :return: (str) COPY ... FROM STDIN statement"""
+        copy_format = " (FORMAT BINARY)" if binary else ""
+        partition_key = ", recorded_on" if self.recorded_on else ""
+        return f"""COPY {self.schema}.{table_name}
+                   (video, longitude, latitude, altitude, geom{partition_key})
+                   FROM STDIN{copy_format}"""
+
+    def prepare_copy(self, copy: psycopg.Copy, binary: bool=False) -> None:
+        """Sets column types of the binary COPY
+        :param copy: (psycopg.Copy) active COPY operation
+        :param binary: (bool) binary COPY format flag. False by default"""
+        if binary:
+            # geometry_recv accepts EWKB, hence bytea's binary
+            # dumper is used to send the geometry as is
+            copy.set_types(["varchar", "numeric", "numeric",
+                            "int4" if self.altitude_data_type == "integer" else "numeric",
+                            "bytea"] + (["date"] if self.recorded_on else []))
+
+    def write_track(self, copy: psycopg.Copy, track, identifier: str,
+                    binary: bool=False) -> None:
+        """Writes track's points to the active COPY operation
+        :param copy: (psycopg.Copy) active COPY operation
+        :param track: (Track) points to be written, either the whole track or its chunk
+        :param identifier: (str) video identifier written to each row
+        :param binary: (bool) binary COPY format flag. False by default"""
+        if not binary:
+            # Whole track is serialized to a single text COPY payload
+            copy.write(self.copy_payload(track=track, identifier=identifier))
+            return
+        for row in self.copy_rows(track=track, identifier=identifier):
+            copy.write_row(row)
+
+    def copy_payload(self, track, identifier: str) -> bytes:
+        """Serializes track to the text COPY payload of the point table
+        :param track: (Track) points to be written
+        :param identifier: (str) video identifier written to each row
+        :return: (bytes) COPY payload"""
+        return track.copy_buffer(identifier=identifier, srid=4326,
+                                 suffix=f"\t{self.recorded_on}" if self.recorded_on else '')
+
+    def copy_rows(self, track, identifier: str):
+        """Converts track's points to the binary COPY rows of the point table
+        :param track: (Track) points to be written
+        :param identifier: (str) video identifier written to each row
+        :return: (generator) row tuples matching copy_query's columns"""
+        from decimal import Decimal
+        from lib.wkb_encoder import WKBEncoder
+
+        integer_altitude = self.altitude_data_type == "integer"
+        geometries = memoryview(track.point_wkbs(srid=4326))
+        size = WKBEncoder.point_size
+        partition_key = (self.recorded_on,) if self.recorded_on else ()
+        for i, (longitude, latitude, altitude) in enumerate(track):
+            yield (identifier,
+                   Decimal(str(longitude)),
+                   Decimal(str(latitude)),
+                   int(altitude) if integer_altitude
+                   else Decimal(str(altitude)),
+                   geometries[i * size:(i + 1) * size]) + partition_key
+
+    def stream_points(self, connection: psycopg.Connection, table_name: str,
+                      alias: str=None, verbose: bool=True, to_console: bool=False,
+                      binary: bool=False, session=None) -> Union[str, None]:
+        """Streams video's points into the point table while they're being
+        extracted: parsed chunks are written to a single COPY as soon as
+        they're read, hence neither the whole output nor the whole track
+        is held in memory and the Database isn't idle during extraction.
+        Streamed track's ellipsoidal length is measured along (streamed_length)
+        :param connection: (psycopg.Connection) Database connection
+        :param table_name: (str) point table's name
+        :param alias: (str) video identifier (alias). None by default.
+        If no alias provided, video is identified by its creation date
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational message for to print to GUI's console.
+        False by default
+        :param binary: (bool) enables/disables binary COPY format. False by
+        default: the text payload is built in one pass, while binary rows are
+        dumped one by one by psycopg (see benchmarks.insert_points). Falls back
+        to the text format if the server rejects the binary representation
+        :param session: (ExifToolSession) ExifTool session to extract with.
+        None by default. If no session provided, the shared one is used"""
+        from lib.geodesic import Geodesic
+
+        extractor = self.extractor(session=session)
+        geodesic = Geodesic()
+        self.streamed_points, self.streamed_length = 0, 0.0
+        try:
+            # Extraction is closed (its session unlocked) before any retry
+            with closing(extractor.stream_data(chunk_size=self.chunk_size)) as stream:
+                # The first chunk carries the header (creation date) the rows
+                # are routed by, hence the video isn't read twice for it
+                first = next(stream, None)
+                chunks = stream
+                if first is not None:
+                    self.default_video_alias = first.alias
+                    chunks = itertools.chain([first], stream)
+                self.route_points(connection=connection, table_name=table_name,
+                                  session=session)
+                with self.transaction(connection):
+                    with self.metrics.timer('copy_points'), connection.cursor() as cur:
+                        with cur.copy(self.copy_query(table_name, binary)) as copy:
+                            self.prepare_copy(copy=copy, binary=binary)
+                            last = None
+                            for chunk in chunks:
+                                self.default_video_alias = chunk.alias
+                                self.write_track(copy=copy, track=chunk,
+                                                 identifier=alias if alias else chunk.alias,
+                                                 binary=binary)
+                                self.streamed_points += len(chunk)
+                                # Line's length is measured on the client side as well,
+                                # chunk by chunk, joints between the chunks included
+                                if last and len(chunk):
+                                    self.streamed_length += geodesic.inverse(
+                                        *last, chunk.longitudes[0], chunk.latitudes[0])
+                                self.streamed_length += geodesic.length(chunk.longitudes,
+                                                                        chunk.latitudes)
+                                if len(chunk):
+                                    last = chunk.longitudes[-1], chunk.latitudes[-1]
+            self.metrics.count('points', self.streamed_points)
+        except psycopg.errors.InvalidBinaryRepresentation:
+            if not binary:
+                raise
+            return self.stream_points(connection=connection, table_name=table_name,
+                                      alias=alias, verbose=verbose, to_console=to_console,
+                                      binary=False, session=session)
 
-            with connection.cursor() as cur:
-                cur.execute(query)
-                connection.commit()
         message = 'Point data inserted'
         if verbose:
             print(message)
         if to_console:
             return message
 
+    def insert_line_from_points(self, connection: psycopg.Connection,
+                                table_names: list, alias: str=None,
+                                verbose: bool=True,
+                                to_console: bool=False) -> Union[str, None]:
+        """Builds the line from the points streamed into the point table
+        (see stream_points) on the server side, hence the track isn't
+        held in memory for the line either. Line simplification and level of
+        detail lines are simplified with tolerances in meters, in the local
+        projection TrackSimplifier uses (see simplified_line).
+        Unsimplified line's length is the one measured on the client side while
+        streaming (see Geodesic). Simplified lines exist on the server only, their
+        lengths are computed there (ST_LengthSpheroid): fetching their vertices back
+        to measure them would cost more than the measurement itself
+        :param connection: (psycopg.Connection) Database connection
+        :param table_names: (list) point and line table names
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational message.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational message for to print to GUI's console.
+        False by default"""
+        identifier = alias if alias else self.default_video_alias
+        spheroid = 'SPHEROID["WGS 84",6378137,298.257223563]'
+        length = f"ST_LengthSpheroid(geom, '{spheroid}')/1000" if self.line_tolerance > 0\
+            else '%(length)s'
+        # Track's mean latitude is the projection's origin of the line
+        # and of its level of detail lines
+        query = f"""WITH track AS (
+                        SELECT ST_MakeLine(geom ORDER BY id) AS geom,
+                        radians(avg(latitude)::float8) AS origin
+                        FROM {self.schema}.{table_names[0]}
+                        WHERE video = %(video)s AND id > %(after)s),
+                    new_line AS (
+                        INSERT INTO {self.schema}.{table_names[1]}(video, geom, length)
+                        SELECT %(video)s, geom, {length}
+                        FROM (SELECT {self.simplified_line('geom', 'origin', self.line_tolerance)}
+                              AS geom FROM track) AS simplified
+                        WHERE geom IS NOT NULL
+                        RETURNING id)
+                    SELECT new_line.id, track.origin FROM new_line, track;"""
+        lod_query = """INSERT INTO {schema}.{lod_table}(video, geom, length)
+                       SELECT video, geom, ST_LengthSpheroid(geom, '{spheroid}')/1000
+                       FROM (SELECT video, {simplified} AS geom
+                             FROM {schema}.{line_table} WHERE id = %(line)s) AS new_line;"""
+
+        with self.transaction(connection), connection.cursor() as cur:
+            with self.metrics.timer('insert_line'):
+                cur.execute(query, {'video': identifier, 'after': self.streamed_after,
+                                    'tolerance': self.line_tolerance,
+                                    'length': self.streamed_length / 1000})
+                line = cur.fetchone()
+            if line and self.lod_tolerances:
+                with self.metrics.timer('create_lod_tables'):
+                    cur.execute(self.lod_tables_query(line_table=table_names[1]))
+                for tolerance in self.lod_tolerances:
+                    with self.metrics.timer('insert_line'):
+                        cur.execute(lod_query.format(
+                            schema=self.schema,
+                            lod_table=self.lod_table(table_names[1], tolerance),
+                            line_table=table_names[1], spheroid=spheroid,
+                            simplified=self.simplified_line('geom', '%(origin)s', tolerance)),
+                            {'line': line[0], 'origin': line[1], 'tolerance': tolerance})
+
+        message = 'Line data inserted'
+        if verbose:
+            print(message)
+        if to_console:
+            return message
+
+    @staticmethod
+    def simplified_line(line: str, origin: str, tolerance: float) -> str:
+        """Builds server-side counterpart of TrackSimplifier: the line is scaled to
+        local planar meters (equirectangular projection, as TrackSimplifier projects
+        tracks), simplified with ST_Simplify and scaled back to degrees, hence the
+        tolerance is kept in meters at any latitude
+        :param line: (str) SQL expression of the line (WGS 84 degrees)
+        :param origin: (str) SQL expression of the projection's origin latitude, radians
+        :param tolerance: (float) tolerance (meters), bound as the 'tolerance' query
+        parameter. Lines aren't simplified if it's not positive
+        :return: (str) SQL expression of the simplified line"""
+        import math
+        from lib.track_simplifier import TrackSimplifier
+
+        if tolerance <= 0:
+            return line
+        y_scale = math.radians(1) * TrackSimplifier.earth_radius  # Meters per degree
+        x_scale = f"({y_scale} * cos({origin}))"
+        return (f"ST_Scale(ST_Simplify(ST_Scale({line}, {x_scale}, {y_scale}), "
+                f"%(tolerance)s), 1 / {x_scale}, 1 / {y_scale})")
+
+    def insert_streamed(self, connection: psycopg.Connection, table_names: list,
+                        geometry: str='Both', alias: str=None,
+                        verbose: bool=True, to_console: bool=False,
+                        db_message: str=None, session=None) -> Union[str, tuple, None]:
+        """Streams extraction into the point table and (for the 'Both' geometry)
+        derives the line from the streamed points. Return values match the
+        insert_data method's ones. Line-only geometry needs the whole track,
+        hence it's extracted and inserted via insert_data
+        :param connection: (psycopg.Connection) Database connection
+        :param table_names: (list) a list with either one or two target table
+        names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational messages for to print to GUI's console.
+        False by default
+        :param db_message: (str) Database creation message to be returned
+        along with the insertion messages. None by default
+        :param session: (ExifToolSession) ExifTool session to extract with.
+        None by default. If no session provided, the shared one is used"""
+        if geometry == 'Line':
+            self.extract_data(session=session)
+            return self.insert_data(connection=connection, table_names=table_names,
+                                    geometry=geometry, alias=alias, verbose=verbose,
+                                    to_console=to_console, db_message=db_message)
+
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT coalesce(max(id), 0) FROM {self.schema}.{table_names[0]};")
+            self.streamed_after = cur.fetchone()[0]
+        messages = self.stream_points(connection=connection, table_name=table_names[0],
+                                      alias=alias, verbose=verbose,
+                                      to_console=to_console, session=session)
+        if geometry == 'Both':
+            messages = (messages,
+                        self.insert_line_from_points(connection=connection,
+                                                     table_names=table_names,
+                                                     alias=alias, verbose=verbose,
+                                                     to_console=to_console))
+        if not to_console:
+            return None
+        return (db_message, messages) if db_message else messages
+
     def insert_line(self, connection: psycopg.Connection,
                     table_name: str, alias: str=None,
                     verbose: bool=True,
                     to_console: bool=False) -> Union[str, None]:
-        """Inserts spatial data into the line table
+        """Inserts spatial data into the line table. Line is simplified
+        if 'Line simplification (m)' tolerance is set, level of detail
+        lines (if any) are inserted along. Lines are sent as binary EWKB
+        parameters, their ellipsoidal lengths are computed on the client side
+        (see Geodesic) and written in the same INSERT
         :param connection: (psycopg.Connection) Database connection
         :param table_name: (str) line table's name
         :param alias: (str) video identifier (alias). None by default.
@@ -161,20 +738,15 @@ class DBPacker:
         informational message for to print to GUI's console.
         False by default"""
         identifier = alias if alias else self.default_video_alias
-        pairs = []
-        for point in self.parsed_data:
-            pairs.append(f"{point[0]} {point[1]}")
-        geometry_string = ','.join(pairs)
-
-        query = f"""INSERT INTO public.{table_name}(video, geom)
-                    VALUES('{identifier}',
-                    ST_GeomFromText('LINESTRING({geometry_string})', 4326));
-                    UPDATE public.{table_name} SET length = ST_LengthSpheroid(geom,
-                    'SPHEROID["WGS 84",6378137,298.257223563]')/1000;"""
-
-        with connection.cursor() as cur:
-            cur.execute(query)
-            connection.commit()
+        with self.metrics.timer('build_lines'):
+            rows = self.line_rows(table_name=table_name, identifier=identifier)
+        with self.transaction(connection), connection.cursor() as cur:
+            if self.lod_tolerances:
+                with self.metrics.timer('create_lod_tables'):
+                    cur.execute(self.lod_tables_query(line_table=table_name))
+            for query, parameters in rows:
+                with self.metrics.timer('insert_line'):
+                    cur.execute(query, parameters)
 
         message = 'Line data inserted'
         if verbose:
@@ -182,6 +754,25 @@ class DBPacker:
         if to_console:
             return message
 
+    def line_rows(self, table_name: str, identifier: str) -> list:
+        """Simplifies parsed track into the line and its level of detail lines
+        :param table_name: (str) line table's name
+        :param identifier: (str) video identifier
+        :return: (list) INSERT query and its parameters per line"""
+        from lib.track_simplifier import TrackSimplifier
+
+        track = TrackSimplifier(self.line_tolerance).simplify(self.parsed_data)
+        lines = [(table_name, track)]
+        for tolerance in self.lod_tolerances:
+            lines.append((self.lod_table(table_name, tolerance),
+                          TrackSimplifier(tolerance).simplify(track)))
+        # Geometry is bound as binary EWKB, length (WGS 84 ellipsoid)
+        # is measured on the client side
+        return [(f"""INSERT INTO {self.schema}.{target_table}(video, geom, length)
+                     VALUES (%s, ST_GeomFromEWKB(%b), %s);""",
+                 (identifier, line.to_wkb(srid=4326), line.length() / 1000))
+                for target_table, line in lines]
+
     def insert_both(self, connection: psycopg.Connection,
                     table_names: list,
                     alias: str=None,
@@ -214,7 +805,8 @@ class DBPacker:
     def pack_data(self, new: bool, db_name: str, user: str,
                   credentials: str, table_names: list,
                   geometry: str='Both', alias: str=None,
-                  verbose: bool=True, to_console: bool=False) -> None:
+                  verbose: bool=True, to_console: bool=False,
+                  skip_ingested: bool=False) -> None:
         """Packs processed data to the Database (either new or the existing one)
         :param new: (bool) flag, enables/disables new Database creation/appending
         to the existing one
@@ -234,35 +826,102 @@ class DBPacker:
         True by default
         :param to_console: (bool) enables/disables return of the
         informational messages for to print to GUI's console.
-        False by default"""
-        self.extract_data()
-        db_message = None
-        if new:
-            postgres_connection = DBConnector(db_name='postgres',
-                                              user=user,
-                                              credentials=credentials,
-                                              autocommit=True).connect()
-            if to_console:
-                db_message = self.create_database(connection=postgres_connection,
-                                 database_name=db_name,
-                                 verbose=False,
-                                 to_console=True)
-            else:
-                self.create_database(connection=postgres_connection,
-                                     database_name=db_name,
-                                     verbose=verbose,
-                                     to_console=False)
-            target_connection = DBConnector(db_name=db_name,
-                                            user=user,
-                                            credentials=credentials).connect()
-            self.create_columns(connection=target_connection,
-                                table_names= table_names,
-                                geometry=geometry)
-        elif not new:
-            target_connection = DBConnector(db_name=db_name,
-                                            user=user,
-                                            credentials=credentials).connect()
+        False by default
+        :param skip_ingested: (bool) enables/disables skipping of the video
+        if it's been ingested into the target tables already (see ingest
+        manifest). Ingested video is recorded to the manifest. False by default"""
+        from lib.ingest_manifest import IngestManifest
+
+        # Measurements are attributed to the video, its record is exported once packed
+        with self.metrics.measure(self.video, status='written') as record:
+            manifest = IngestManifest(table_names=table_names) if skip_ingested else None
+            if manifest and not new:
+                with DBConnector(db_name=db_name,
+                                 user=user,
+                                 credentials=credentials,
+                                 pooled=True).connection() as connection:
+                    manifest.create_table(connection=connection)
+                    pending, _ = self.filter_ingested(connection=connection,
+                                                      folders=[self.video],
+                                                      table_names=table_names)
+                if not pending:
+                    message = 'Video has been ingested already, skipped'
+                    if verbose:
+                        print(message)
+                    record['status'] = 'skipped'
+                    if to_console:
+                        return message
+                    return None
+
+            if not self.streaming:
+                self.extract_data()
+            db_message = None
+            if new:
+                with DBConnector(db_name='postgres',
+                                 user=user,
+                                 credentials=credentials,
+                                 autocommit=True).connection() as postgres_connection:
+                    if to_console:
+                        db_message = self.create_database(connection=postgres_connection,
+                                         database_name=db_name,
+                                         verbose=False,
+                                         to_console=True)
+                    else:
+                        self.create_database(connection=postgres_connection,
+                                             database_name=db_name,
+                                             verbose=verbose,
+                                             to_console=False)
+
+            # Pooled connections are reused by every packer of the batch
+            with DBConnector(db_name=db_name,
+                             user=user,
+                             credentials=credentials,
+                             pooled=True).connection() as target_connection:
+                if new:
+                    self.create_columns(connection=target_connection,
+                                        table_names= table_names,
+                                        geometry=geometry)
+                    if manifest:
+                        manifest.create_table(connection=target_connection)
+                insert = self.insert_streamed if self.streaming else self.insert_data
+                # Points, lines and the manifest entry are committed at once, hence
+                # a failed video leaves neither partial rows nor a manifest entry
+                with self.transaction(target_connection):
+                    messages = insert(connection=target_connection,
+                                      table_names=table_names,
+                                      geometry=geometry,
+                                      alias=alias,
+                                      verbose=verbose,
+                                      to_console=to_console,
+                                      db_message=db_message)
+                    entry = manifest.fingerprint(self.video) if manifest else None
+                    if entry:
+                        entry['video'] = alias if alias else self.default_video_alias
+                        with self.metrics.timer('manifest_record'):
+                            manifest.record(entries=[entry], connection=target_connection)
+            if entry:
+                manifest.record(entries=[entry])  # Local mirror, once committed
+            return messages
 
+    def insert_data(self, connection: psycopg.Connection, table_names: list,
+                    geometry: str='Both', alias: str=None,
+                    verbose: bool=True, to_console: bool=False,
+                    db_message: str=None) -> Union[str, tuple, None]:
+        """Inserts extracted data according to the geometry type
+        :param connection: (psycopg.Connection) Database connection
+        :param table_names: (list) a list with either one or two target table
+        names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :param alias: (str) video identifier (alias). None by default
+        :param verbose: (bool) enables/disables informational messages.
+        True by default
+        :param to_console: (bool) enables/disables return of the
+        informational messages for to print to GUI's console.
+        False by default
+        :param db_message: (str) Database creation message to be returned
+        along with the insertion messages. None by default"""
+        target_connection = connection
         if geometry == 'Point' and to_console:
             message = self.insert_points(connection=target_connection,
                                table_name= table_names[0],
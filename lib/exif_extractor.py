@@ -2,28 +2,75 @@
 EXIF extractor module
 
 Extracts positional information from video's data via the EXIFTool.
-Returns parsed data as a nested list
+Returns parsed data as a Track (longitude, latitude and altitude columns),
+whole or streamed in chunks
 
 © 2024 Kirill Romashchenko
 """
+from array import array
+from lib.track import Track
+
+try:
+    import numpy
+except ImportError:  # Numeric output is parsed into array('d') instead
+    numpy = None
+
+class ExtractionResult:
+    """
+    Extraction result class. Holds everything read from a single video
+    in one ExifTool pass: GPS samples, creation date, derived default
+    alias and the requested header tags
+    """
+    __slots__ = ('source', 'points', 'create_date', 'alias', 'tags')
+
+    def __init__(self, source: str, points, create_date: str,
+                 alias: str, tags: dict) -> None:
+        """Result's constructor method
+        :param source: (str) path to the source video
+        :param points: (Track) track of three coordinate values
+        per each (succesfull) GPS measurement
+        :param create_date: (str) raw 'CreateDate' tag's value
+        :param alias: (str) default video identifier derived from the creation date
+        :param tags: (dict) header (main document) tags"""
+        self.source = source
+        self.points = points
+        self.create_date = create_date
+        self.alias = alias
+        self.tags = tags
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the result class instance
+        """
+        return (f"{self.__class__.__name__} (source={self.source}, "
+                f"points={len(self.points)}, alias={self.alias})")
 
 class EXIFExtractor:
     """
     EXIF extractor class. Class instance validates input and sets
     up processing. extract_data method performs module's functionality.
     """
-    def __init__(self, input_path: str) -> None:
+    header_tags = ('CreateDate', 'Duration')  # Main document's tags
+    gps_tags = ('GPSLongitude', 'GPSLatitude', 'GPSAltitude')  # Per sample tags
+    format_path = None  # Print format file of the numeric output, written once per process
+
+    def __init__(self, input_path: str, session=None) -> None:
         """Instantiates class. Verifies input. Reads processing parameters (settings.json)
         :param input_path: (str) absolute path to the folder, containing target file
+        :param session: (ExifToolSession) ExifTool session to run commands with.
+        None by default. If no session provided, the shared (process-wide) one is used
         """
         import os
         from lib.settings_reader import Reader
+        from lib.exiftool_session import ExifToolSession
+        from lib.track_cache import TrackCache
 
         self.settings = Reader().get_settings() # Settings setup
         self.coordinate_precision = self.settings['Coordinate precision']  # 8 by default
         self.altitude_data_type = self.settings['Altitude data type'] # Integer by default
         self.prefix = self.settings["Default prefix"]  # Default prefix for the video identifier
         self.default_file = self.settings["Default filename"]  # origin_6_lrv.mp4 by default
+        self.output_format = self.settings.get("ExifTool output", "json")  # json or numeric
 
         self.exe_path = "lib/exiftool.exe"  # Paths setup
         self.input_path = input_path
@@ -31,6 +78,11 @@ class EXIFExtractor:
         assert os.path.exists(self.input_path), 'The input is invalid'
         assert os.path.exists(self.video_path), 'The input folder does not contain target filess'
         self.parent_folder = (os.path.abspath(os.path.join(os.getcwd(), os.pardir)))
+        self.session = session if session else ExifToolSession.shared(self.exe_path)
+        try:
+            self.cache = TrackCache.from_settings(self.settings)
+        except OSError:
+            self.cache = None  # Cache directory can't be created, e.g. read-only install
 
     def __repr__(self) -> str:
         """
@@ -44,32 +96,327 @@ class EXIFExtractor:
         """
         return f"{self.__class__.__name__} instance for {self.input_path})"
 
-    def extract_data(self) -> (list, str):
+    def extract_data(self) -> (Track, str):
         """
         Extracts spatial data and video's creation time from EXIF
-        to list via the parse_data method.
+        to a Track via the extract method. Track cache (if enabled) is checked
+        first and populated afterwards, hence unchanged videos are extracted once
         :return: (tuple) parsed data with three values per point
-        (i.e. per each (succesfull) GPS measurement) as a list
+        (i.e. per each (succesfull) GPS measurement) as a Track
         and video's creation time as a string
         """
-        import subprocess, shlex
+        key, cached = self.cached_track()
+        if cached:
+            return cached, cached.alias
 
-        query = f'{self.exe_path} -G1 -a -s' f' -ee3\
-        -p "$gpslongitude, $gpslatitude, $gpsaltitude#"'\
-        f' -api largefilesupport=1 -c "%.8f" {self.video_path}'
+        result = self.extract()
+        self.store(key=key, result=result)
+        return result.points, result.alias
 
-        args = shlex.split(query)
-        output, error = subprocess.Popen(args=args, stdout=subprocess.PIPE,
-                                         stderr=subprocess.DEVNULL).communicate()
-        parsed_lines = output.splitlines()
-        raw_output = []
-        for line in parsed_lines:
-            raw_output.append(line.decode())
+    def store(self, key: str, result: ExtractionResult) -> None:
+        """Puts extracted track into the track cache (if enabled)
+        :param key: (str) cache key (see cached_track), None if caching is disabled
+        :param result: (ExtractionResult) extraction result"""
+        if key and len(result.points):
+            try:
+                self.cache.put(key, track=result.points)
+            except OSError:
+                pass  # Caching is an optimization, extraction result is still valid
+
+    def extract(self) -> ExtractionResult:
+        """
+        Extracts GPS samples, creation date and other header tags in a single
+        ExifTool pass (JSON output, numeric values, one group per embedded document)
+        :return: (ExtractionResult) structured extraction result
+        """
+        from lib.metrics import Metrics
 
-        processed_output = self.parse_data(raw_data=raw_output)
-        default_name = self.extract_default_name()
+        raw_data = self.session.execute(*self.command())
+        with Metrics.shared().timer('parse'):
+            return self.parse_output(raw_data=raw_data)
 
-        return processed_output, default_name
+    def command(self) -> list:
+        """Builds ExifTool arguments of the single-pass extraction of the
+        target video, in the output format set in settings ('ExifTool output')
+        :return: (list) command line arguments, input file included"""
+        query = self.build_numeric_query() if self.output_format == 'numeric'\
+            else self.build_query()
+        return query + [self.video_path]
+
+    def parse_output(self, raw_data: bytes) -> ExtractionResult:
+        """Parses output of the command built by the command method
+        :param raw_data: (bytes) ExifTool's stdout
+        :return: (ExtractionResult) structured extraction result"""
+        if self.output_format == 'numeric':
+            return self.parse_numeric(raw_data=raw_data)
+        return self.parse_json(raw_data=raw_data)
+
+    def stream_data(self, chunk_size: int=10000):
+        """
+        Streams video's track in chunks. Cached track (if any) is sliced,
+        otherwise the video is streamed via the stream method
+        :param chunk_size: (int) maximal amount of points per chunk. 10000 by default
+        :return: (generator) Track chunks, each one carrying video's default alias
+        """
+        _, cached = self.cached_track()
+        if cached:
+            for start in range(0, len(cached), chunk_size):
+                yield cached[start:start + chunk_size]
+            return
+        yield from self.stream(chunk_size=chunk_size)
+
+    def cached_track(self) -> tuple:
+        """Looks video's track up in the track cache (if enabled)
+        :return: (tuple) cache key (None if caching is disabled) and
+        cached track (None if missing)"""
+        if not self.cache:
+            return None, None
+        key = self.cache.key(video_path=self.video_path,
+                             variant=f"{self.coordinate_precision}|{self.altitude_data_type}")
+        if not key:
+            return None, None
+        cached = self.cache.get(key, integer_altitude=self.altitude_data_type == 'integer')
+        if cached:
+            cached.source = self.video_path
+        return key, cached
+
+    def stream(self, chunk_size: int=10000):
+        """
+        Reads ExifTool's numeric output incrementally and parses it chunk
+        by chunk, hence memory stays bounded regardless of the recording's length
+        :param chunk_size: (int) approximate amount of points per chunk (chunks
+        are cut at the pipe's read boundaries). 10000 by default
+        :return: (generator) Track chunks, each one carrying video's default alias
+        """
+        import contextlib
+        from lib.metrics import Metrics
+
+        alias = None
+        buffer = bytearray()
+        lines = 0
+        metrics = Metrics.shared()
+
+        def parse(complete: bytes) -> Track:
+            """Parses complete lines, the first chunk's header included"""
+            nonlocal alias
+            with metrics.timer('parse'):
+                tags, longitudes, latitudes, altitudes = self.parse_columns(raw_data=complete)
+            if alias is None:
+                alias = self.format_alias(str(tags.get('CreateDate', '')))
+            return Track(longitudes, latitudes, altitudes, alias=alias,
+                         source=self.video_path)
+
+        # Session's output is closed (and the session unlocked) even if parsing fails
+        # or this generator is closed early
+        with contextlib.closing(self.session.stream(*self.build_numeric_query(),
+                                                    self.video_path)) as output:
+            for data in output:
+                buffer += data
+                lines += data.count(b'\n')
+                if lines < chunk_size:
+                    continue
+                cut = buffer.rfind(b'\n') + 1
+                chunk = parse(bytes(buffer[:cut]))
+                del buffer[:cut]
+                lines = 0
+                if len(chunk):
+                    yield chunk
+        if buffer.strip() or alias is None:
+            chunk = parse(bytes(buffer))
+            if len(chunk):
+                yield chunk
+
+    @classmethod
+    def extract_batch(cls, input_paths: list, chunk_size: int=20,
+                      sessions: list=None):
+        """
+        Extracts many videos with a few ExifTool commands. Input is split into
+        chunks, each chunk's video paths are passed to a single command and its
+        JSON output is demultiplexed back per video by the SourceFile key.
+        Chunks are distributed over the provided sessions
+        :param input_paths: (list) absolute paths to the folders, containing target files
+        :param chunk_size: (int) amount of videos per ExifTool command. 20 by default
+        :param sessions: (list) ExifTool sessions to run chunks in parallel with.
+        None by default. If no sessions provided, the shared one is used
+        :return: (generator) ExtractionResult per video, in completion order
+        """
+        import json
+        import queue
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        if not input_paths:
+            return
+        extractors = [cls(input_path=path) for path in input_paths]
+        template = extractors[0]
+        if not sessions:
+            sessions = [template.session]
+        idle_sessions = queue.Queue()
+        for session in sessions:
+            idle_sessions.put(session)
+
+        def run_chunk(chunk: list) -> list:
+            """Runs a single chunk on the first idle session"""
+            session = idle_sessions.get()
+            try:
+                output = session.execute(*template.build_query(),
+                                         *[e.video_path for e in chunk])
+            finally:
+                idle_sessions.put(session)
+            return json.loads(output) if output.strip() else []
+
+        chunks = [extractors[i:i + chunk_size]
+                  for i in range(0, len(extractors), chunk_size)]
+        executor = ThreadPoolExecutor(max_workers=len(sessions))
+        try:
+            futures = [executor.submit(run_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                for record in future.result():
+                    yield template.parse_record(record=record)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def build_query(self) -> list:
+        """Builds ExifTool arguments for the single-pass extraction
+        (JSON output, numeric values, one group per embedded document)
+        :return: (list) command line arguments, excluding input files"""
+        query = ['-j', '-G3', '-n', '-ee3', '-api', 'largefilesupport=1']
+        query += [f"-{tag}" for tag in self.header_tags + self.gps_tags]
+        return query
+
+    @classmethod
+    def build_numeric_query(cls) -> list:
+        """Builds ExifTool arguments for the single-pass numeric extraction.
+        Header tags are printed once as 'Tag=value' lines, followed by
+        a whitespace separated 'longitude latitude altitude' line per
+        GPS sample (numeric values, one line per embedded document)
+        :return: (list) command line arguments, excluding input files"""
+        import atexit
+        import os
+        import tempfile
+
+        if cls.format_path is None:
+            head = ''.join(f"#[HEAD]{tag}=${tag}\n" for tag in cls.header_tags)
+            body = '#[BODY]' + ' '.join(f"${tag}" for tag in cls.gps_tags) + '\n'
+            descriptor, path = tempfile.mkstemp(suffix='.fmt', prefix='qtd_')
+            with os.fdopen(descriptor, 'w') as format_file:
+                format_file.write(head + body)
+            atexit.register(os.remove, path)
+            EXIFExtractor.format_path = path
+        return ['-n', '-ee3', '-api', 'largefilesupport=1', '-p', cls.format_path]
+
+    def parse_numeric(self, raw_data: bytes) -> ExtractionResult:
+        """Converts ExifTool's numeric print output into the extraction result
+        :param raw_data: (bytes) ExifTool's stdout
+        :return: (ExtractionResult) structured extraction result"""
+        tags, longitudes, latitudes, altitudes = self.parse_columns(raw_data=raw_data)
+        create_date = str(tags.get('CreateDate', ''))
+        alias = self.format_alias(create_date)
+        return ExtractionResult(source=self.video_path,
+                                points=Track(longitudes, latitudes, altitudes,
+                                             alias=alias, source=self.video_path),
+                                create_date=create_date,
+                                alias=alias,
+                                tags=tags)
+
+    def parse_columns(self, raw_data: bytes) -> tuple:
+        """Parses ExifTool's numeric print output in a single pass into
+        float64 columns (NumPy arrays or array('d') if NumPy is not installed).
+        Coordinate precision and altitude data type settings are applied
+        to whole columns
+        :param raw_data: (bytes) ExifTool's stdout
+        :return: (tuple) header tags dictionary, longitudes, latitudes and altitudes"""
+        tags = {}
+        offset = 0
+        while True:  # Leading 'Tag=value' header lines
+            line_end = raw_data.find(b'\n', offset)
+            line = raw_data[offset:line_end if line_end != -1 else len(raw_data)]
+            if b'=' not in line:
+                break
+            tag, value = line.decode('utf-8', 'replace').split('=', 1)
+            tags[tag] = value.strip()
+            if line_end == -1:
+                offset = len(raw_data)
+                break
+            offset = line_end + 1
+
+        body = raw_data[offset:]
+        if numpy is not None:
+            values = numpy.array(body.split(), dtype=numpy.float64)
+        else:
+            values = array('d', map(float, body.split()))
+        count = len(values) // 3
+        return (tags, *self.format_columns(longitudes=values[0:3 * count:3],
+                                           latitudes=values[1:3 * count:3],
+                                           altitudes=values[2:3 * count:3]))
+
+    def format_columns(self, longitudes, latitudes, altitudes) -> tuple:
+        """Applies coordinate precision and altitude data type settings
+        to whole coordinate columns
+        :param longitudes: longitudes column (NumPy array or array('d'))
+        :param latitudes: latitudes column (NumPy array or array('d'))
+        :param altitudes: altitudes column (NumPy array or array('d'))
+        :return: (tuple) formatted longitudes, latitudes and altitudes,
+        NumPy arrays if NumPy is installed or arrays otherwise"""
+        integer_altitude = self.altitude_data_type == 'integer'
+        if numpy is not None:
+            longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+            latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+            altitudes = numpy.asarray(altitudes, dtype=numpy.float64)
+            return (numpy.round(longitudes, self.coordinate_precision),
+                    numpy.round(latitudes, self.coordinate_precision),
+                    numpy.trunc(altitudes).astype(numpy.int64) if integer_altitude
+                    else numpy.round(altitudes, 1))
+
+        return (array('d', (round(v, self.coordinate_precision) for v in longitudes)),
+                array('d', (round(v, self.coordinate_precision) for v in latitudes)),
+                array('q', map(int, altitudes)) if integer_altitude
+                else array('d', (round(v, 1) for v in altitudes)))
+
+    def parse_json(self, raw_data: bytes) -> ExtractionResult:
+        """Converts ExifTool's JSON output (-j -G3 -n) into the extraction result.
+        Tags of the main document are grouped as 'Main', GPS samples of
+        the embedded documents are grouped as 'Doc1', 'Doc2', etc.
+        :param raw_data: (bytes) ExifTool's stdout
+        :return: (ExtractionResult) structured extraction result"""
+        import json
+
+        return self.parse_record(record=json.loads(raw_data)[0])
+
+    def parse_record(self, record: dict) -> ExtractionResult:
+        """Converts a single video's JSON record into the extraction result
+        :param record: (dict) decoded JSON object of a single source file
+        :return: (ExtractionResult) structured extraction result"""
+        tags = {}
+        documents = {}
+        for key, value in record.items():
+            if ':' not in key:
+                continue
+            group, tag = key.rsplit(':', 1)
+            if group.startswith('Doc'):
+                document = tuple(int(n) for n in group[3:].split('-'))
+                documents.setdefault(document, {})[tag] = value
+            else:
+                tags[tag] = value
+
+        points = []
+        for document in sorted(documents):
+            sample = documents[document]
+            if not all(tag in sample for tag in self.gps_tags):
+                continue
+            points.append(self.format_point(longitude=float(sample['GPSLongitude']),
+                                            latitude=float(sample['GPSLatitude']),
+                                            altitude=float(sample['GPSAltitude'])))
+
+        create_date = str(tags.get('CreateDate', ''))
+        alias = self.format_alias(create_date)
+        source = record.get('SourceFile', self.video_path)
+        return ExtractionResult(source=source,
+                                points=Track.from_points(
+                                    points, alias=alias, source=source,
+                                    integer_altitude=self.altitude_data_type == 'integer'),
+                                create_date=create_date,
+                                alias=alias,
+                                tags=tags)
 
     def parse_data(self, raw_data: list) -> list:
         """Converts parsed raw output into a list
@@ -98,24 +445,38 @@ class EXIFExtractor:
 
         return parsed_data
 
+    def format_point(self, longitude: float, latitude: float,
+                     altitude: float) -> list:
+        """Applies coordinate precision and altitude data type settings
+        to a single numeric GPS measurement
+        :param longitude: (float) longitude in signed decimal degrees
+        :param latitude: (float) latitude in signed decimal degrees
+        :param altitude: (float) altitude in meters
+        :return: (list) longitude, latitude and altitude values"""
+        altitude = int(altitude) if self.altitude_data_type == 'integer'\
+            else round(altitude, 1)
+        return [round(longitude, self.coordinate_precision),
+                round(latitude, self.coordinate_precision),
+                altitude]
+
     def extract_default_name(self) -> str:
         """Extracts 'CreateData' EXIF tag to be used as video's
         possible default identifier/name (if no name provided during
         the later processing stages)
         :return formated_date: (str) video creation time formated
         with underscores"""
-        import subprocess, shlex
-
-        query = f'{self.exe_path} -G1 -a -s -createdate\
-        -api largefilesupport=1 {self.video_path}'
-
-        date_args = shlex.split(query)
-        output, error = subprocess.Popen(args=date_args, stdout=subprocess.PIPE,
-                                         stderr=subprocess.DEVNULL).communicate()
+        output = self.session.execute('-G1', '-a', '-s', '-createdate',
+                                      '-api', 'largefilesupport=1', self.video_path)
 
         raw_line = output.splitlines()[0].decode()
-        no_colons = raw_line.split(': ')[1].replace(':', '_')
+        return self.format_alias(raw_line.split(': ')[1])
+
+    def format_alias(self, create_date: str) -> str:
+        """Formats video's creation date to the default identifier
+        :param create_date: (str) 'CreateDate' tag's value
+        :return formated_date: (str) prefixed video creation time
+        formated with underscores"""
+        no_colons = create_date.replace(':', '_')
         formated_name = f"{self.prefix}_{no_colons.replace(' ', '_')}"
 
         return formated_name
-
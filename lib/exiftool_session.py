@@ -0,0 +1,207 @@
+"""
+ExifTool session module
+
+Keeps a long-lived ExifTool process (-stay_open mode) and feeds it
+commands via stdin, so the Perl interpreter's start-up is paid once
+per session instead of once per extraction.
+Restarts the child process automatically if it dies.
+
+© 2024 Kirill Romashchenko
+"""
+import atexit
+import os
+import subprocess
+import threading
+from lib.metrics import Metrics
+
+class ExifToolSession:
+    """
+    Session class. Class instance wraps a single ExifTool process,
+    started with '-stay_open True -@ -'. Each command is framed with
+    a numbered -execute and read back up to the matching {ready} marker.
+    Commands are serialized with a lock, hence one instance can be
+    shared between threads. Independent instances can be pooled for
+    parallel extraction
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, exe_path: str="lib/exiftool.exe") -> None:
+        """Session's constructor method. The process is started lazily,
+        on the first executed command
+        :param exe_path: (str) path to the ExifTool executable"""
+        self.exe_path = exe_path
+        self.process = None
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the session class instance
+        """
+        return f"{self.__class__.__name__} (exe_path={self.exe_path})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @classmethod
+    def shared(cls, exe_path: str="lib/exiftool.exe"):
+        """Returns process-wide session for the given executable,
+        creating it on the first call. Shared sessions are closed at exit
+        :param exe_path: (str) path to the ExifTool executable
+        :return: (ExifToolSession) shared session instance"""
+        with cls._shared_lock:
+            if exe_path not in cls._shared:
+                session = cls(exe_path=exe_path)
+                atexit.register(session.close)
+                cls._shared[exe_path] = session
+            return cls._shared[exe_path]
+
+    def is_alive(self) -> bool:
+        """Checks if the ExifTool process is running
+        :return: (bool) True if the process has been started and is alive"""
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        """Starts ExifTool process in the -stay_open mode. Commands are written
+        as UTF-8, hence file names are decoded as UTF-8 by every command
+        (-common_args), otherwise non-ASCII paths aren't found on Windows"""
+        self.process = subprocess.Popen(args=[self.exe_path, '-stay_open', 'True',
+                                              '-@', '-', '-common_args',
+                                              '-charset', 'filename=utf8'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.counter = 0
+
+    def execute(self, *args: str) -> bytes:
+        """Executes a single ExifTool command. The process is (re)started
+        if needed, and the command is retried once if the process
+        dies while executing it
+        :param args: (str) command line arguments, one value per argument.
+        No shell quoting is applied
+        :return: (bytes) command's stdout"""
+        with self.lock:
+            metrics = Metrics.shared()
+            for attempt in range(2):
+                if not self.is_alive():
+                    with metrics.timer('exiftool_spawn'):
+                        self.start()
+                try:
+                    with metrics.timer('exiftool_run'):
+                        output = self.run(args)
+                    metrics.count('bytes_read', len(output))
+                    return output
+                except (BrokenPipeError, ChildProcessError):
+                    self.terminate()
+                    if attempt:
+                        raise
+
+    def run(self, args: tuple) -> bytes:
+        """Writes framed command to the process' stdin and reads its
+        stdout back through the {ready} marker's line. The marker's line
+        terminator may arrive in a later read than the marker itself, if
+        it's left in the pipe, it prefixes the next command's output
+        :param args: (tuple) command line arguments
+        :return: (bytes) command's stdout"""
+        self.counter += 1
+        marker = f"{{ready{self.counter}}}".encode()
+        command = '\n'.join(args) + f"\n-execute{self.counter}\n"
+        self.process.stdin.write(command.encode('utf-8'))
+        self.process.stdin.flush()
+
+        descriptor = self.process.stdout.fileno()
+        output = bytearray()
+        index = -1
+        while index == -1 or output.find(b'\n', index) == -1:
+            chunk = os.read(descriptor, 65536)
+            if not chunk:
+                raise ChildProcessError('ExifTool process terminated')
+            searched = max(0, len(output) - len(marker) + 1)
+            output += chunk
+            if index == -1:
+                index = output.find(marker, searched)
+        return bytes(output[:index])
+
+    def stream(self, *args: str):
+        """Executes a single ExifTool command, yielding its stdout incrementally
+        as it's read from the pipe, hence the output is never buffered whole.
+        The session is locked from the first iteration until the generator is
+        exhausted or closed, hence consumers which may stop early must close it
+        (e.g. with contextlib.closing) rather than leave it to the garbage collector.
+        If the consumer stops early, the process is terminated (and restarted by
+        the next command), since its remaining output can't be told apart from
+        the next command's one
+        :param args: (str) command line arguments, one value per argument.
+        No shell quoting is applied
+        :return: (generator) stdout's chunks (bytes), {ready} marker excluded"""
+        metrics = Metrics.shared()
+        self.lock.acquire()
+        finished = False
+        try:
+            if not self.is_alive():
+                with metrics.timer('exiftool_spawn'):
+                    self.start()
+            self.counter += 1
+            marker = f"{{ready{self.counter}}}".encode()
+            command = '\n'.join(args) + f"\n-execute{self.counter}\n"
+            self.process.stdin.write(command.encode('utf-8'))
+            self.process.stdin.flush()
+
+            descriptor = self.process.stdout.fileno()
+            pending = b''
+            while True:
+                chunk = os.read(descriptor, 65536)
+                if not chunk:
+                    raise ChildProcessError('ExifTool process terminated')
+                metrics.count('bytes_read', len(chunk))
+                pending += chunk
+                index = pending.find(marker)
+                if index != -1:
+                    # Read through the marker's line, see run
+                    while pending.find(b'\n', index) == -1:
+                        chunk = os.read(descriptor, 65536)
+                        if not chunk:
+                            raise ChildProcessError('ExifTool process terminated')
+                        pending += chunk
+                    finished = True
+                    if index:
+                        yield pending[:index]
+                    return
+                # Marker's possible beginning is held back till the next read
+                keep = len(marker) - 1
+                if len(pending) > keep:
+                    yield pending[:-keep]
+                    pending = pending[-keep:]
+        finally:
+            try:
+                if not finished:
+                    self.terminate()
+            finally:
+                self.lock.release()
+
+    def close(self) -> None:
+        """Gracefully stops the ExifTool process"""
+        with self.lock:
+            if self.is_alive():
+                try:
+                    self.process.stdin.write(b"-stay_open\nFalse\n")
+                    self.process.stdin.flush()
+                    self.process.wait(timeout=5)
+                except (BrokenPipeError, subprocess.TimeoutExpired):
+                    pass
+            self.terminate()
+
+    def terminate(self) -> None:
+        """Kills the ExifTool process (if any) and releases its pipes"""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        for stream in [self.process.stdin, self.process.stdout]:
+            stream.close()
+        self.process = None
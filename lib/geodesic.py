@@ -0,0 +1,154 @@
+"""
+Geodesic module
+
+Computes ellipsoidal (WGS 84) distances between consecutive track points
+on the client side with Vincenty's inverse formula (sub-millimetre accuracy
+for non-antipodal points), vectorized over whole coordinate columns with
+NumPy and with a pure Python fallback. Track's length is their sum
+
+© 2024 Kirill Romashchenko
+"""
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:  # Segments are computed one by one instead
+    numpy = None
+
+class Geodesic:
+    """
+    Geodesic class. Class instance measures tracks on the ellipsoid.
+    distances method performs module's functionality
+    """
+    def __init__(self, semi_major_axis: float=6378137.0,
+                 flattening: float=1 / 298.257223563,
+                 tolerance: float=1e-12, max_iterations: int=200) -> None:
+        """Geodesic's constructor method
+        :param semi_major_axis: (float) ellipsoid's semi-major axis, meters.
+        WGS 84 by default
+        :param flattening: (float) ellipsoid's flattening. WGS 84 by default
+        :param tolerance: (float) convergence threshold of the longitude on
+        the auxiliary sphere, radians. 1e-12 (~0.006 mm) by default
+        :param max_iterations: (int) iterations limit. 200 by default"""
+        self.a = semi_major_axis
+        self.f = flattening
+        self.b = (1 - flattening) * semi_major_axis
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the geodesic class instance
+        """
+        return f"{self.__class__.__name__} (a={self.a}, f={self.f})"
+
+    def length(self, longitudes, latitudes) -> float:
+        """Measures polyline's length
+        :param longitudes: longitudes column, decimal degrees
+        :param latitudes: latitudes column, decimal degrees
+        :return: (float) length, meters"""
+        return math.fsum(self.distances(longitudes, latitudes))
+
+    def distances(self, longitudes, latitudes):
+        """Measures each segment between consecutive points
+        :param longitudes: longitudes column, decimal degrees
+        :param latitudes: latitudes column, decimal degrees
+        :return: segment lengths (meters), one less than points:
+        NumPy array if NumPy is installed or array('d') otherwise"""
+        if len(longitudes) < 2:
+            return numpy.zeros(0) if numpy is not None else array('d')
+        if numpy is not None:
+            longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+            latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                return self.inverse_numpy(longitudes[:-1], latitudes[:-1],
+                                          longitudes[1:], latitudes[1:])
+        longitudes = list(longitudes)
+        latitudes = list(latitudes)
+        return array('d', [self.inverse(longitudes[i], latitudes[i],
+                                        longitudes[i + 1], latitudes[i + 1])
+                           for i in range(len(longitudes) - 1)])
+
+    def inverse_numpy(self, lon1, lat1, lon2, lat2):
+        """Vincenty's inverse formula over coordinate arrays. Iterates until
+        every segment converges (or the iterations limit is reached)
+        :return: (numpy.ndarray) distances, meters"""
+        a, b, f = self.a, self.b, self.f
+        difference = numpy.radians(lon2 - lon1)
+        u1 = numpy.arctan((1 - f) * numpy.tan(numpy.radians(lat1)))
+        u2 = numpy.arctan((1 - f) * numpy.tan(numpy.radians(lat2)))
+        sin_u1, cos_u1 = numpy.sin(u1), numpy.cos(u1)
+        sin_u2, cos_u2 = numpy.sin(u2), numpy.cos(u2)
+
+        lam = difference
+        for _ in range(self.max_iterations):
+            sin_lam, cos_lam = numpy.sin(lam), numpy.cos(lam)
+            sin_sigma = numpy.hypot(cos_u2 * sin_lam,
+                                    cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = numpy.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = numpy.where(sin_sigma == 0, 0.0,
+                                    cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines: cos2_alpha = 0
+            cos_2sigma_m = numpy.where(cos2_alpha == 0, 0.0,
+                                       cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = difference + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma *
+                                         (-1 + 2 * cos_2sigma_m ** 2)))
+            if numpy.all(numpy.abs(lam - previous) <= self.tolerance):
+                break
+
+        u_squared = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_squared / 16384 * (4096 + u_squared * (-768 + u_squared *
+                                                             (320 - 175 * u_squared)))
+        big_b = u_squared / 1024 * (256 + u_squared * (-128 + u_squared *
+                                                       (74 - 47 * u_squared)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - big_b / 6 * cos_2sigma_m *
+            (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        return b * big_a * (sigma - delta_sigma)
+
+    def inverse(self, lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+        """Vincenty's inverse formula for a single segment
+        :return: (float) distance, meters"""
+        a, b, f = self.a, self.b, self.f
+        difference = math.radians(lon2 - lon1)
+        u1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+        u2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+        sin_u1, cos_u1 = math.sin(u1), math.cos(u1)
+        sin_u2, cos_u2 = math.sin(u2), math.cos(u2)
+
+        lam = difference
+        for _ in range(self.max_iterations):
+            sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+            sin_sigma = math.hypot(cos_u2 * sin_lam,
+                                   cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            if sin_sigma == 0:
+                return 0.0  # Coincident points
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = math.atan2(sin_sigma, cos_sigma)
+            sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha\
+                if cos2_alpha else 0.0
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = difference + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma *
+                                         (-1 + 2 * cos_2sigma_m ** 2)))
+            if abs(lam - previous) <= self.tolerance:
+                break
+
+        u_squared = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_squared / 16384 * (4096 + u_squared * (-768 + u_squared *
+                                                             (320 - 175 * u_squared)))
+        big_b = u_squared / 1024 * (256 + u_squared * (-128 + u_squared *
+                                                       (74 - 47 * u_squared)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - big_b / 6 * cos_2sigma_m *
+            (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        return b * big_a * (sigma - delta_sigma)
@@ -0,0 +1,227 @@
+"""
+Ingest manifest module
+
+Keeps track of already ingested videos, keyed by a cheap file fingerprint
+(path, size, modification time and a hash of the moov box header).
+Manifest is stored in the target Database next to the point/line tables,
+optionally mirrored to a local SQLite file. Unchanged videos are skipped
+on re-runs without being extracted again
+
+© 2024 Kirill Romashchenko
+"""
+import hashlib
+import mmap
+import os
+import sqlite3
+import psycopg
+from typing import Union
+
+class IngestManifest:
+    """
+    Manifest class. Class instance fingerprints videos, looks up
+    already ingested ones in a single query and records new ones
+    """
+    moov_sample = 65536  # Amount of moov's leading bytes being hashed
+    created_tables = set()  # Manifest tables created by the process, per Database
+
+    def __init__(self, table_names: list) -> None:
+        """Manifest's constructor method. Reads settings (settings.json)
+        :param table_names: (list) target table names. Manifest entries
+        are scoped to the target tables, so re-targeting other tables
+        within the same Database ingests videos again"""
+        from lib.settings_reader import Reader
+
+        self.settings = Reader().get_settings()
+        self.schema = self.settings["Default schema"]
+        self.default_file = self.settings["Default filename"]
+        self.table_name = self.settings.get("Manifest table", "ingest_manifest")
+        self.mirror_path = self.settings.get("Manifest mirror")
+        self.target = ','.join(table_names)
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the manifest class instance
+        """
+        return f"{self.__class__.__name__} (table_name={self.table_name}, target={self.target})"
+
+    def fingerprint(self, folder: str) -> Union[dict, None]:
+        """Fingerprints folder's target video
+        :param folder: (str) absolute path to the folder containing the target video
+        :return: (dict) manifest entry or None if the video is not readable"""
+        return self.fingerprint_file(video_path=f"{folder}/{self.default_file}")
+
+    @classmethod
+    def fingerprint_file(cls, video_path: str) -> Union[dict, None]:
+        """Fingerprints a video. Only file's metadata and moov box's
+        leading bytes are read
+        :param video_path: (str) path to the video
+        :return: (dict) manifest entry or None if the video is not readable"""
+        from lib.quicktime_reader import QuickTimeReader
+
+        try:
+            stat = os.stat(video_path)
+            moov_hash = hashlib.blake2b(digest_size=16)
+            with open(video_path, 'rb') as video:
+                with mmap.mmap(video.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    for box_type, payload, box_end in\
+                            QuickTimeReader.iterate_boxes(buffer, 0, len(buffer)):
+                        if box_type == b'moov':
+                            moov_hash.update(buffer[payload:min(box_end,
+                                                                payload + cls.moov_sample)])
+                            moov_hash.update(str(box_end - payload).encode())
+                            break
+        except (OSError, ValueError):
+            return None
+
+        key = f"{video_path}|{stat.st_size}|{stat.st_mtime_ns}|{moov_hash.hexdigest()}"
+        return {'fingerprint': hashlib.blake2b(key.encode(), digest_size=20).hexdigest(),
+                'path': video_path,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'moov_hash': moov_hash.hexdigest()}
+
+    def create_table(self, connection: psycopg.Connection) -> None:
+        """Creates manifest table (if not exists) once per Database, e.g. in the
+        batch's preparation. Lookups and records expect the table to exist
+        :param connection: (psycopg.Connection) Database connection"""
+        key = (connection.info.dbname, self.schema, self.table_name)
+        if key in self.created_tables:
+            return
+        with connection.transaction(), connection.cursor() as cur:
+            cur.execute(self.table_query())
+        self.created_tables.add(key)
+
+    async def create_table_async(self, connection: psycopg.AsyncConnection) -> None:
+        """Creates manifest table via an asynchronous connection (see create_table)
+        :param connection: (psycopg.AsyncConnection) Database connection"""
+        key = (connection.info.dbname, self.schema, self.table_name)
+        if key in self.created_tables:
+            return
+        async with connection.transaction():
+            async with connection.cursor() as cur:
+                await cur.execute(self.table_query())
+        self.created_tables.add(key)
+
+    def table_query(self) -> str:
+        """Builds manifest table's creation query
+        :return: (str) CREATE TABLE IF NOT EXISTS statement"""
+        return f"""
+                CREATE TABLE IF NOT EXISTS {self.schema}.{self.table_name}
+                (fingerprint varchar(40),
+                target text,
+                path text,
+                size bigint,
+                mtime double precision,
+                moov_hash varchar(32),
+                video text,
+                ingested_at timestamptz DEFAULT now(),
+                PRIMARY KEY (fingerprint, target));"""
+
+    def record_query(self) -> str:
+        """Builds manifest entry's insertion query
+        :return: (str) INSERT ... ON CONFLICT DO NOTHING statement"""
+        return f"""
+                    INSERT INTO {self.schema}.{self.table_name}
+                    (fingerprint, target, path, size, mtime, moov_hash, video)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (fingerprint, target) DO NOTHING;"""
+
+    def lookup(self, fingerprints: list,
+               connection: psycopg.Connection=None) -> set:
+        """Looks up already ingested videos among candidates with a single query
+        :param fingerprints: (list) candidate fingerprints
+        :param connection: (psycopg.Connection) Database connection. None by default.
+        If no connection provided, the local SQLite mirror is queried instead
+        :return: (set) already ingested fingerprints"""
+        if not fingerprints:
+            return set()
+        if connection is None:
+            return self.lookup_mirror(fingerprints)
+        with connection.cursor() as cur:
+            cur.execute(f"""SELECT fingerprint FROM {self.schema}.{self.table_name}
+                            WHERE target = %s AND fingerprint = ANY(%s);""",
+                        (self.target, list(fingerprints)))
+            return {row[0] for row in cur}
+
+    def record(self, entries: list, connection: psycopg.Connection=None) -> None:
+        """Records ingested videos in the Database, within the connection's
+        transaction (if any) so they're committed along with the videos' rows.
+        Without a connection, videos are recorded in the local mirror (if set)
+        instead, i.e. once the Database's transaction is committed
+        :param entries: (list) manifest entries (see fingerprint method),
+        each one supplemented with the 'video' (identifier) key
+        :param connection: (psycopg.Connection) Database connection. None by default"""
+        rows = self.rows(entries)
+        if not rows:
+            return
+        if connection is None:
+            self.record_mirror(rows)
+            return
+        with connection.transaction(), connection.cursor() as cur:
+            cur.executemany(self.record_query(), rows)
+
+    async def record_async(self, entries: list,
+                           connection: psycopg.AsyncConnection) -> None:
+        """Records ingested videos in the Database via an asynchronous
+        connection, within its transaction (see record method)
+        :param entries: (list) manifest entries supplemented with the 'video' key
+        :param connection: (psycopg.AsyncConnection) Database connection"""
+        rows = self.rows(entries)
+        if not rows:
+            return
+        async with connection.transaction():
+            async with connection.cursor() as cur:
+                await cur.executemany(self.record_query(), rows)
+
+    def rows(self, entries: list) -> list:
+        """Converts manifest entries to the manifest table's rows
+        :param entries: (list) manifest entries supplemented with the 'video' key
+        :return: (list) row tuples"""
+        return [(e['fingerprint'], self.target, e['path'], e['size'], e['mtime'],
+                 e['moov_hash'], e.get('video')) for e in entries]
+
+    def record_mirror(self, rows: list) -> None:
+        """Records manifest rows in the local SQLite mirror (if set)
+        :param rows: (list) row tuples (see rows method)"""
+        if self.mirror_path:
+            mirror = self.open_mirror()
+            try:
+                with mirror:  # Commits on success
+                    mirror.executemany(f"""
+                        INSERT OR IGNORE INTO {self.table_name}
+                        (fingerprint, target, path, size, mtime, moov_hash, video)
+                        VALUES (?, ?, ?, ?, ?, ?, ?);""", rows)
+            finally:
+                mirror.close()
+
+    def open_mirror(self) -> sqlite3.Connection:
+        """Opens the local SQLite mirror, creating its table if needed
+        :return: (sqlite3.Connection) mirror's connection"""
+        mirror = sqlite3.connect(self.mirror_path)
+        mirror.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name}
+            (fingerprint TEXT, target TEXT, path TEXT, size INTEGER,
+            mtime REAL, moov_hash TEXT, video TEXT,
+            ingested_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (fingerprint, target));""")
+        return mirror
+
+    def lookup_mirror(self, fingerprints: list) -> set:
+        """Looks up already ingested videos in the local SQLite mirror
+        :param fingerprints: (list) candidate fingerprints
+        :return: (set) already ingested fingerprints"""
+        if not self.mirror_path:
+            return set()
+        found = set()
+        mirror = self.open_mirror()
+        try:
+            for i in range(0, len(fingerprints), 500):  # SQLite's parameters limit
+                chunk = list(fingerprints[i:i + 500])
+                placeholders = ','.join('?' * len(chunk))
+                rows = mirror.execute(f"""SELECT fingerprint FROM {self.table_name}
+                                          WHERE target = ? AND fingerprint IN ({placeholders});""",
+                                      [self.target] + chunk)
+                found.update(row[0] for row in rows)
+        finally:
+            mirror.close()
+        return found
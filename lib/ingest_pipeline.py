@@ -0,0 +1,580 @@
+"""
+Ingest pipeline module
+
+Extracts and inserts many videos concurrently. A pool of extraction
+workers (threads or processes) feeds a smaller pool of Database writers.
+Stages are connected by bounded queues, hence fast extraction is throttled
+by slow writers (backpressure) instead of piling tracks up in memory.
+Reports per-stage throughput
+
+© 2024 Kirill Romashchenko
+"""
+import queue
+import threading
+import time
+import psycopg
+from typing import Union
+from lib.db_connector import DBConnector
+from lib.db_packer import DBPacker
+from lib.metrics import Metrics
+
+
+def extract_video(video: str, session=None) -> tuple:
+    """Extraction stage's unit of work. Module-level function,
+    hence it can be sent to the worker processes
+    :param video: (str) absolute path to the folder containing the target video
+    :param session: (ExifToolSession) ExifTool session to extract with.
+    None (process-wide shared session) by default
+    :return: (tuple) parsed data and video's default alias"""
+    packer = DBPacker(video=video)
+    packer.extract_data(session=session)
+    return packer.parsed_data, packer.default_video_alias
+
+
+def extract_videos(videos: list, session=None) -> tuple:
+    """Batched extraction stage's unit of work: videos missing from the track
+    cache are extracted with a single ExifTool command (see
+    EXIFExtractor.extract_batch), then cached
+    :param videos: (list) absolute paths to the folders containing target videos
+    :param session: (ExifToolSession) ExifTool session to extract with.
+    None (process-wide shared session) by default
+    :return: (tuple) dictionaries of the extracted videos' (parsed data, default
+    alias) tuples and of the failed videos' errors, keyed by folder"""
+    from lib.exif_extractor import EXIFExtractor
+
+    extracted, errors, pending = {}, {}, {}
+    for video in videos:
+        try:
+            extractor = EXIFExtractor(input_path=video, session=session)
+            key, cached = extractor.cached_track()
+        except Exception as error:
+            errors[video] = repr(error)
+            continue
+        if cached:
+            extracted[video] = cached, cached.alias
+        else:
+            pending[extractor.video_path] = video, extractor, key
+    if pending:
+        for result in EXIFExtractor.extract_batch(input_paths=[video for video, _, _
+                                                               in pending.values()],
+                                                  chunk_size=len(pending),
+                                                  sessions=[session] if session else None):
+            if result.source not in pending:
+                continue
+            video, extractor, key = pending[result.source]
+            extractor.store(key=key, result=result)
+            extracted[video] = result.points, result.alias
+    for video, _, _ in pending.values():
+        if video not in extracted:
+            errors[video] = repr(ChildProcessError('No ExifTool output for the video'))
+    return extracted, errors
+
+
+class StageStats:
+    """
+    Stage statistics class. Accumulates processed videos, points
+    and busy time of a single pipeline stage. Thread-safe
+    """
+    def __init__(self, name: str) -> None:
+        """Statistics' constructor method
+        :param name: (str) stage's name"""
+        self.name = name
+        self.videos = 0
+        self.points = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, points: int, elapsed: float, failed: bool=False) -> None:
+        """Records a single processed video
+        :param points: (int) amount of processed points
+        :param elapsed: (float) time spent on the video, in seconds
+        :param failed: (bool) flag indicating failed processing. False by default"""
+        with self.lock:
+            self.busy += elapsed
+            if failed:
+                self.failed += 1
+            else:
+                self.videos += 1
+                self.points += points
+
+    def report(self, wall_time: float) -> dict:
+        """Summarizes stage's throughput
+        :param wall_time: (float) whole run's duration, in seconds
+        :return: (dict) stage's counters and rates"""
+        return {'videos': self.videos,
+                'points': self.points,
+                'failed': self.failed,
+                'busy_seconds': round(self.busy, 3),
+                'videos_per_second': round(self.videos / wall_time, 3) if wall_time else 0,
+                'points_per_second': round(self.points / wall_time, 1) if wall_time else 0}
+
+
+class IngestPipeline:
+    """
+    Pipeline class. Class instance runs extraction and insertion of a batch
+    of videos concurrently. Usable from both the GUI and headless scripts
+    """
+    def __init__(self, db_name: str, user: str, credentials: str,
+                 table_names: list, geometry: str='Both',
+                 extract_workers: int=4, write_workers: int=2,
+                 queue_size: int=8, processes: bool=False,
+                 skip_ingested: bool=False, streaming: bool=False,
+                 defer_indexes: bool=False, batch_size: int=1,
+                 on_event=None) -> None:
+        """Pipeline's constructor method
+        :param db_name: (str) target Database name
+        :param user: (str) username
+        :param credentials: (str) user's password
+        :param table_names: (list) a list with either one or two target table
+        names as strings, depending on the geometry type
+        :param geometry: (str) geometry type(s) flag as a string.
+        Possible values: 'Point', 'Line', 'Both'. 'Both' is the default
+        :param extract_workers: (int) amount of extraction workers. 4 by default
+        :param write_workers: (int) amount of Database writers (i.e. connections).
+        2 by default
+        :param queue_size: (int) capacity of each queue between stages. 8 by default
+        :param processes: (bool) enables/disables running extraction in worker
+        processes instead of threads. False by default
+        :param skip_ingested: (bool) enables/disables skipping of the videos
+        already ingested into the target tables (see ingest manifest). Ingested
+        videos are recorded to the manifest. False by default
+        :param streaming: (bool) enables/disables streaming extraction: points are
+        copied to the Database chunk by chunk while being extracted, by the writers
+        (see DBPacker.insert_streamed). Extraction workers only pass videos
+        through then. False by default
+        :param defer_indexes: (bool) enables/disables deferred index maintenance:
+        geometry and video identifier indexes of the target tables are dropped
+        before the batch and rebuilt after it. False by default
+        :param batch_size: (int) maximal amount of videos an extraction worker
+        passes to a single ExifTool command (see extract_videos). Workers batch
+        the videos already waiting in the queue. Used by in-thread, non-streaming
+        extraction with the 'exiftool' engine only. 1 (a command per video) by default
+        :param on_event: (callable) callback receiving (event, video, detail)
+        per each processing event ('prepared', 'skipped', 'started', 'extracted',
+        'written', 'failed', 'cancelled', 'indexed'). Called from worker threads.
+        None by default"""
+        from lib.ingest_manifest import IngestManifest
+        from lib.settings_reader import Reader
+
+        self.db_name = db_name
+        self.user = user
+        self.credentials = credentials
+        self.table_names = table_names
+        self.geometry = geometry
+        self.extract_workers = extract_workers
+        self.write_workers = write_workers
+        self.queue_size = queue_size
+        self.processes = processes
+        self.streaming = streaming and geometry != 'Line'
+        self.defer_indexes = defer_indexes
+        engine = Reader().get_settings().get('Extraction engine', 'exiftool')
+        self.batch_size = max(1, batch_size) if engine == 'exiftool'\
+            and not (processes or self.streaming) else 1
+        self.on_event = on_event
+        self.manifest = IngestManifest(table_names=table_names) if skip_ingested else None
+        self.fingerprints = {}
+
+        self.cancelled = threading.Event()
+        self.resumed = threading.Event()  # Cleared while paused
+        self.resumed.set()
+
+        self.extraction = StageStats('extraction')
+        self.writing = StageStats('writing')
+        self.failures = []
+        self.skipped = 0
+        self.rebuild_seconds = None
+        self.wall_time = 0.0
+        self.metrics = Metrics.shared()  # Per-video stage timings, reset per run
+        self.sessions = {}  # Worker threads' own ExifTool sessions, closed per run
+        self.sessions_lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the pipeline class instance
+        """
+        return (f"{self.__class__.__name__} (db_name={self.db_name}, "
+                f"extract_workers={self.extract_workers}, "
+                f"write_workers={self.write_workers})")
+
+    def emit(self, event: str, video: str, detail=None) -> None:
+        """Passes processing event to the callback (if any)
+        :param event: (str) event name
+        :param video: (str) video's folder
+        :param detail: event's payload. None by default"""
+        if self.on_event:
+            self.on_event(event, video, detail)
+
+    def pause(self) -> None:
+        """Pauses the run. Videos being processed are completed,
+        the next ones wait for resume"""
+        self.resumed.clear()
+
+    def resume(self) -> None:
+        """Resumes the paused run"""
+        self.resumed.set()
+
+    def cancel(self) -> None:
+        """Cancels the run. Videos being processed are completed,
+        the remaining ones are skipped"""
+        self.cancelled.set()
+        self.resumed.set()
+
+    def proceed(self) -> bool:
+        """Blocks while the run is paused
+        :return: (bool) False if the run has been cancelled"""
+        self.resumed.wait()
+        return not self.cancelled.is_set()
+
+    def prepare(self, new: bool) -> list:
+        """Creates target Database and tables (for the new Database only)
+        and the ingest manifest's table (if skipping ingested videos)
+        :param new: (bool) flag, enables/disables new Database creation
+        :return: (list) informational messages"""
+        if not (new or self.manifest):
+            return []
+        packer = DBPacker(video='')
+        messages = []
+        if new:
+            with DBConnector(db_name='postgres', user=self.user,
+                             credentials=self.credentials,
+                             autocommit=True).connection() as connection:
+                messages.append(packer.create_database(connection=connection,
+                                                       database_name=self.db_name,
+                                                       verbose=False, to_console=True))
+        with DBConnector(db_name=self.db_name, user=self.user,
+                         credentials=self.credentials, pooled=True,
+                         max_size=self.write_workers).connection() as connection:
+            if new:
+                packer.create_columns(connection=connection,
+                                      table_names=self.table_names,
+                                      geometry=self.geometry)
+            if self.manifest:
+                self.manifest.create_table(connection=connection)
+        return messages
+
+    def run(self, videos: list, new: bool=False) -> dict:
+        """Processes a batch of videos. Blocks until the batch is complete
+        :param videos: (list) tuples of video's folder and alias (None for
+        the default alias)
+        :param new: (bool) flag, enables/disables new Database creation. False by default
+        :return: (dict) per-stage throughput report"""
+        from concurrent.futures import ProcessPoolExecutor
+
+        start = time.perf_counter()
+        self.metrics.reset()
+        for message in self.prepare(new=new):
+            self.emit('prepared', '', message)
+        if self.manifest and not new:
+            videos = self.filter_ingested(videos)
+        if self.defer_indexes and videos:
+            self.drop_indexes()
+
+        tasks = queue.Queue(maxsize=self.queue_size)
+        results = queue.Queue(maxsize=self.queue_size)
+        pool = ProcessPoolExecutor(max_workers=self.extract_workers)\
+            if self.processes else None
+
+        extractors = [threading.Thread(target=self.extract_loop,
+                                       args=(tasks, results, pool), daemon=True)
+                      for _ in range(self.extract_workers)]
+        writers = [threading.Thread(target=self.write_loop,
+                                    args=(results,), daemon=True)
+                   for _ in range(self.write_workers)]
+        for worker in extractors + writers:
+            worker.start()
+        try:
+            for video in videos:
+                if not self.proceed():
+                    break
+                tasks.put(video)
+        finally:
+            for _ in extractors:
+                tasks.put(None)
+            for worker in extractors:
+                worker.join()
+            for _ in writers:
+                results.put(None)
+            for worker in writers:
+                worker.join()
+            if pool:
+                pool.shutdown()
+            self.close_sessions()
+            if self.defer_indexes and videos:
+                self.rebuild_indexes()
+
+        self.wall_time = time.perf_counter() - start
+        return self.report()
+
+    def thread_session(self):
+        """Returns ExifTool session owned by the calling worker thread, so
+        extraction threads don't serialize on the shared session. Sessions
+        are the pipeline's own, hence other pipelines' runs don't close them
+        :return: (ExifToolSession) calling thread's session"""
+        from lib.exiftool_session import ExifToolSession
+
+        identifier = threading.get_ident()
+        with self.sessions_lock:
+            if identifier not in self.sessions:
+                self.sessions[identifier] = ExifToolSession()
+            return self.sessions[identifier]
+
+    def close_sessions(self) -> None:
+        """Closes the sessions created by thread_session, once the workers are done"""
+        with self.sessions_lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def drop_indexes(self) -> None:
+        """Drops target tables' indexes ahead of the batch (deferred index maintenance)"""
+        packer = DBPacker(video='')
+        with DBConnector(db_name=self.db_name, user=self.user,
+                         credentials=self.credentials, pooled=True,
+                         max_size=self.write_workers).connection() as connection:
+            packer.drop_indexes(connection=connection,
+                                tables=packer.indexed_tables(self.table_names, self.geometry))
+
+    def rebuild_indexes(self) -> None:
+        """Rebuilds target tables' indexes after the batch and reports the rebuild time"""
+        packer = DBPacker(video='')
+        with DBConnector(db_name=self.db_name, user=self.user,
+                         credentials=self.credentials, pooled=True,
+                         max_size=self.write_workers).connection() as connection:
+            message = packer.rebuild_indexes(connection=connection,
+                                             tables=packer.indexed_tables(self.table_names,
+                                                                          self.geometry),
+                                             verbose=False, to_console=True)
+        self.rebuild_seconds = packer.rebuild_seconds
+        self.emit('indexed', '', message)
+
+    def filter_ingested(self, videos: list) -> list:
+        """Drops videos already ingested into the target tables
+        :param videos: (list) tuples of video's folder and alias
+        :return: (list) videos to be ingested"""
+        with DBConnector(db_name=self.db_name, user=self.user,
+                         credentials=self.credentials, pooled=True,
+                         max_size=self.write_workers).connection() as connection:
+            pending, self.fingerprints = DBPacker.filter_ingested(
+                connection=connection,
+                folders=[video for video, _ in videos],
+                table_names=self.table_names,
+                workers=self.extract_workers * 2)
+        pending = set(pending)
+        for video, _ in videos:
+            if video not in pending:
+                self.skipped += 1
+                self.emit('skipped', video)
+        return [task for task in videos if task[0] in pending]
+
+    def extract_loop(self, tasks: queue.Queue, results: queue.Queue, pool) -> None:
+        """Extraction worker's loop
+        :param tasks: (queue.Queue) input queue of (folder, alias) tuples
+        :param results: (queue.Queue) output queue of extracted videos
+        :param pool: (ProcessPoolExecutor) worker processes. None for in-thread extraction"""
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if self.batch_size > 1:
+                if not self.extract_batch(task=task, tasks=tasks, results=results):
+                    break
+                continue
+            video, alias = task
+            if not self.proceed():
+                self.emit('cancelled', video)
+                continue
+            self.emit('started', video)
+            if self.streaming:  # Extracted by the writer while being copied
+                results.put((video, alias, None, None))
+                continue
+            started = time.perf_counter()
+            try:
+                with self.metrics.video(video):
+                    if pool:
+                        # Worker processes' measurements stay there, the whole
+                        # extraction is timed here instead
+                        with self.metrics.timer('extract'):
+                            parsed_data, default_alias = pool.submit(extract_video,
+                                                                     video).result()
+                        self.metrics.count('points', len(parsed_data))
+                    else:
+                        parsed_data, default_alias = extract_video(
+                            video, session=self.thread_session())
+            except Exception as error:
+                self.extraction.record(0, time.perf_counter() - started, failed=True)
+                self.failures.append((video, repr(error)))
+                self.metrics.finish(video, status='failed')
+                self.emit('failed', video, repr(error))
+                continue
+            self.extraction.record(len(parsed_data), time.perf_counter() - started)
+            self.emit('extracted', video, len(parsed_data))
+            results.put((video, alias, parsed_data, default_alias))
+
+    def extract_batch(self, task: tuple, tasks: queue.Queue, results: queue.Queue) -> bool:
+        """Extracts the task along with the tasks already waiting in the queue
+        (up to batch_size videos) with a single ExifTool command. Batch's time
+        is shared by its videos
+        :param task: (tuple) first task's (folder, alias) tuple
+        :param tasks: (queue.Queue) input queue of (folder, alias) tuples
+        :param results: (queue.Queue) output queue of extracted videos
+        :return: (bool) False if the queue's end has been reached"""
+        batch, proceeding = [], True
+        while True:
+            video, alias = task
+            if not self.proceed():
+                self.emit('cancelled', video)
+            else:
+                self.emit('started', video)
+                batch.append(task)
+            if len(batch) == self.batch_size:
+                break
+            try:
+                task = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                proceeding = False
+                break
+        if not batch:
+            return proceeding
+
+        started = time.perf_counter()
+        try:
+            extracted, errors = extract_videos(videos=[video for video, _ in batch],
+                                               session=self.thread_session())
+        except Exception as error:
+            extracted, errors = {}, {video: repr(error) for video, _ in batch}
+        elapsed = (time.perf_counter() - started) / len(batch)
+        for video, alias in batch:
+            if video not in extracted:
+                self.extraction.record(0, elapsed, failed=True)
+                self.failures.append((video, errors[video]))
+                self.metrics.finish(video, status='failed')
+                self.emit('failed', video, errors[video])
+                continue
+            parsed_data, default_alias = extracted[video]
+            with self.metrics.video(video):
+                self.metrics.record('extract', elapsed)
+                self.metrics.count('points', len(parsed_data))
+            self.extraction.record(len(parsed_data), elapsed)
+            self.emit('extracted', video, len(parsed_data))
+            results.put((video, alias, parsed_data, default_alias))
+        return proceeding
+
+    def write_loop(self, results: queue.Queue) -> None:
+        """Database writer's loop. Connections are checked out of the
+        shared pool per video
+        :param results: (queue.Queue) input queue of extracted videos"""
+        connector = DBConnector(db_name=self.db_name, user=self.user,
+                                credentials=self.credentials, pooled=True,
+                                max_size=self.write_workers)
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            video, alias, parsed_data, default_alias = item
+            if not self.proceed():
+                self.metrics.finish(video, status='cancelled')
+                self.emit('cancelled', video)
+                continue
+            started = time.perf_counter()
+            status, points, detail, entry = 'failed', 0, None, None
+            try:
+                with self.metrics.video(video):
+                    packer = DBPacker(video=video, alias=alias)
+                    packer.parsed_data = parsed_data
+                    packer.default_video_alias = default_alias
+                    with connector.connection() as connection:
+                        # Points, lines and the manifest entry are committed at once
+                        with packer.transaction(connection):
+                            detail = self.write(packer=packer, connection=connection)
+                            if self.manifest:
+                                entry = self.record_ingested(packer=packer,
+                                                             connection=connection)
+                    if entry:
+                        self.manifest.record(entries=[entry])  # Local mirror
+                points = packer.streamed_points if parsed_data is None else len(parsed_data)
+                status = 'written'
+            except Exception as error:
+                # Any failure is the video's one, the writer keeps draining the queue,
+                # otherwise the extractors (and the run) would block on the full queue
+                detail = repr(error)
+                self.failures.append((video, detail))
+            finally:
+                # Video's bookkeeping is done whatever the outcome, hence the stage
+                # report and the metrics always add up to the batch
+                self.writing.record(points, time.perf_counter() - started,
+                                    failed=status == 'failed')
+                self.metrics.finish(video, status=status)
+            self.emit(status, video, detail)
+
+    def write(self, packer: DBPacker, connection: psycopg.Connection) -> list:
+        """Inserts a single extracted video according to the geometry type
+        :param packer: (DBPacker) packer holding video's parsed data
+        :param connection: (psycopg.Connection) writer's connection
+        :return: (list) informational messages"""
+        if packer.parsed_data is None:
+            messages = packer.insert_streamed(connection=connection,
+                                              table_names=self.table_names,
+                                              geometry=self.geometry,
+                                              alias=packer.alias,
+                                              verbose=False,
+                                              to_console=True,
+                                              session=self.thread_session())
+        else:
+            messages = packer.insert_data(connection=connection,
+                                          table_names=self.table_names,
+                                          geometry=self.geometry,
+                                          alias=packer.alias,
+                                          verbose=False,
+                                          to_console=True)
+        return list(messages) if isinstance(messages, tuple) else [messages]
+
+    def record_ingested(self, packer: DBPacker,
+                        connection: psycopg.Connection) -> Union[dict, None]:
+        """Records written video to the ingest manifest within the video's transaction.
+        The local mirror (if set) is left to the caller, once it's committed
+        :param packer: (DBPacker) packer holding video's data
+        :param connection: (psycopg.Connection) writer's connection
+        :return: (dict) recorded manifest entry or None if the video is not readable"""
+        entry = self.fingerprints.get(packer.video) or self.manifest.fingerprint(packer.video)
+        if entry:
+            entry = dict(entry, video=packer.alias if packer.alias
+                         else packer.default_video_alias)
+            with self.metrics.timer('manifest_record'):
+                self.manifest.record(entries=[entry], connection=connection)
+        return entry
+
+    def report(self) -> dict:
+        """Summarizes the last run
+        :return: (dict) per-stage counters and rates"""
+        return {'wall_seconds': round(self.wall_time, 3),
+                'extraction': self.extraction.report(self.wall_time),
+                'writing': self.writing.report(self.wall_time),
+                'skipped': self.skipped,
+                'index_rebuild_seconds': self.rebuild_seconds,
+                'failures': list(self.failures),
+                'metrics': self.metrics.report()}
+
+    def summary(self) -> list:
+        """Formats the last run's report as human-readable lines
+        :return: (list) summary lines"""
+        report = self.report()
+        lines = [f"Processed in {report['wall_seconds']} s"]
+        if report['skipped']:
+            lines.append(f"Skipped {report['skipped']} already ingested videos")
+        if report['index_rebuild_seconds'] is not None:
+            lines.append(f"Indexes rebuilt in {report['index_rebuild_seconds']} s")
+        for stage in ['extraction', 'writing']:
+            stats = report[stage]
+            lines.append(f"{stage.capitalize()}: {stats['videos']} videos,"
+                         f" {stats['points']} points,"
+                         f" {stats['videos_per_second']} videos/s,"
+                         f" {stats['points_per_second']} points/s,"
+                         f" {stats['failed']} failed")
+        stages = self.metrics.summary()
+        if stages:
+            lines.append("Stage timings:")
+            lines.extend(stages)
+        return lines
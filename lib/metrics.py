@@ -0,0 +1,228 @@
+"""
+Ingest metrics module
+
+Lightweight instrumentation of the ingest path. Stage timings (ExifTool
+spawn and runtime, parsing, connecting, each insert statement, commits)
+and counters (points, bytes read) are recorded per video and aggregated
+per batch. Finished videos are exported as JSON lines, aggregates as
+a Prometheus textfile (node_exporter's textfile collector format)
+
+© 2024 Kirill Romashchenko
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+_video = contextvars.ContextVar('metrics_video', default='')  # Video being measured
+
+
+class Metrics:
+    """
+    Metrics class. Class instance collects stage timings and counters.
+    The measured video is tracked per thread and per asyncio task
+    (a context variable), hence measurements of concurrent packers aren't
+    mixed up. Measurements outside of any video (batch set-up, index
+    rebuild) are kept under the empty name. Thread-safe
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+    namespace = 'quicktime_ingest'  # Prometheus metric names' prefix
+
+    def __init__(self, jsonl_path: str=None, textfile_path: str=None) -> None:
+        """Metrics' constructor method
+        :param jsonl_path: (str) path to the JSON lines file finished videos
+        are appended to. None (no export) by default
+        :param textfile_path: (str) path to the Prometheus textfile.
+        None (no export) by default"""
+        self.jsonl_path = jsonl_path
+        self.textfile_path = textfile_path
+        self.lock = threading.Lock()
+        self.videos = {}  # Records of the videos being measured
+        self.stages = {}  # Calls, total and maximal seconds per stage
+        self.counters = {}
+        self.finished = 0
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the metrics class instance
+        """
+        return (f"{self.__class__.__name__} (jsonl_path={self.jsonl_path}, "
+                f"textfile_path={self.textfile_path})")
+
+    @classmethod
+    def shared(cls):
+        """Returns process-wide metrics configured in settings
+        ('Metrics JSON lines' and 'Metrics textfile'), creating them on the first call
+        :return: (Metrics) shared metrics instance"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                from lib.settings_reader import Reader
+
+                settings = Reader().get_settings()
+                cls._shared = cls(jsonl_path=settings.get("Metrics JSON lines"),
+                                  textfile_path=settings.get("Metrics textfile"))
+            return cls._shared
+
+    def reset(self) -> None:
+        """Drops all measurements, e.g. ahead of a new batch"""
+        with self.lock:
+            self.videos = {}
+            self.stages = {}
+            self.counters = {}
+            self.finished = 0
+
+    @contextmanager
+    def video(self, video: str):
+        """Attributes measurements of the enclosed block to the video
+        :param video: (str) video's folder"""
+        token = _video.set(video)
+        try:
+            yield
+        finally:
+            _video.reset(token)
+
+    @contextmanager
+    def measure(self, video: str, **fields):
+        """Attributes measurements of the enclosed block to the video and
+        finishes its record on exit (see finish). The block may update the
+        record's fields, it's marked as failed if the block raises
+        :param video: (str) video's folder
+        :param fields: additional fields of the record, e.g. status
+        :return: (dict) record's fields"""
+        with self.video(video):
+            try:
+                yield fields
+            except BaseException:
+                fields['status'] = 'failed'
+                raise
+            finally:
+                self.finish(video, **fields)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Times the enclosed block as a single call of the stage. Failed calls
+        are timed as well. Under the asyncio engine it's the wall time of the
+        awaited operation, other tasks' turns included
+        :param stage: (str) stage name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Records a single call of the stage
+        :param stage: (str) stage name
+        :param seconds: (float) call's duration"""
+        with self.lock:
+            record = self.entry(_video.get())
+            record['seconds'][stage] = record['seconds'].get(stage, 0.0) + seconds
+            record['calls'][stage] = record['calls'].get(stage, 0) + 1
+            calls, total, peak = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = (calls + 1, total + seconds, max(peak, seconds))
+
+    def count(self, name: str, value: int) -> None:
+        """Increments the counter
+        :param name: (str) counter name, e.g. 'points' or 'bytes_read'
+        :param value: (int) increment"""
+        with self.lock:
+            counts = self.entry(_video.get())['counts']
+            counts[name] = counts.get(name, 0) + value
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def entry(self, video: str) -> dict:
+        """Returns video's record, creating it if needed. Called under the lock
+        :param video: (str) video's folder
+        :return: (dict) seconds and calls per stage, counters"""
+        if video not in self.videos:
+            self.videos[video] = {'seconds': {}, 'calls': {}, 'counts': {}}
+        return self.videos[video]
+
+    def finish(self, video: str=None, **fields) -> dict:
+        """Completes video's record, appends it to the JSON lines file and
+        refreshes the Prometheus textfile (if set)
+        :param video: (str) video's folder. None (the measured one) by default
+        :param fields: additional fields of the record, e.g. status
+        :return: (dict) video's record"""
+        video = _video.get() if video is None else video
+        with self.lock:
+            record = self.videos.pop(video, None) or {'seconds': {}, 'calls': {}, 'counts': {}}
+            record = dict({'video': video,
+                           'finished': datetime.now().isoformat(timespec='milliseconds')},
+                          **fields, **record)
+            record['seconds'] = {stage: round(seconds, 6)
+                                 for stage, seconds in record['seconds'].items()}
+            self.finished += 1
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as jsonl_file:
+                    jsonl_file.write(json.dumps(record) + '\n')
+        self.export_prometheus()
+        return record
+
+    def report(self) -> dict:
+        """Summarizes aggregated measurements
+        :return: (dict) calls, total and maximal seconds per stage, counters"""
+        with self.lock:
+            return {'stages': {stage: {'calls': calls,
+                                       'seconds': round(total, 6),
+                                       'max_seconds': round(peak, 6)}
+                               for stage, (calls, total, peak) in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def summary(self) -> list:
+        """Formats aggregated measurements as human-readable lines,
+        the most time-consuming stages first
+        :return: (list) summary lines"""
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+            counters = dict(self.counters)
+        lines = [f"{stage}: {calls} calls, {total:.3f} s total,"
+                 f" {total / calls * 1000:.1f} ms mean, {peak * 1000:.1f} ms max"
+                 for stage, (calls, total, peak) in stages]
+        if counters:
+            lines.append(', '.join(f"{name.replace('_', ' ').capitalize()}: {value:,}"
+                                   for name, value in sorted(counters.items())))
+        return lines
+
+    def prometheus(self) -> str:
+        """Formats aggregated measurements in the Prometheus text exposition format
+        :return: (str) textfile's content"""
+        with self.lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+            finished = self.finished
+        name = self.namespace
+        lines = [f"# HELP {name}_stage_seconds_total Time spent per ingest stage",
+                 f"# TYPE {name}_stage_seconds_total counter"]
+        lines += [f'{name}_stage_seconds_total{{stage="{stage}"}} {total:.6f}'
+                  for stage, (_, total, _) in stages]
+        lines += [f"# HELP {name}_stage_calls_total Calls per ingest stage",
+                  f"# TYPE {name}_stage_calls_total counter"]
+        lines += [f'{name}_stage_calls_total{{stage="{stage}"}} {calls}'
+                  for stage, (calls, _, _) in stages]
+        lines += [f"# HELP {name}_stage_seconds_max Longest call per ingest stage",
+                  f"# TYPE {name}_stage_seconds_max gauge"]
+        lines += [f'{name}_stage_seconds_max{{stage="{stage}"}} {peak:.6f}'
+                  for stage, (_, _, peak) in stages]
+        for counter, value in counters:
+            lines += [f"# TYPE {name}_{counter}_total counter",
+                      f"{name}_{counter}_total {value}"]
+        lines += [f"# TYPE {name}_videos_finished_total counter",
+                  f"{name}_videos_finished_total {finished}"]
+        return '\n'.join(lines) + '\n'
+
+    def export_prometheus(self, path: str=None) -> None:
+        """Writes the Prometheus textfile. The file is replaced atomically,
+        hence the collector never reads it half-written
+        :param path: (str) textfile's path. None (the one set in settings) by default"""
+        path = path or self.textfile_path
+        if not path:
+            return
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'w') as textfile:
+            textfile.write(self.prometheus())
+        os.replace(temporary, path)
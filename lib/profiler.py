@@ -0,0 +1,235 @@
+"""
+Ingest profiler module
+
+Wraps an ingest run with cProfile (every thread started during the run
+is profiled as well), a stack sampler and tracemalloc. Each run writes:
+-<tag>.pstats: merged cProfile statistics (pstats/snakeviz compatible)
+-<tag>.collapsed: sampled stacks in the collapsed format of flamegraph.pl,
+speedscope and inferno
+-<tag>.allocations.txt: top allocation sites at the traced memory's peak
+-<tag>.json: run's metadata, i.e. the input set and the settings used
+Runs are tagged with their start time, label and input set's digest
+
+© 2024 Kirill Romashchenko
+"""
+import cProfile
+import hashlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Union
+
+
+class IngestProfiler:
+    """
+    Profiler class. Class instance profiles the enclosed block (use it as
+    a context manager) and writes its reports on exit, failed runs included.
+    Worker processes (if any) aren't profiled, threads outliving the run
+    (e.g. connection pool's workers) are profiled until they exit
+    """
+    top_allocations = 25  # Amount of the reported allocation sites
+    snapshot_period = 1.0  # Seconds between the traced memory's peak checks
+
+    def __init__(self, directory: str='profiles', label: str='ingest',
+                 inputs: list=None, parameters: dict=None,
+                 interval: float=0.005, frames: int=1) -> None:
+        """Profiler's constructor method
+        :param directory: (str) reports' directory. 'profiles' by default
+        :param label: (str) run's label, e.g. entry point's name. 'ingest' by default
+        :param inputs: (list) input set, e.g. video folders. None by default
+        :param parameters: (dict) run's parameters (credentials excluded).
+        None by default. Settings (settings.json) are recorded along anyway
+        :param interval: (float) stack sampling interval, in seconds. 0.005 by default
+        :param frames: (int) traceback depth of the traced allocations. 1 (allocation
+        sites only, the lowest overhead) by default"""
+        self.directory = directory
+        self.label = label
+        self.inputs = sorted(inputs or [])
+        self.parameters = parameters or {}
+        self.interval = interval
+        self.frames = frames
+
+        self.profile = None
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.samples = {}  # Amount of samples per collapsed stack
+        self.peak_snapshot = None
+        self.peak_memory = 0
+        self.sampler = None
+        self.tracing = False  # Whether tracemalloc has been started by the profiler
+        self.stopped = threading.Event()
+        self.started = None
+        self.wall_time = 0.0
+        self.paths = []
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the profiler class instance
+        """
+        return f"{self.__class__.__name__} (directory={self.directory}, label={self.label})"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.stop()
+        self.write(failed=exc_type is not None)
+
+    @classmethod
+    def from_settings(cls, settings: dict, enabled: bool=None,
+                      **kwargs) -> Union['IngestProfiler', None]:
+        """Instantiates profiler configured in settings
+        :param settings: (dict) settings dictionary
+        :param enabled: (bool) profiling switch overriding 'Profiling' setting
+        (e.g. entry point's --profile flag). None (setting's value) by default
+        :param kwargs: label, inputs and parameters of the run
+        :return: (IngestProfiler) profiler instance or None if profiling is disabled"""
+        if not (enabled or settings.get("Profiling", False)):
+            return None
+        return cls(directory=settings.get("Profiling directory", "profiles"),
+                   interval=settings.get("Profiling sample interval (ms)", 5) / 1000,
+                   **kwargs)
+
+    def tag(self) -> str:
+        """Builds run's tag, the reports' common file name
+        :return: (str) start time, label and input set's digest"""
+        return f"{self.started:%Y%m%d_%H%M%S}_{self.label}_{self.input_digest()}"
+
+    def input_digest(self) -> str:
+        """Fingerprints the input set, hence runs over the same inputs can be told
+        :return: (str) short digest of the sorted inputs"""
+        return hashlib.sha1('\n'.join(self.inputs).encode('utf-8')).hexdigest()[:10]
+
+    def start(self) -> None:
+        """Starts profiling, allocation tracing and stack sampling"""
+        self.started = datetime.now()
+        self.wall_time = time.perf_counter()
+        self.tracing = not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        self.stopped.clear()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        threading.setprofile(self.profile_thread)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def profile_thread(self, *args) -> None:
+        """Enables a profiler of its own in each thread started during the run
+        (installed via threading.setprofile, hence called on thread's first event)"""
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return  # Python 3.12+: the run's profiler covers all threads already
+        with self.lock:
+            self.thread_profiles.append(profile)
+
+    def stop(self) -> None:
+        """Stops profiling, allocation tracing and stack sampling"""
+        self.profile.disable()
+        threading.setprofile(None)
+        self.stopped.set()
+        self.sampler.join()
+        self.take_snapshot()
+        if self.tracing:
+            tracemalloc.stop()
+        self.wall_time = time.perf_counter() - self.wall_time
+
+    def sample(self) -> None:
+        """Sampler thread's loop. Collects stacks of all the other threads
+        every interval and checks the traced memory's peak every snapshot_period"""
+        own = threading.get_ident()
+        names = {}
+        checked = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                                 f":{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            if time.perf_counter() - checked >= self.snapshot_period:
+                self.take_snapshot()
+                checked = time.perf_counter()
+
+    def take_snapshot(self) -> None:
+        """Snapshots traced allocations if the traced memory is at its new peak,
+        hence allocation sites are reported where memory use culminates rather
+        than after it's been freed"""
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.peak_memory or self.peak_snapshot is None:
+            self.peak_memory = current
+            self.peak_snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__),
+                 tracemalloc.Filter(False, __file__)])  # Profiler's own samples
+
+    def write(self, failed: bool=False) -> list:
+        """Writes run's reports
+        :param failed: (bool) flag indicating the run has raised. False by default
+        :return: (list) written files' paths"""
+        import pstats
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.tag())
+        self.paths = [f"{base}.pstats", f"{base}.collapsed",
+                      f"{base}.allocations.txt", f"{base}.json"]
+
+        stats = pstats.Stats(self.profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(self.paths[0])
+
+        with open(self.paths[1], 'w') as collapsed:
+            for stack, count in sorted(self.samples.items()):
+                collapsed.write(f"{stack} {count}\n")
+
+        with open(self.paths[2], 'w') as allocations:
+            allocations.write(f"Traced memory peak: {self.peak_memory / 1024 ** 2:.1f} MB\n")
+            for statistic in self.peak_snapshot.statistics('lineno')[:self.top_allocations]:
+                frame = statistic.traceback[0]
+                allocations.write(f"{statistic.size / 1024:>12,.1f} KiB"
+                                  f" {statistic.count:>10,} blocks"
+                                  f"  {frame.filename}:{frame.lineno}\n")
+
+        with open(self.paths[3], 'w') as metadata:
+            json.dump(self.metadata(failed=failed), metadata, indent=2, default=str)
+        return self.paths
+
+    def metadata(self, failed: bool=False) -> dict:
+        """Collects run's metadata
+        :param failed: (bool) flag indicating the run has raised. False by default
+        :return: (dict) input set, parameters, settings and environment of the run"""
+        from lib.settings_reader import Reader
+
+        return {'tag': self.tag(),
+                'label': self.label,
+                'started': self.started.isoformat(timespec='seconds'),
+                'wall_seconds': round(self.wall_time, 3),
+                'failed': failed,
+                'input_set': {'digest': self.input_digest(),
+                              'count': len(self.inputs),
+                              'items': self.inputs},
+                'parameters': self.parameters,
+                'settings': Reader().get_settings(),
+                'sampled_stacks': sum(self.samples.values()),
+                'profiled_threads': len(self.thread_profiles) + 1,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'files': [os.path.basename(path) for path in self.paths]}
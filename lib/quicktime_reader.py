@@ -0,0 +1,271 @@
+"""
+Native QuickTime GPS reader module
+
+Pure Python alternative to the ExifTool-based extractor. Walks the
+MP4/QuickTime atom tree of a memory-mapped video and decodes GPS samples
+of the timed metadata ('camm') tracks and of the Insta360 trailer.
+Only the moov box, the metadata samples and the trailer are read,
+mdat's audio/video payload is never touched.
+Shares EXIFExtractor's interface, hence engines are interchangeable
+
+© 2024 Kirill Romashchenko
+"""
+import mmap
+import struct
+from array import array
+from lib.exif_extractor import EXIFExtractor, ExtractionResult
+from lib.track import Track
+
+class QuickTimeReader(EXIFExtractor):
+    """
+    Native reader class. Class instance validates input and sets up
+    processing exactly as EXIFExtractor does. extract_data method
+    performs module's functionality without spawning ExifTool
+    """
+    trailer_magic = b'8db42d694ccc418790edff439fe026bf'
+    trailer_footer = 72  # Insta360 trailer's fixed-size footer
+    trailer_gps_record = 0x700
+    trailer_gps_entry = struct.Struct('<QHcdcdcddd')
+    camm_gps_minimal = struct.Struct('<3d')  # Type 5: latitude, longitude, altitude
+    # Type 6: time, fix type, latitude, longitude, altitude, followed by float32
+    # accuracies and velocities which aren't read
+    camm_gps_full = struct.Struct('<diddf')
+
+    def extract(self) -> ExtractionResult:
+        """
+        Reads GPS samples, creation date and duration straight from the video's atoms
+        :return: (ExtractionResult) structured extraction result
+        """
+        with open(self.video_path, 'rb') as video:
+            with mmap.mmap(video.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                moov = self.find_box(buffer, b'moov')
+                tags = self.read_header(buffer, moov) if moov else {}
+                longitudes, latitudes, altitudes = (array('d'), array('d'),
+                                                    array('d'))
+                if moov:
+                    for stbl in self.find_camm_tables(buffer, moov):
+                        self.read_camm(buffer, stbl, longitudes, latitudes, altitudes)
+                if not longitudes:
+                    self.read_trailer(buffer, longitudes, latitudes, altitudes)
+
+        create_date = tags.get('CreateDate', '')
+        alias = self.format_alias(create_date)
+        track = Track(*self.format_columns(longitudes, latitudes, altitudes),
+                      alias=alias, source=self.video_path)
+        return ExtractionResult(source=self.video_path, points=track,
+                                create_date=create_date,
+                                alias=alias,
+                                tags=tags)
+
+    def stream(self, chunk_size: int=10000):
+        """
+        Yields the track in chunks. Coordinate columns take 24 bytes per point
+        and chunks are views of them, so the whole track is read at once
+        :param chunk_size: (int) maximal amount of points per chunk. 10000 by default
+        :return: (generator) Track chunks, each one carrying video's default alias
+        """
+        track = self.extract().points
+        for start in range(0, len(track), chunk_size):
+            yield track[start:start + chunk_size]
+
+    def extract_default_name(self) -> str:
+        """Reads movie header's creation time to be used as video's
+        possible default identifier/name
+        :return formated_date: (str) video creation time formated
+        with underscores"""
+        with open(self.video_path, 'rb') as video:
+            with mmap.mmap(video.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                moov = self.find_box(buffer, b'moov')
+                tags = self.read_header(buffer, moov) if moov else {}
+        return self.format_alias(tags.get('CreateDate', ''))
+
+    @staticmethod
+    def iterate_boxes(buffer, start: int, end: int):
+        """Iterates over sibling boxes within the given byte range.
+        Box payloads are not read, only their 8/16-byte headers
+        :param buffer: memory-mapped video
+        :param start: (int) first box's offset
+        :param end: (int) range's end offset
+        :return: (generator) tuples of box type, payload's start
+        and box's end offsets"""
+        position = start
+        while position + 8 <= end:
+            size, box_type = struct.unpack_from('>I4s', buffer, position)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', buffer, position + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - position
+            if size < header or position + size > end:
+                return
+            yield box_type, position + header, position + size
+            position += size
+
+    def find_box(self, buffer, box_type: bytes, start: int=0,
+                 end: int=None) -> tuple:
+        """Finds the first box of the given type among siblings
+        :param buffer: memory-mapped video
+        :param box_type: (bytes) four-character box type
+        :param start: (int) range's start offset. 0 by default
+        :param end: (int) range's end offset. None (end of file) by default
+        :return: (tuple) payload's start and box's end offsets
+        or None if no box found"""
+        end = len(buffer) if end is None else end
+        for found_type, payload, box_end in self.iterate_boxes(buffer, start, end):
+            if found_type == box_type:
+                return payload, box_end
+        return None
+
+    def read_header(self, buffer, moov: tuple) -> dict:
+        """Reads creation date and duration from the movie header (mvhd)
+        :param buffer: memory-mapped video
+        :param moov: (tuple) moov's payload start and end offsets
+        :return: (dict) header tags formatted as ExifTool's numeric output"""
+        from datetime import datetime, timedelta
+
+        mvhd = self.find_box(buffer, b'mvhd', *moov)
+        if not mvhd:
+            return {}
+        version = buffer[mvhd[0]]
+        if version == 1:
+            created, _, timescale, duration = struct.unpack_from('>QQIQ', buffer,
+                                                                 mvhd[0] + 4)
+        else:
+            created, _, timescale, duration = struct.unpack_from('>IIII', buffer,
+                                                                 mvhd[0] + 4)
+        create_date = (datetime(1904, 1, 1) + timedelta(seconds=created))\
+            .strftime('%Y:%m:%d %H:%M:%S') if created else '0000:00:00 00:00:00'
+        return {'CreateDate': create_date,
+                'Duration': duration / timescale if timescale else 0}
+
+    def find_camm_tables(self, buffer, moov: tuple) -> list:
+        """Finds sample tables (stbl) of the camera motion metadata tracks
+        :param buffer: memory-mapped video
+        :param moov: (tuple) moov's payload start and end offsets
+        :return: (list) stbl's payload start and end offsets per camm track"""
+        tables = []
+        for box_type, payload, box_end in self.iterate_boxes(buffer, *moov):
+            if box_type != b'trak':
+                continue
+            stbl = None
+            location = (payload, box_end)
+            for path_type in [b'mdia', b'minf', b'stbl']:
+                location = self.find_box(buffer, path_type, *location)
+                if not location:
+                    break
+            else:
+                stbl = location
+            if not stbl:
+                continue
+            stsd = self.find_box(buffer, b'stsd', *stbl)
+            # Full box header (4) and entry count (4), then the first entry's size and format
+            if stsd and buffer[stsd[0] + 12:stsd[0] + 16] == b'camm':
+                tables.append(stbl)
+        return tables
+
+    def sample_locations(self, buffer, stbl: tuple):
+        """Resolves sample offsets and sizes from the sample table
+        :param buffer: memory-mapped video
+        :param stbl: (tuple) stbl's payload start and end offsets
+        :return: (generator) tuples of sample's offset and size"""
+        stsz = self.find_box(buffer, b'stsz', *stbl)
+        stsc = self.find_box(buffer, b'stsc', *stbl)
+        stco = self.find_box(buffer, b'stco', *stbl)
+        offset_format = '>I'
+        if not stco:
+            stco = self.find_box(buffer, b'co64', *stbl)
+            offset_format = '>Q'
+        if not (stsz and stsc and stco):
+            return
+
+        uniform_size, sample_count = struct.unpack_from('>II', buffer, stsz[0] + 4)
+        if uniform_size:
+            sizes = [uniform_size] * sample_count
+        else:
+            sizes = struct.unpack_from(f'>{sample_count}I', buffer, stsz[0] + 12)
+
+        chunk_count = struct.unpack_from('>I', buffer, stco[0] + 4)[0]
+        offsets = struct.unpack_from(f'>{chunk_count}{offset_format[1]}',
+                                     buffer, stco[0] + 8)
+
+        entry_count = struct.unpack_from('>I', buffer, stsc[0] + 4)[0]
+        entries = [struct.unpack_from('>III', buffer, stsc[0] + 8 + i * 12)
+                   for i in range(entry_count)]
+
+        sample = 0
+        for i, (first_chunk, per_chunk, _) in enumerate(entries):
+            last_chunk = entries[i + 1][0] if i + 1 < entry_count else chunk_count + 1
+            for chunk in range(first_chunk, last_chunk):
+                position = offsets[chunk - 1]
+                for _ in range(per_chunk):
+                    if sample >= sample_count:
+                        return
+                    yield position, sizes[sample]
+                    position += sizes[sample]
+                    sample += 1
+
+    def read_camm(self, buffer, stbl: tuple, longitudes: array,
+                  latitudes: array, altitudes: array) -> None:
+        """Decodes GPS samples (camm types 5 and 6) into coordinate arrays.
+        Type 6 samples without a fix (fix type 0) are skipped
+        :param buffer: memory-mapped video
+        :param stbl: (tuple) stbl's payload start and end offsets
+        :param longitudes: (array) output array of longitudes
+        :param latitudes: (array) output array of latitudes
+        :param altitudes: (array) output array of altitudes"""
+        for offset, size in self.sample_locations(buffer, stbl):
+            if size < 4:
+                continue
+            camm_type = struct.unpack_from('<H', buffer, offset + 2)[0]
+            if camm_type == 5 and size >= 4 + self.camm_gps_minimal.size:
+                latitude, longitude, altitude = \
+                    self.camm_gps_minimal.unpack_from(buffer, offset + 4)
+            elif camm_type == 6 and size >= 4 + self.camm_gps_full.size:
+                _, fix_type, latitude, longitude, altitude = \
+                    self.camm_gps_full.unpack_from(buffer, offset + 4)
+                if not fix_type:
+                    continue
+            else:
+                continue
+            longitudes.append(longitude)
+            latitudes.append(latitude)
+            altitudes.append(altitude)
+
+    def read_trailer(self, buffer, longitudes: array,
+                     latitudes: array, altitudes: array) -> None:
+        """Decodes GPS records of the Insta360 trailer (if any) into coordinate
+        arrays. Records are chained backwards from the footer, each one
+        followed by a 6-byte header (record id, record length).
+        Void fixes are skipped
+        :param buffer: memory-mapped video
+        :param longitudes: (array) output array of longitudes
+        :param latitudes: (array) output array of latitudes
+        :param altitudes: (array) output array of altitudes"""
+        file_end = len(buffer)
+        if file_end < self.trailer_footer + 6 or\
+                buffer[file_end - 32:file_end] != self.trailer_magic:
+            return
+        trailer_length = struct.unpack_from('<I', buffer,
+                                            file_end - self.trailer_footer + 32)[0]
+        trailer_start = file_end - trailer_length
+        position = file_end - self.trailer_footer
+        while position - 6 >= trailer_start:
+            record_id, record_length = struct.unpack_from('<HI', buffer, position - 6)
+            record_start = position - 6 - record_length
+            if record_start < trailer_start:
+                return
+            if record_id == self.trailer_gps_record:
+                entry = self.trailer_gps_entry
+                for offset in range(record_start, position - 6 - entry.size + 1,
+                                    entry.size):
+                    (_, _, fix, latitude, north_south, longitude, east_west,
+                     _, _, altitude) = entry.unpack_from(buffer, offset)
+                    if fix != b'A':
+                        continue
+                    longitudes.append(-abs(longitude) if east_west == b'W'
+                                      else abs(longitude))
+                    latitudes.append(-abs(latitude) if north_south == b'S'
+                                     else abs(latitude))
+                    altitudes.append(altitude)
+            position = record_start
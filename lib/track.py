@@ -0,0 +1,201 @@
+"""
+Track module
+
+Compact in-memory representation of a video's GPS track. Coordinates
+are held in contiguous typed columns (8 bytes per value) instead of
+a list per point, slices share the parent's memory and the columns
+are serialized straight to EWKB and COPY buffers
+
+© 2024 Kirill Romashchenko
+"""
+from array import array
+
+class Track:
+    """
+    Track class. Class instance holds longitude, latitude, altitude and
+    (optionally) time columns along with the video's alias and source path.
+    Iterating yields (longitude, latitude, altitude) tuples, hence the
+    track reads like the former nested list of points
+    """
+    __slots__ = ('longitudes', 'latitudes', 'altitudes', 'times', 'alias', 'source')
+
+    def __init__(self, longitudes, latitudes, altitudes, times=None,
+                 alias: str=None, source: str=None) -> None:
+        """Track's constructor method. Columns exposing a contiguous
+        8-byte buffer (array('d'), array('q'), NumPy arrays, memoryviews)
+        are wrapped without copying, other sequences are copied
+        :param longitudes: longitudes in decimal degrees
+        :param latitudes: latitudes in decimal degrees
+        :param altitudes: altitudes in meters, either integers or floats
+        :param times: sample times in seconds. None by default
+        :param alias: (str) video's default alias. None by default
+        :param source: (str) path to the source video. None by default"""
+        self.longitudes = self.column(longitudes, 'd')
+        self.latitudes = self.column(latitudes, 'd')
+        self.altitudes = self.column(altitudes, 'q' if self.is_integer(altitudes) else 'd')
+        self.times = None if times is None else self.column(times, 'd')
+        self.alias = alias
+        self.source = source
+        if not len(self.longitudes) == len(self.latitudes) == len(self.altitudes):
+            raise ValueError('Track columns differ in length')
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the track class instance
+        """
+        return f"{self.__class__.__name__} (alias={self.alias}, points={len(self)})"
+
+    def __len__(self) -> int:
+        return len(self.longitudes)
+
+    def __iter__(self):
+        return zip(self.longitudes, self.latitudes, self.altitudes)
+
+    def __getitem__(self, index):
+        """Returns a single point as a tuple or, for a slice,
+        a track viewing the parent's columns (no copy)"""
+        if isinstance(index, slice):
+            return Track(self.longitudes[index], self.latitudes[index],
+                         self.altitudes[index],
+                         None if self.times is None else self.times[index],
+                         alias=self.alias, source=self.source)
+        return self.longitudes[index], self.latitudes[index], self.altitudes[index]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Track):
+            return NotImplemented
+        return (self.longitudes.tolist() == other.longitudes.tolist()
+                and self.latitudes.tolist() == other.latitudes.tolist()
+                and self.altitudes.tolist() == other.altitudes.tolist()
+                and self.alias == other.alias)
+
+    def __reduce__(self):
+        """Pickles columns as arrays (memoryviews are not picklable),
+        hence tracks can be returned from the worker processes"""
+        return (self.__class__,
+                (self.to_array(self.longitudes), self.to_array(self.latitudes),
+                 self.to_array(self.altitudes),
+                 None if self.times is None else self.to_array(self.times),
+                 self.alias, self.source))
+
+    @classmethod
+    def from_points(cls, points: list, alias: str=None, source: str=None,
+                    integer_altitude: bool=None):
+        """Builds track from a list of [longitude, latitude, altitude] points
+        :param points: (list) nested lists (or tuples) of three coordinate values
+        :param alias: (str) video's default alias. None by default
+        :param source: (str) path to the source video. None by default
+        :param integer_altitude: (bool) flag indicating integer altitudes.
+        None (detected from the first point) by default
+        :return: (Track) track instance"""
+        if integer_altitude is None:
+            integer_altitude = bool(points) and isinstance(points[0][2], int)
+        return cls(array('d', [point[0] for point in points]),
+                   array('d', [point[1] for point in points]),
+                   array('q', [int(point[2]) for point in points]) if integer_altitude
+                   else array('d', [point[2] for point in points]),
+                   alias=alias, source=source)
+
+    @staticmethod
+    def is_integer(values) -> bool:
+        """Checks whether column's values are integers"""
+        try:
+            return memoryview(values).format in ('q', 'l', 'Q', 'L')\
+                and memoryview(values).itemsize == 8
+        except TypeError:
+            return bool(values) and isinstance(values[0], int)
+
+    @staticmethod
+    def column(values, typecode: str) -> memoryview:
+        """Wraps values into a one-dimensional memoryview of 8-byte items
+        :param values: column's values
+        :param typecode: (str) 'd' for floats or 'q' for integers
+        :return: (memoryview) column's view"""
+        try:
+            view = memoryview(values)
+        except TypeError:
+            view = None
+        formats = ('d',) if typecode == 'd' else ('q', 'l')
+        if view is None or view.ndim != 1 or not view.c_contiguous\
+                or view.format not in formats or view.itemsize != 8:
+            if view is not None and view.ndim == 1:
+                values = view.tolist()
+            view = memoryview(array(typecode, values))
+        elif view.format != typecode:
+            view = view.cast('B').cast(typecode)
+        return view
+
+    @staticmethod
+    def to_array(view: memoryview) -> array:
+        """Copies column's view into a standalone array"""
+        copied = array(view.format)
+        copied.frombytes(view.cast('B'))
+        return copied
+
+    def take(self, indices: list):
+        """Builds track of the selected points (copied)
+        :param indices: (list) sorted indices of the points to be kept
+        :return: (Track) track instance"""
+        def pick(view: memoryview):
+            if view is None:
+                return None
+            return array(view.format, [view[i] for i in indices])
+
+        return Track(pick(self.longitudes), pick(self.latitudes), pick(self.altitudes),
+                     pick(self.times), alias=self.alias, source=self.source)
+
+    def nbytes(self) -> int:
+        """Returns memory taken by the track's columns
+        :return: (int) size in bytes"""
+        total = self.longitudes.nbytes + self.latitudes.nbytes + self.altitudes.nbytes
+        return total + (self.times.nbytes if self.times is not None else 0)
+
+    def segment_distances(self):
+        """Measures ellipsoidal (WGS 84) distances between consecutive points
+        :return: segment lengths in meters, one less than points
+        (NumPy array if NumPy is installed or array('d') otherwise)"""
+        from lib.geodesic import Geodesic
+
+        return Geodesic().distances(self.longitudes, self.latitudes)
+
+    def length(self) -> float:
+        """Measures track's ellipsoidal (WGS 84) length
+        :return: (float) length in meters"""
+        from lib.geodesic import Geodesic
+
+        return Geodesic().length(self.longitudes, self.latitudes)
+
+    def to_wkb(self, srid: int=4326) -> bytes:
+        """Serializes track to the linestring EWKB
+        :param srid: (int) spatial reference identifier. 4326 by default
+        :return: (bytes) linestring's EWKB"""
+        from lib.wkb_encoder import WKBEncoder
+
+        return WKBEncoder(srid=srid).linestring_columns(self.longitudes, self.latitudes)
+
+    def point_wkbs(self, srid: int=4326) -> bytes:
+        """Serializes each point of the track to the point EWKB
+        :param srid: (int) spatial reference identifier. 4326 by default
+        :return: (bytes) concatenated fixed-size (WKBEncoder.point_size) point EWKBs"""
+        from lib.wkb_encoder import WKBEncoder
+
+        return WKBEncoder(srid=srid).point_columns(self.longitudes, self.latitudes)
+
+    def copy_buffer(self, identifier: str, srid: int=4326, suffix: str='') -> bytes:
+        """Serializes track to the text COPY payload of the point table
+        (video, longitude, latitude, altitude, geom), geometry being hex EWKB
+        :param identifier: (str) video identifier written to each row
+        :param srid: (int) spatial reference identifier. 4326 by default
+        :param suffix: (str) tab-prefixed values of the trailing columns,
+        the same for each row. Empty by default
+        :return: (bytes) COPY payload, one line per point"""
+        from lib.wkb_encoder import WKBEncoder
+
+        escaped = identifier.replace('\\', '\\\\').replace('\t', '\\t')\
+            .replace('\n', '\\n').replace('\r', '\\r')
+        size = WKBEncoder.point_size * 2
+        geometries = self.point_wkbs(srid=srid).hex()
+        lines = [f"{escaped}\t{longitude}\t{latitude}\t{altitude}\t"
+                 f"{geometries[i * size:(i + 1) * size]}{suffix}\n"
+                 for i, (longitude, latitude, altitude) in enumerate(self)]
+        return ''.join(lines).encode('utf-8')
@@ -0,0 +1,186 @@
+"""
+Track cache module
+
+Local on-disk cache of parsed tracks. Each video's parsed points and
+default alias are stored in a compact binary file keyed by the video's
+fingerprint (see ingest manifest), hence retries and re-targeting another
+Database skip extraction entirely. Cache size is capped, least recently
+used entries are evicted first. Cache's total size is kept running per
+directory, hence the directory is scanned only when entries are evicted
+
+© 2024 Kirill Romashchenko
+"""
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from typing import Union
+from lib.track import Track
+
+class TrackCache:
+    """
+    Cache class. Class instance reads and writes cached tracks
+    within the cache directory
+    """
+    magic = b'QTDT'
+    version = 1
+    header = struct.Struct('<4sBII')  # Magic, version, points count, alias length
+    extension = '.trk'
+    totals = {}  # Running cache sizes (bytes) per directory, scanned on first use
+    totals_lock = threading.Lock()
+
+    def __init__(self, directory: str, max_size: int=512 * 1024 * 1024) -> None:
+        """Cache's constructor method
+        :param directory: (str) cache directory, created if not exists. Relative
+        directory is resolved against the package's folder rather than the working one
+        :param max_size: (int) cache size cap, in bytes. 512 MB by default"""
+        package_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.directory = os.path.join(package_folder, os.path.expanduser(directory))
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the cache class instance
+        """
+        return f"{self.__class__.__name__} (directory={self.directory}, max_size={self.max_size})"
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        """Instantiates cache configured in settings
+        :param settings: (dict) settings dictionary
+        :return: (TrackCache) cache instance or None if caching is disabled"""
+        directory = settings.get("Track cache directory")
+        if not directory:
+            return None
+        return cls(directory=directory,
+                   max_size=int(settings.get("Track cache size (MB)", 512)) * 1024 * 1024)
+
+    def key(self, video_path: str, variant: str='') -> Union[str, None]:
+        """Builds cache key from video's fingerprint
+        :param video_path: (str) path to the video
+        :param variant: (str) processing settings affecting parsed values
+        (e.g. coordinate precision). Empty by default
+        :return: (str) cache key or None if the video is not readable"""
+        import hashlib
+        from lib.ingest_manifest import IngestManifest
+
+        entry = IngestManifest.fingerprint_file(video_path=video_path)
+        if not entry:
+            return None
+        return hashlib.blake2b(f"{entry['fingerprint']}|{variant}".encode(),
+                               digest_size=20).hexdigest()
+
+    def path(self, key: str) -> str:
+        """Returns cache file's path for the key"""
+        return os.path.join(self.directory, key[:2], key + self.extension)
+
+    def get(self, key: str, integer_altitude: bool=True) -> Union[Track, None]:
+        """Reads cached track. Hit refreshes entry's recency
+        :param key: (str) cache key
+        :param integer_altitude: (bool) flag indicating altitudes are restored
+        as integers. True by default
+        :return: (Track) cached track (alias included) or None if missing. Unreadable
+        (e.g. truncated) file is a miss, it's removed"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cached:
+                content = cached.read()
+            os.utime(path)  # Modification time serves as the LRU clock
+        except OSError:
+            return None
+
+        if len(content) < self.header.size:
+            return self.discard(path)
+        magic, version, count, alias_length = self.header.unpack_from(content)
+        offset = self.header.size + alias_length
+        if magic != self.magic or version != self.version\
+                or len(content) != offset + count * 3 * 8:
+            return self.discard(path)  # Truncated, corrupted or stale entry
+        alias = content[self.header.size:offset].decode('utf-8', errors='replace')
+        coordinates = array('d')
+        coordinates.frombytes(content[offset:])
+
+        view = memoryview(coordinates)
+        altitudes = array('q', map(int, view[2 * count:])) if integer_altitude\
+            else view[2 * count:]
+        return Track(view[:count], view[count:2 * count], altitudes, alias=alias)
+
+    @staticmethod
+    def discard(path: str) -> None:
+        """Removes unreadable cache file, hence it's extracted and cached again
+        :param path: (str) cache file's path
+        :return: (None) i.e. cache miss"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    def put(self, key: str, track: Track) -> None:
+        """Writes track to the cache (atomically) and evicts least
+        recently used entries if the size cap is exceeded
+        :param key: (str) cache key
+        :param track: (Track) parsed track, alias included"""
+        encoded_alias = (track.alias or '').encode('utf-8')
+        altitudes = track.altitudes if track.altitudes.format == 'd'\
+            else array('d', track.altitudes.tolist())
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(descriptor, 'wb') as cached:
+            cached.write(self.header.pack(self.magic, self.version,
+                                          len(track), len(encoded_alias)))
+            cached.write(encoded_alias)
+            cached.write(track.longitudes)
+            cached.write(track.latitudes)
+            cached.write(altitudes)
+        os.replace(temporary, path)
+
+        size = self.header.size + len(encoded_alias) + len(track) * 3 * 8
+        with self.totals_lock:
+            if self.directory not in self.totals:
+                self.totals[self.directory] = self.scan()[1]
+            else:
+                self.totals[self.directory] += size - replaced
+            exceeded = self.totals[self.directory] > self.max_size
+        if exceeded:
+            self.evict()
+
+    def scan(self) -> tuple:
+        """Lists cache's entries
+        :return: (tuple) entries' (modification time, size, path) tuples
+        and their total size, in bytes"""
+        entries = []
+        total = 0
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(self.extension):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        return entries, total
+
+    def evict(self) -> None:
+        """Removes least recently used entries until cache fits its size cap.
+        Running size is refreshed by the scan, e.g. with other processes' entries"""
+        with self.totals_lock:
+            entries, total = self.scan()
+            if total > self.max_size:
+                for _, size, path in sorted(entries):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    if total <= self.max_size:
+                        break
+            self.totals[self.directory] = total
@@ -0,0 +1,124 @@
+"""
+Track simplifier module
+
+Reduces track's vertices with the tolerance-based Douglas-Peucker
+algorithm before the track is stored as a line. Coordinates are projected
+to local meters (equirectangular, centered on the track), hence the
+tolerance is set in meters. Distances of each range are computed
+vectorized (NumPy) with a pure Python fallback
+
+© 2024 Kirill Romashchenko
+"""
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:  # Distances are computed point by point instead
+    numpy = None
+
+class TrackSimplifier:
+    """
+    Simplifier class. Class instance simplifies tracks with the given
+    tolerance. simplify method performs module's functionality
+    """
+    earth_radius = 6371008.8  # Mean Earth radius, meters
+    vector_threshold = 64  # Shortest range processed vectorized, vertices
+
+    def __init__(self, tolerance: float) -> None:
+        """Simplifier's constructor method
+        :param tolerance: (float) maximal distance (meters) between the
+        original track and the simplified line"""
+        self.tolerance = tolerance
+
+    def __repr__(self) -> str:
+        """
+        Overwrite of the built-in __repr__ method for the simplifier class instance
+        """
+        return f"{self.__class__.__name__} (tolerance={self.tolerance})"
+
+    def simplify(self, track):
+        """Simplifies the track. Altitudes (and times) of the kept vertices are preserved
+        :param track: (Track) full resolution track
+        :return: (Track) simplified track, the same instance if nothing's removed"""
+        if len(track) < 3 or self.tolerance <= 0:
+            return track
+        indices = self.indices(*self.project(track))
+        if len(indices) == len(track):
+            return track
+        return track.take(indices)
+
+    def project(self, track) -> tuple:
+        """Projects track's coordinates to local planar meters
+        :param track: (Track) track to be projected
+        :return: (tuple) x and y columns, NumPy arrays or arrays"""
+        scale = math.radians(1) * self.earth_radius
+        if numpy is not None:
+            longitudes = numpy.asarray(track.longitudes, dtype=numpy.float64)
+            latitudes = numpy.asarray(track.latitudes, dtype=numpy.float64)
+            origin = math.radians(float(latitudes.mean()))
+            return ((longitudes - longitudes[0]) * scale * math.cos(origin),
+                    (latitudes - latitudes[0]) * scale)
+
+        longitudes = track.longitudes.tolist()
+        latitudes = track.latitudes.tolist()
+        x_scale = scale * math.cos(math.radians(sum(latitudes) / len(latitudes)))
+        return (array('d', [(longitude - longitudes[0]) * x_scale for longitude in longitudes]),
+                array('d', [(latitude - latitudes[0]) * scale for latitude in latitudes]))
+
+    def indices(self, x, y) -> list:
+        """Runs Douglas-Peucker over projected coordinates. Ranges are processed
+        with an explicit stack (no recursion limit on long tracks), each range's
+        point-to-segment distances are computed at once
+        :param x: projected x column (meters)
+        :param y: projected y column (meters)
+        :return: (list) sorted indices of the kept vertices"""
+        keep = {0, len(x) - 1}
+        ranges = [(0, len(x) - 1)]
+        x_list, y_list = x.tolist(), y.tolist()  # Plain floats index faster
+        while ranges:
+            start, end = ranges.pop()
+            if end - start < 2:
+                continue
+            # NumPy's per call overhead outweighs the loop on short ranges
+            if numpy is not None and end - start > self.vector_threshold:
+                index, distance = self.farthest_numpy(x, y, start, end)
+            else:
+                index, distance = self.farthest_python(x_list, y_list, start, end)
+            if distance > self.tolerance:
+                keep.add(index)
+                ranges.append((start, index))
+                ranges.append((index, end))
+        return sorted(keep)
+
+    @staticmethod
+    def farthest_numpy(x, y, start: int, end: int) -> tuple:
+        """Finds range's vertex farthest from the segment between its ends
+        :return: (tuple) vertex index and its distance"""
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = dx * dx + dy * dy
+        if length:
+            position = numpy.clip((px * dx + py * dy) / length, 0.0, 1.0)
+            px = px - position * dx
+            py = py - position * dy
+        distances = numpy.hypot(px, py)
+        index = int(distances.argmax())
+        return start + 1 + index, float(distances[index])
+
+    @staticmethod
+    def farthest_python(x, y, start: int, end: int) -> tuple:
+        """Finds range's vertex farthest from the segment between its ends
+        :return: (tuple) vertex index and its distance"""
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length = dx * dx + dy * dy
+        best, best_distance = start + 1, -1.0
+        for i in range(start + 1, end):
+            px, py = x[i] - x[start], y[i] - y[start]
+            if length:
+                position = min(max((px * dx + py * dy) / length, 0.0), 1.0)
+                px, py = px - position * dx, py - position * dy
+            distance = math.hypot(px, py)
+            if distance > best_distance:
+                best, best_distance = i, distance
+        return best, best_distance
@@ -0,0 +1,95 @@
+"""
+EWKB geometry encoder
+
+Encodes extracted coordinates into PostGIS Extended Well-Known Binary
+(EWKB) on the client side, so geometries can be streamed to the Database
+without any per-row SQL function call (e.g. ST_GeomFromText)
+
+© 2024 Kirill Romashchenko
+"""
+import struct
+from array import array
+
+try:
+    import numpy
+except ImportError:  # Columns are encoded with struct instead
+    numpy = None
+
+class WKBEncoder:
+    """
+    Encoder class. Builds little-endian EWKB for point and
+    linestring geometries with an embedded SRID
+    """
+    srid_flag = 0x20000000
+    point_type = 1
+    linestring_type = 2
+    point_size = 25  # Byte order (1), type (4), SRID (4) and two doubles (16)
+
+    def __init__(self, srid: int=4326) -> None:
+        """Encoder's constructor method
+        :param srid: (int) spatial reference identifier embedded
+        into every geometry. 4326 (WGS 84) by default"""
+        self.srid = srid
+        self.point_struct = struct.Struct('<BIIdd')
+        self.linestring_header = struct.Struct('<BIII')
+
+    def point(self, longitude: float, latitude: float) -> bytes:
+        """Encodes a single point
+        :param longitude: (float) point's longitude
+        :param latitude: (float) point's latitude
+        :return: (bytes) point's EWKB"""
+        return self.point_struct.pack(1, self.point_type | self.srid_flag,
+                                      self.srid, longitude, latitude)
+
+    def linestring(self, coordinates: list) -> bytes:
+        """Encodes a linestring
+        :param coordinates: (list) a list of coordinate sequences,
+        longitude and latitude being the first two values of each one
+        :return: (bytes) linestring's EWKB"""
+        header = self.linestring_header.pack(1, self.linestring_type | self.srid_flag,
+                                             self.srid, len(coordinates))
+        flat = []
+        for point in coordinates:
+            flat.append(point[0])
+            flat.append(point[1])
+        return header + struct.pack(f'<{len(flat)}d', *flat)
+
+    def linestring_columns(self, longitudes, latitudes) -> bytes:
+        """Encodes a linestring from coordinate columns. Coordinates are
+        interleaved in a single vectorized copy instead of a per-point loop
+        :param longitudes: longitudes column (float buffer or sequence)
+        :param latitudes: latitudes column (float buffer or sequence)
+        :return: (bytes) linestring's EWKB"""
+        header = self.linestring_header.pack(1, self.linestring_type | self.srid_flag,
+                                             self.srid, len(longitudes))
+        if numpy is not None:
+            flat = numpy.empty((len(longitudes), 2), dtype='<f8')
+            flat[:, 0] = numpy.asarray(longitudes, dtype=numpy.float64)
+            flat[:, 1] = numpy.asarray(latitudes, dtype=numpy.float64)
+            return header + flat.tobytes()
+        flat = array('d', bytes(16 * len(longitudes)))
+        flat[0::2] = array('d', longitudes)
+        flat[1::2] = array('d', latitudes)
+        if struct.pack('=H', 1) != struct.pack('<H', 1):  # Big-endian host
+            flat.byteswap()
+        return header + flat.tobytes()
+
+    def point_columns(self, longitudes, latitudes) -> bytes:
+        """Encodes every point of the coordinate columns
+        :param longitudes: longitudes column (float buffer or sequence)
+        :param latitudes: latitudes column (float buffer or sequence)
+        :return: (bytes) concatenated point EWKBs, point_size bytes each"""
+        geometry_type = self.point_type | self.srid_flag
+        if numpy is not None:
+            records = numpy.empty(len(longitudes),
+                                  dtype=[('order', 'u1'), ('type', '<u4'), ('srid', '<u4'),
+                                         ('x', '<f8'), ('y', '<f8')])
+            records['order'] = 1
+            records['type'] = geometry_type
+            records['srid'] = self.srid
+            records['x'] = numpy.asarray(longitudes, dtype=numpy.float64)
+            records['y'] = numpy.asarray(latitudes, dtype=numpy.float64)
+            return records.tobytes()
+        pack = self.point_struct.pack
+        return b''.join([pack(1, geometry_type, self.srid, longitude, latitude)
+                         for longitude, latitude in zip(longitudes, latitudes)])
@@ -0,0 +1,126 @@
+"""
+Shared test fixtures
+
+Database tests run against a PostGIS-enabled Database set with the
+QTD_TEST_DB, QTD_TEST_USER and QTD_TEST_PASSWORD environment variables
+(localhost:5432, as DBConnector connects). They are skipped if no such
+Database is set or reachable. Pipeline tests run offline, on the
+stand-ins of extraction and the Database (see offline)
+
+© 2024 Kirill Romashchenko
+"""
+import contextlib
+import os
+import uuid
+import psycopg
+import pytest
+
+POISONED = frozenset({'/videos/2', '/videos/4'})
+
+
+class Connection:
+    """Connection stand-in, its transactions are no-ops"""
+    class info:
+        transaction_status = psycopg.pq.TransactionStatus.IDLE
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+class AsyncConnection(Connection):
+    """Asynchronous connection stand-in, its transactions are no-ops"""
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+@pytest.fixture
+def postgis():
+    """Connection (autocommit disabled) to the PostGIS-enabled test Database"""
+    from lib.db_connector import DBConnector
+
+    db_name = os.environ.get('QTD_TEST_DB')
+    if not db_name:
+        pytest.skip('QTD_TEST_DB is not set')
+    connection = DBConnector(db_name=db_name,
+                             user=os.environ.get('QTD_TEST_USER', 'postgres'),
+                             credentials=os.environ.get('QTD_TEST_PASSWORD', ''),
+                             autocommit=False).connect()
+    if connection is None:
+        pytest.skip(f"{db_name} Database is not reachable")
+    with connection.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'postgis';")
+        available = cur.fetchone() is not None
+        if available:
+            cur.execute('CREATE EXTENSION IF NOT EXISTS postgis;')
+            connection.commit()
+    if not available:
+        connection.close()
+        pytest.skip(f"PostGIS is not available in {db_name} Database")
+    yield connection
+    connection.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def table_names(postgis):
+    """Two unique table names (public schema), the tables are dropped afterwards"""
+    names = [f"test_{kind}_{uuid.uuid4().hex[:8]}" for kind in ('points', 'lines')]
+    yield names
+    postgis.rollback()
+    with postgis.cursor() as cur:
+        for name in names:
+            cur.execute(f"DROP TABLE IF EXISTS public.{name} CASCADE;")
+    postgis.commit()
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Extraction returns a single point track, connections (and the pool)
+    are dummies, writing raises ValueError for the poisoned videos. Stands
+    in for both the threaded and the asyncio pipelines
+    :return: (frozenset) poisoned videos"""
+    from lib import ingest_pipeline
+    from lib.async_packer import AsyncDBPacker
+    from lib.db_connector import DBConnector
+    from lib.ingest_pipeline import IngestPipeline
+    from lib.track import Track
+
+    def extract_video(video: str, session=None) -> tuple:
+        return Track.from_points([[30.5, 50.4, 120]], alias='VID'), 'VID'
+
+    async def extract_data_async(self, session=None) -> None:
+        self.parsed_data, self.default_video_alias = extract_video(self.video)
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield Connection()
+
+    @contextlib.asynccontextmanager
+    async def async_connection(connector, pool=None):
+        yield AsyncConnection()
+
+    @contextlib.asynccontextmanager
+    async def pool(self):
+        yield object()
+
+    def write(self, packer, connection) -> list:
+        if packer.video in POISONED:
+            raise ValueError('Unparsable track')
+        return ['Point data inserted']
+
+    async def insert_data_async(self, connection, table_names, geometry='Both',
+                                alias=None, verbose=True, to_console=False):
+        if self.video in POISONED:
+            raise ValueError('Unparsable track')
+        return 'Point data inserted'
+
+    monkeypatch.setattr(ingest_pipeline, 'extract_video', extract_video)
+    monkeypatch.setattr(DBConnector, 'connection', connection)
+    monkeypatch.setattr(IngestPipeline, 'write', write)
+    monkeypatch.setattr(AsyncDBPacker, 'extract_data_async', extract_data_async)
+    monkeypatch.setattr(AsyncDBPacker, 'connection', staticmethod(async_connection))
+    monkeypatch.setattr(AsyncDBPacker, 'insert_data_async', insert_data_async)
+    monkeypatch.setattr(DBConnector, 'async_pool', pool)
+    return POISONED
@@ -0,0 +1,39 @@
+"""
+Async ingest pipeline tests
+
+Runs the asyncio pipeline with extraction and the Database replaced
+(see conftest's offline), hence no ExifTool or Postgres is needed
+
+© 2024 Kirill Romashchenko
+"""
+from lib.async_pipeline import AsyncIngestPipeline
+
+
+def test_poisoned_videos_are_failures_of_their_own(offline):
+    events = []
+    pipeline = AsyncIngestPipeline(db_name='db', user='user', credentials='',
+                                   table_names=['p', 'l'], extract_workers=2,
+                                   write_workers=2, queue_size=1,
+                                   on_event=lambda event, video, detail:
+                                   events.append((event, video)))
+    videos = [(f"/videos/{index}", None) for index in range(8)]
+    pipeline.run(videos)
+
+    assert sorted(video for video, _ in pipeline.failures) == sorted(offline)
+    assert all('ValueError' in error for _, error in pipeline.failures)
+    assert pipeline.writing.videos == len(videos) - len(offline)
+    assert pipeline.writing.failed == len(offline)
+    assert {video for event, video in events if event == 'failed'} == offline
+
+
+def test_errors_escaping_a_video_do_not_cancel_the_batch(offline):
+    def on_event(event: str, video: str, detail) -> None:
+        if event == 'extracted' and video == '/videos/1':
+            raise RuntimeError('Callback failed')
+
+    pipeline = AsyncIngestPipeline(db_name='db', user='user', credentials='',
+                                   table_names=['p', 'l'], on_event=on_event)
+    pipeline.run([(f"/videos/{index}", None) for index in (1, 3, 5, 7)])
+
+    assert [video for video, _ in pipeline.failures] == ['/videos/1']
+    assert pipeline.writing.videos == 3
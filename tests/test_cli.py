@@ -0,0 +1,34 @@
+"""
+Headless entry point tests
+
+© 2024 Kirill Romashchenko
+"""
+import pytest
+from cli import parse_arguments
+
+SETTINGS = {"Default user": "postgres", "Default filename": "origin_6_lrv.mp4",
+            "Default table names": ["trackpoints", "tracklines"]}
+
+
+@pytest.mark.parametrize('geometry, tables', [
+    ('Both', ['points', 'lines']), ('Point', ['points']), ('Line', ['lines'])])
+def test_tables_match_the_geometry(geometry, tables):
+    arguments = parse_arguments(['/videos', '--db', 'db', '--geometry', geometry,
+                                 '--tables', *tables], SETTINGS)
+    assert arguments.tables == tables
+
+
+@pytest.mark.parametrize('geometry, tables', [
+    ('Both', ['points']), ('Both', ['points', 'lines', 'more']), ('Point', ['a', 'b'])])
+def test_tables_not_matching_the_geometry_are_rejected(geometry, tables, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        parse_arguments(['/videos', '--db', 'db', '--geometry', geometry,
+                         '--tables', *tables], SETTINGS)
+
+    assert exit_info.value.code == 2
+    assert f"--geometry {geometry} takes" in capsys.readouterr().err
+
+
+def test_default_tables_are_trimmed_to_the_geometry():
+    arguments = parse_arguments(['/videos', '--db', 'db', '--geometry', 'Line'], SETTINGS)
+    assert arguments.tables == ['trackpoints']
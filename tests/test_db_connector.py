@@ -0,0 +1,49 @@
+"""
+Database connector tests
+
+Shared pools are replaced with stand-ins, hence no Postgres is needed
+
+© 2024 Kirill Romashchenko
+"""
+import psycopg_pool
+import pytest
+from lib.db_connector import DBConnector
+
+
+class Pool:
+    """Connection pool stand-in, keeps its creation parameters"""
+    check_connection = None
+
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    monkeypatch.setattr(psycopg_pool, 'ConnectionPool', Pool)
+    monkeypatch.setattr(DBConnector, '_pools', {})
+    yield
+    DBConnector.close_pools()
+
+
+def connector(**kwargs) -> DBConnector:
+    parameters = dict(db_name='tracks', user='postgres', credentials='secret',
+                      pooled=True, min_size=1, max_size=4)
+    return DBConnector(**dict(parameters, **kwargs))
+
+
+def test_identical_connectors_share_the_pool(pools):
+    assert connector().pool() is connector().pool()
+
+
+@pytest.mark.parametrize('difference', [{'credentials': 'other'}, {'autocommit': False},
+                                        {'min_size': 2}, {'max_size': 8}])
+def test_differing_connectors_get_pools_of_their_own(pools, difference):
+    shared = connector().pool()
+    own = connector(**difference).pool()
+    assert own is not shared
+    assert own.kwargs['min_size'] == connector(**difference).min_size
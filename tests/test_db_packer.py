@@ -0,0 +1,161 @@
+"""
+Database packer tests
+
+Run against the PostGIS-enabled test Database (see conftest), routing
+checks run on stand-ins
+
+© 2024 Kirill Romashchenko
+"""
+import pytest
+from lib.db_packer import DBPacker
+from lib.track import Track
+from lib.track_simplifier import TrackSimplifier
+
+
+def line_packer(points: list) -> DBPacker:
+    """Packer holding the given track, lines are neither simplified nor
+    inserted with levels of detail"""
+    packer = DBPacker(video='')
+    packer.schema = 'public'
+    packer.line_tolerance = 0
+    packer.lod_tolerances = []
+    packer.parsed_data = Track.from_points(points, alias='VID')
+    return packer
+
+
+def test_insert_line_does_not_rewrite_existing_rows(postgis, table_names):
+    line_table = table_names[1]
+    first = line_packer([[30.5, 50.4, 120], [30.501, 50.401, 121], [30.502, 50.4, 122]])
+    first.create_columns(connection=postgis, table_names=[line_table], geometry='Line')
+    first.insert_line(connection=postgis, table_name=line_table, alias='first', verbose=False)
+
+    query = f"SELECT length, xmin::text FROM public.{line_table} WHERE video = %s;"
+    with postgis.cursor() as cur:
+        cur.execute(query, ('first',))
+        before = cur.fetchone()
+    postgis.commit()
+
+    second = line_packer([[37.6, 55.7, 150], [37.61, 55.71, 151]])
+    second.insert_line(connection=postgis, table_name=line_table, alias='second',
+                       verbose=False)
+
+    with postgis.cursor() as cur:
+        cur.execute(query, ('first',))
+        after = cur.fetchone()
+        cur.execute(f"SELECT count(*) FROM public.{line_table};")
+        rows = cur.fetchone()[0]
+    postgis.commit()
+
+    assert before[0] > 0
+    assert after == before, 'the first line has been rewritten'
+    assert rows == 2
+
+
+def test_failed_video_leaves_no_rows(postgis, table_names):
+    packer = line_packer([[30.5, 50.4, 120], [30.501, 50.401, 121]])
+    packer.partitioning = None
+    packer.create_columns(connection=postgis, table_names=table_names, geometry='Both')
+
+    with pytest.raises(RuntimeError):
+        with packer.transaction(postgis):
+            packer.insert_both(connection=postgis, table_names=table_names,
+                               alias='failed', verbose=False)
+            raise RuntimeError('Manifest record failed')
+
+    with postgis.cursor() as cur:
+        for table_name in table_names:
+            cur.execute(f"SELECT count(*) FROM public.{table_name};")
+            assert cur.fetchone()[0] == 0
+    postgis.commit()
+
+
+def test_streamed_line_is_simplified_in_meters(postgis, table_names):
+    # Middle vertex is 3 m east of the meridian at 60°N, i.e. within the 4 m
+    # tolerance although its offset in degrees is twice the equatorial one
+    offset = 3 / (111195.08 * 0.5)
+    points = [[30.0, 60.0, 100], [30.0 + offset, 60.0005, 100], [30.0, 60.001, 100]]
+    packer = line_packer(points)
+    packer.partitioning = None
+    packer.line_tolerance = 4
+    packer.create_columns(connection=postgis, table_names=table_names, geometry='Both')
+    packer.insert_points(connection=postgis, table_name=table_names[0], alias='VID',
+                         verbose=False)
+    packer.insert_line_from_points(connection=postgis, table_names=table_names,
+                                   alias='VID', verbose=False)
+
+    with postgis.cursor() as cur:
+        cur.execute(f"SELECT ST_NPoints(geom) FROM public.{table_names[1]};")
+        vertices = cur.fetchone()[0]
+    postgis.commit()
+
+    expected = TrackSimplifier(tolerance=4).simplify(Track.from_points(points, alias='VID'))
+    assert vertices == len(expected) == 2
+
+
+def test_streamed_points_are_routed_by_the_streamed_header(monkeypatch):
+    """Date partition is picked from the first streamed chunk's creation date,
+    the video isn't read again for it"""
+    import contextlib
+
+    class Extractor:
+        def stream_data(self, chunk_size: int=10000):
+            yield Track.from_points([[30.5, 50.4, 120]], alias='VID_2024_05_01_10_20_30')
+
+        def extract_default_name(self):
+            raise AssertionError('the video is read twice')
+
+    class Connection:
+        executed = []
+
+        @contextlib.contextmanager
+        def transaction(self):
+            yield
+
+        @contextlib.contextmanager
+        def cursor(self):
+            yield self
+
+        def execute(self, query: str):
+            self.executed.append(query)
+
+        def copy(self, query: str):
+            raise RuntimeError('Routed')
+
+        class info:
+            transaction_status = None
+
+    packer = DBPacker(video='')
+    packer.schema = 'public'
+    monkeypatch.setattr(packer, 'extractor', lambda session=None: Extractor())
+    monkeypatch.setattr(packer, 'partition_strategy', lambda connection, table_name: 'date')
+    with pytest.raises(RuntimeError, match='Routed'):
+        packer.stream_points(connection=Connection(), table_name='trackpoints', verbose=False)
+
+    assert str(packer.recorded_on) == '2024-05-01'
+    assert 'public.trackpoints_202405' in Connection.executed[0]
+
+
+@pytest.mark.parametrize('alias, partition, bounds', [
+    ('VID_2024_05_01_10_20_30', '202405', ("'2024-05-01'", "'2024-06-01'")),
+    ('VID_2023_12_31_23_59_59', '202312', ("'2023-12-01'", "'2024-01-01'")),
+    ('VID_', '190401', ("'1904-01-01'", "'1904-02-01'"))])  # Unknown creation date
+def test_points_are_routed_to_their_month(alias, partition, bounds):
+    packer = DBPacker(video='')
+    packer.schema = 'public'
+    packer.default_video_alias = alias
+    query = packer.partition_query(table_name='trackpoints')
+
+    assert f"public.trackpoints_{partition}" in query
+    assert f"FROM ({bounds[0]}) TO ({bounds[1]})" in query
+    assert packer.recorded_on.strftime('%Y%m') == partition
+
+
+def test_hash_partitions_are_created_with_the_table():
+    packer = DBPacker(video='')
+    packer.schema = 'public'
+    packer.partitioning, packer.hash_partitions = 'hash', 4
+    query = packer.partitioned_point_query(table_name='trackpoints', altitude_type='integer')
+
+    assert 'PARTITION BY HASH (video)' in query
+    assert [f"trackpoints_p{remainder}" in query for remainder in range(5)] ==\
+        [True] * 4 + [False]
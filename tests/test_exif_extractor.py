@@ -0,0 +1,94 @@
+"""
+EXIF extractor tests
+
+Parses recorded ExifTool output of the same three samples in each output
+format the extractor understands, with and without NumPy. No ExifTool
+is needed
+
+© 2024 Kirill Romashchenko
+"""
+import pytest
+from lib import exif_extractor
+from lib.exif_extractor import EXIFExtractor
+
+# exiftool -j -G3 -n -ee3 -api largefilesupport=1 -CreateDate -Duration
+# -GPSLongitude -GPSLatitude -GPSAltitude origin_6_lrv.mp4
+JSON_OUTPUT = b"""[{
+  "SourceFile": "origin_6_lrv.mp4",
+  "Main:CreateDate": "2024:05:01 10:20:30",
+  "Main:Duration": 2.002,
+  "Doc1:GPSLatitude": 50.4501234567,
+  "Doc1:GPSLongitude": 30.5234567891,
+  "Doc1:GPSAltitude": 171.64,
+  "Doc2:GPSLatitude": 50.4501301234,
+  "Doc2:GPSLongitude": 30.5234601234,
+  "Doc2:GPSAltitude": 171.58,
+  "Doc3:GPSLatitude": -50.4501367891,
+  "Doc3:GPSLongitude": -30.5234634567,
+  "Doc3:GPSAltitude": 171.49,
+  "Doc4:GPSLatitude": 50.4501434567
+}]
+"""
+# exiftool -n -ee3 -api largefilesupport=1 -p <build_numeric_query's format> origin_6_lrv.mp4
+NUMERIC_OUTPUT = b"""CreateDate=2024:05:01 10:20:30
+Duration=2.002
+30.5234567891 50.4501234567 171.64
+30.5234601234 50.4501301234 171.58
+-30.5234634567 -50.4501367891 171.49
+"""
+# exiftool -c "%.8f" -p "$GPSLongitude, $GPSLatitude, $GPSAltitude" -ee3 origin_6_lrv.mp4
+LEGACY_OUTPUT = ['30.52345679 E, 50.45012346 N, 171.6',
+                 '30.52346012 E, 50.45013012 N, 171.6',
+                 '30.52346346 W, 50.45013679 S, 171.5']
+
+POINTS = [(30.52345679, 50.45012346, 171), (30.52346012, 50.45013012, 171),
+          (-30.52346346, -50.45013679, 171)]
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def extractor(request, tmp_path, monkeypatch):
+    """Extractor of an empty video (8 decimal places, integer altitudes),
+    parsing into NumPy arrays or, with NumPy hidden, into array('d')"""
+    from lib.settings_reader import Reader
+
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(exif_extractor, 'numpy', None)
+    (tmp_path / Reader().get_settings()["Default filename"]).write_bytes(b'')
+    extractor = EXIFExtractor(input_path=str(tmp_path), session=object())
+    extractor.coordinate_precision = 8
+    extractor.altitude_data_type = 'integer'
+    extractor.prefix = 'VID'
+    return extractor
+
+
+def test_json_and_numeric_outputs_parse_alike(extractor):
+    from_json = extractor.parse_json(JSON_OUTPUT)
+    from_numeric = extractor.parse_numeric(NUMERIC_OUTPUT)
+
+    for result in (from_json, from_numeric):
+        assert list(result.points) == POINTS
+        assert result.create_date == '2024:05:01 10:20:30'
+        assert result.alias == result.points.alias == 'VID_2024_05_01_10_20_30'
+        assert float(result.tags['Duration']) == 2.002
+    assert from_json.points == from_numeric.points
+
+
+def test_legacy_output_parses_alike(extractor):
+    assert [tuple(point) for point in extractor.parse_data(LEGACY_OUTPUT)] == POINTS
+
+
+def test_decimal_altitudes_are_rounded(extractor):
+    extractor.altitude_data_type = 'decimal'
+    _, _, _, altitudes = extractor.parse_columns(NUMERIC_OUTPUT)
+
+    assert list(altitudes) == [171.6, 171.6, 171.5]
+    assert list(extractor.parse_json(JSON_OUTPUT).points.altitudes) == [171.6, 171.6, 171.5]
+
+
+def test_header_only_output_is_an_empty_track(extractor):
+    result = extractor.parse_numeric(b'CreateDate=2024:05:01 10:20:30\nDuration=2.002\n')
+
+    assert len(result.points) == 0
+    assert result.alias == 'VID_2024_05_01_10_20_30'
@@ -0,0 +1,73 @@
+"""
+ExifTool session tests
+
+Runs the session against a stand-in script speaking the -stay_open
+protocol, hence no ExifTool is needed (POSIX only, the script is run
+via its shebang)
+
+© 2024 Kirill Romashchenko
+"""
+import os
+import sys
+import pytest
+from lib.exiftool_session import ExifToolSession
+
+STAND_IN = """#!{python}
+import sys
+import time
+common = sys.argv[sys.argv.index('-common_args') + 1:]
+args = []
+for line in sys.stdin:
+    line = line.rstrip('\\n')
+    if line.startswith('-execute'):
+        sys.stdout.write(' '.join(common) + '\\n' + 'line\\n' * 50000)
+        sys.stdout.write('{{ready' + line[len('-execute'):] + '}}')
+        if '-split' in args:  # Marker's line terminator comes in a later write
+            sys.stdout.flush()
+            time.sleep(0.2)
+        sys.stdout.write('\\n')
+        sys.stdout.flush()
+        args = []
+    elif line == 'False' and args == ['-stay_open']:
+        break
+    else:
+        args.append(line)
+"""
+
+
+@pytest.fixture
+def session(tmp_path):
+    if os.name != 'posix':
+        pytest.skip('Stand-in ExifTool is run via its shebang')
+    exe_path = tmp_path / 'exiftool'
+    exe_path.write_text(STAND_IN.format(python=sys.executable))
+    exe_path.chmod(0o755)
+    with ExifToolSession(exe_path=str(exe_path)) as session:
+        yield session
+
+
+def test_file_names_are_decoded_as_utf8(session):
+    assert session.execute('-ver').startswith(b'-charset filename=utf8\n')
+
+
+def test_closed_stream_unlocks_the_session(session):
+    output = session.stream('-ver')
+    assert next(output).startswith(b'-charset filename=utf8\n')
+    assert session.lock.locked()
+
+    output.close()
+    assert not session.lock.locked()
+    assert len(session.execute('-ver').splitlines()) == 50001
+
+
+def test_exhausted_stream_unlocks_the_session(session):
+    assert b''.join(session.stream('-ver')).count(b'line\n') == 50000
+    assert not session.lock.locked()
+
+
+def test_marker_line_is_read_through(session):
+    assert session.execute('-split').endswith(b'line\n')
+    assert session.execute('-ver').startswith(b'-charset filename=utf8\n')
+
+    assert b''.join(session.stream('-split')).endswith(b'line\n')
+    assert next(session.stream('-ver')).startswith(b'-charset filename=utf8\n')
@@ -0,0 +1,68 @@
+"""
+Geodesic tests
+
+Known WGS 84 distances are checked with both the NumPy and the pure
+Python computation, track lengths against PostGIS' ST_LengthSpheroid
+when the test Database is available (see conftest)
+
+© 2024 Kirill Romashchenko
+"""
+import math
+import pytest
+from lib import geodesic
+from lib.geodesic import Geodesic
+from lib.track import Track
+from benchmarks.synthetic import synthetic_track
+
+
+def dms(degrees: int, minutes: int, seconds: float) -> float:
+    """Converts degrees, minutes and seconds to decimal degrees"""
+    return math.copysign(abs(degrees) + minutes / 60 + seconds / 3600, degrees)
+
+
+# Longitude, latitude of both ends and the distance (meters)
+KNOWN_DISTANCES = [
+    # Flinders Peak - Buninyong (Geoscience Australia's Vincenty example)
+    ((dms(144, 25, 29.52440), dms(-37, 57, 3.72030),
+      dms(143, 55, 35.38390), dms(-37, 39, 10.15610)), 54972.271),
+    # Degree of longitude along the equator: a * pi / 180
+    ((0.0, 0.0, 1.0, 0.0), 111319.491),
+    # Equator to the pole (quarter meridian)
+    ((0.0, 0.0, 0.0, 90.0), 10001965.729),
+    # Coincident points
+    ((30.5, 50.4, 30.5, 50.4), 0.0)]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    """Geodesic computing with NumPy (if installed) or with the pure Python fallback"""
+    if request.param == 'numpy' and geodesic.numpy is None:
+        pytest.skip('NumPy is not installed')
+    if request.param == 'python':
+        monkeypatch.setattr(geodesic, 'numpy', None)
+    return Geodesic()
+
+
+@pytest.mark.parametrize('ends, distance', KNOWN_DISTANCES)
+def test_known_distances(engine, ends, distance):
+    lon1, lat1, lon2, lat2 = ends
+    assert engine.length([lon1, lon2], [lat1, lat2]) == pytest.approx(distance, abs=1e-3)
+
+
+def test_length_sums_segments(engine):
+    lon1, lat1, lon2, lat2 = KNOWN_DISTANCES[0][0]
+    there_and_back = engine.length([lon1, lon2, lon1], [lat1, lat2, lat1])
+    assert there_and_back == pytest.approx(2 * 54972.271, abs=2e-3)
+    assert len(engine.distances([lon1], [lat1])) == 0
+
+
+def test_track_length_matches_postgis(postgis):
+    track = Track.from_points(synthetic_track(500, seed=7))
+    with postgis.cursor() as cur:
+        cur.execute("""SELECT ST_LengthSpheroid(ST_GeomFromEWKB(%b),
+                       'SPHEROID["WGS 84",6378137,298.257223563]');""",
+                    (track.to_wkb(srid=4326),))
+        expected = cur.fetchone()[0]
+    postgis.rollback()
+    assert expected > 0
+    assert track.length() == pytest.approx(expected, abs=1e-3)
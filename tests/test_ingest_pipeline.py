@@ -0,0 +1,150 @@
+"""
+Ingest pipeline tests
+
+Runs the threaded pipeline with extraction and the Database replaced
+(see conftest's offline), hence no ExifTool or Postgres is needed
+
+© 2024 Kirill Romashchenko
+"""
+import threading
+import pytest
+from lib import ingest_pipeline
+from lib.ingest_pipeline import IngestPipeline
+
+
+def test_poisoned_videos_do_not_stall_the_batch(offline):
+    pipeline = IngestPipeline(db_name='db', user='user', credentials='', table_names=['p', 'l'],
+                              extract_workers=2, write_workers=2, queue_size=1)
+    videos = [(f"/videos/{index}", None) for index in range(8)]
+    runner = threading.Thread(target=pipeline.run, args=(videos,), daemon=True)
+    runner.start()
+    runner.join(timeout=20)
+
+    assert not runner.is_alive(), 'the batch stalled'
+    assert sorted(video for video, _ in pipeline.failures) == sorted(offline)
+    assert all('ValueError' in error for _, error in pipeline.failures)
+    assert pipeline.writing.videos == len(videos) - len(offline)
+    assert pipeline.writing.failed == len(offline)
+
+
+@pytest.fixture
+def recorded(tmp_path, monkeypatch):
+    """Five video folders whose ExifTool output is replayed by the stand-in
+    ExifTool (see benchmarks.stub_exiftool), the track cache is disabled
+    :return: (tuple) folders, their amounts of points and the stand-in's session"""
+    from benchmarks.parse_output import render
+    from benchmarks.stub_exiftool import write_recordings
+    from benchmarks.suite import StubSession
+    from benchmarks.synthetic import synthetic_track
+    from lib.settings_reader import Reader
+    from lib.track_cache import TrackCache
+
+    recordings = str(tmp_path / 'recordings')
+    folders, points = [], []
+    for index in range(5):
+        folder = tmp_path / f"video_{index}"
+        folder.mkdir()
+        (folder / Reader().get_settings()["Default filename"]).write_bytes(b'')
+        track = synthetic_track(10 + index, seed=index)
+        write_recordings(recordings, folder.name,
+                         {'json': render(track, '2024:05:01 10:20:30')['json']})
+        folders.append(str(folder))
+        points.append(len(track))
+    monkeypatch.setattr(TrackCache, 'from_settings', classmethod(lambda cls, settings: None))
+    with StubSession(recordings) as session:
+        yield folders, points, session
+
+
+def test_videos_are_extracted_with_a_single_command(recorded, monkeypatch):
+    folders, points, session = recorded
+    commands = []
+    execute = session.execute
+    monkeypatch.setattr(session, 'execute', lambda *args: commands.append(args) or execute(*args))
+
+    extracted, errors = ingest_pipeline.extract_videos(folders + ['/videos/missing'],
+                                                       session=session)
+
+    assert len(commands) == 1
+    assert [len(extracted[folder][0]) for folder in folders] == points
+    assert {alias for _, alias in extracted.values()} == {'VID_2024_05_01_10_20_30'}
+    assert list(errors) == ['/videos/missing']
+
+
+def test_pipeline_batches_waiting_videos(offline, recorded, monkeypatch):
+    folders, points, session = recorded
+    monkeypatch.setattr(IngestPipeline, 'thread_session', lambda self: session)
+    written = {}
+
+    def write(self, packer, connection) -> list:
+        written[packer.video] = len(packer.parsed_data)
+        return ['Point data inserted']
+
+    monkeypatch.setattr(IngestPipeline, 'write', write)
+    pipeline = IngestPipeline(db_name='db', user='user', credentials='', table_names=['p', 'l'],
+                              extract_workers=1, write_workers=1, queue_size=8, batch_size=4)
+    pipeline.run([(folder, None) for folder in folders] + [('/videos/missing', None)])
+
+    assert written == dict(zip(folders, points))
+    assert [video for video, _ in pipeline.failures] == ['/videos/missing']
+    assert pipeline.extraction.videos == len(folders)
+
+
+def test_indexes_are_deferred_to_the_end_of_the_batch(offline, monkeypatch):
+    from lib.db_packer import DBPacker
+
+    events = []
+
+    def drop_indexes(self, connection, tables: list) -> None:
+        events.append(('drop', tuple(tables)))
+
+    def rebuild_indexes(self, connection, tables: list, verbose=True, to_console=False):
+        events.append(('rebuild', tuple(tables)))
+        self.rebuild_seconds = 0.0
+        return 'Indexes rebuilt in 0.0 s'
+
+    def write(self, packer, connection) -> list:
+        events.append(('write', packer.video))
+        return ['Point data inserted']
+
+    monkeypatch.setattr(DBPacker, 'drop_indexes', drop_indexes)
+    monkeypatch.setattr(DBPacker, 'rebuild_indexes', rebuild_indexes)
+    monkeypatch.setattr(IngestPipeline, 'write', write)
+    videos = [(f"/videos/{index}", None) for index in range(4)]
+    pipeline = IngestPipeline(db_name='db', user='user', credentials='', table_names=['p', 'l'],
+                              geometry='Point', extract_workers=2, write_workers=2,
+                              defer_indexes=True)
+    pipeline.run(videos)
+
+    assert events[0] == ('drop', ('p',)) and events[-1] == ('rebuild', ('p',))
+    assert sorted(video for _, video in events[1:-1]) == [video for video, _ in videos]
+
+    events.clear()
+    pipeline.defer_indexes = False
+    pipeline.run(videos)
+    assert {event for event, _ in events} == {'write'}
+
+
+def test_deferred_indexes_cover_level_of_detail_tables():
+    from lib.db_packer import DBPacker
+
+    packer = DBPacker(video='')
+    packer.lod_tolerances = [10, 2.5]
+
+    assert packer.indexed_tables(['p', 'l'], 'Both') == ['p', 'l', 'l_10m', 'l_2_5m']
+    assert packer.indexed_tables(['l'], 'Line') == ['l', 'l_10m', 'l_2_5m']
+    assert packer.indexed_tables(['p', 'l'], 'Point') == ['p']
+
+
+def test_runs_close_only_their_own_sessions(offline, monkeypatch):
+    from lib.exiftool_session import ExifToolSession
+
+    closed = []
+    monkeypatch.setattr(ExifToolSession, 'close', lambda session: closed.append(session))
+    idle = IngestPipeline(db_name='db', user='user', credentials='', table_names=['p', 'l'])
+    other_session = idle.thread_session()
+    pipeline = IngestPipeline(db_name='db', user='user', credentials='', table_names=['p', 'l'],
+                              extract_workers=2, write_workers=1)
+    pipeline.run([(f"/videos/{index}", None) for index in (1, 3, 5, 7)])
+
+    assert closed and other_session not in closed  # One per extraction thread at most
+    assert pipeline.sessions == {} and idle.sessions
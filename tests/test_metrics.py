@@ -0,0 +1,65 @@
+"""
+Metrics tests
+
+© 2024 Kirill Romashchenko
+"""
+import json
+import os
+import pytest
+from lib.metrics import Metrics
+
+
+@pytest.fixture
+def measured(tmp_path):
+    """Metrics of two videos, exported to a JSON lines file and a Prometheus textfile"""
+    metrics = Metrics(jsonl_path=str(tmp_path / 'metrics.jsonl'),
+                      textfile_path=str(tmp_path / 'ingest.prom'))
+    with metrics.measure('/videos/1', status='inserted'):
+        metrics.record('extract', 0.25)
+        metrics.record('copy_points', 0.5)
+        metrics.count('points', 100)
+    with pytest.raises(ValueError):
+        with metrics.measure('/videos/2', status='inserted'):
+            metrics.record('extract', 1.5)
+            metrics.count('points', 20)
+            raise ValueError('Unparsable track')
+    return metrics
+
+
+def test_prometheus_textfile(measured):
+    with open(measured.textfile_path) as textfile:
+        content = textfile.read()
+
+    assert content == measured.prometheus()
+    assert content == """\
+# HELP quicktime_ingest_stage_seconds_total Time spent per ingest stage
+# TYPE quicktime_ingest_stage_seconds_total counter
+quicktime_ingest_stage_seconds_total{stage="copy_points"} 0.500000
+quicktime_ingest_stage_seconds_total{stage="extract"} 1.750000
+# HELP quicktime_ingest_stage_calls_total Calls per ingest stage
+# TYPE quicktime_ingest_stage_calls_total counter
+quicktime_ingest_stage_calls_total{stage="copy_points"} 1
+quicktime_ingest_stage_calls_total{stage="extract"} 2
+# HELP quicktime_ingest_stage_seconds_max Longest call per ingest stage
+# TYPE quicktime_ingest_stage_seconds_max gauge
+quicktime_ingest_stage_seconds_max{stage="copy_points"} 0.500000
+quicktime_ingest_stage_seconds_max{stage="extract"} 1.500000
+# TYPE quicktime_ingest_points_total counter
+quicktime_ingest_points_total 120
+# TYPE quicktime_ingest_videos_finished_total counter
+quicktime_ingest_videos_finished_total 2
+"""
+    # Replaced atomically, no temporary file is left behind
+    assert sorted(os.listdir(os.path.dirname(measured.textfile_path))) ==\
+        ['ingest.prom', 'metrics.jsonl']
+
+
+def test_json_lines_record_per_video(measured):
+    with open(measured.jsonl_path) as jsonl_file:
+        records = [json.loads(line) for line in jsonl_file]
+
+    assert [(record['video'], record['status']) for record in records] ==\
+        [('/videos/1', 'inserted'), ('/videos/2', 'failed')]
+    assert records[0]['seconds'] == {'extract': 0.25, 'copy_points': 0.5}
+    assert records[1]['counts'] == {'points': 20}
+    assert measured.report()['counters'] == {'points': 120}
@@ -0,0 +1,60 @@
+"""
+Native QuickTime reader tests
+
+Reads minimal MP4 files whose camm samples are packed field by field
+after the camera motion metadata spec, hence the reader's layout is
+checked independently of the synthetic data generator
+
+© 2024 Kirill Romashchenko
+"""
+import struct
+from datetime import datetime
+from benchmarks.synthetic import build_camm_mp4, write_mp4
+from lib.quicktime_reader import QuickTimeReader
+from lib.settings_reader import Reader
+
+
+def camm_type_6(time: float, fix_type: int, latitude: float, longitude: float,
+                altitude: float) -> bytes:
+    """Packs a camm type 6 sample: reserved and type (uint16), time_gps_epoch (double),
+    gps_fix_type (int32), latitude, longitude (double), altitude, horizontal and
+    vertical accuracy, east, north and up velocity, speed accuracy (float32)"""
+    sample = struct.pack('<H', 0) + struct.pack('<H', 6)
+    sample += struct.pack('<d', time) + struct.pack('<i', fix_type)
+    sample += struct.pack('<d', latitude) + struct.pack('<d', longitude)
+    sample += struct.pack('<f', altitude)
+    sample += struct.pack('<f', 3.5) + struct.pack('<f', 5.0)  # Accuracies
+    sample += struct.pack('<f', 1.25) + struct.pack('<f', -0.75) + struct.pack('<f', 0.1)
+    sample += struct.pack('<f', 0.5)  # Speed accuracy
+    return sample
+
+
+def read(folder, content: bytes) -> list:
+    """Writes the video into the folder and reads its track natively"""
+    (folder / Reader().get_settings()["Default filename"]).write_bytes(content)
+    return [list(point) for point in QuickTimeReader(str(folder)).extract().points]
+
+
+def test_camm_type_6_spec_sample(tmp_path):
+    samples = [camm_type_6(1.7e9, 3, 55.755826, 37.617299, 151.0),
+               camm_type_6(1.7e9 + 1, 2, 55.755901, 37.617350, 152.0)]
+    assert len(samples[0]) == 4 + 56
+
+    points = read(tmp_path, build_camm_mp4(samples, datetime(2024, 1, 2, 3, 4, 5)))
+    assert points == [[37.617299, 55.755826, 151.0], [37.61735, 55.755901, 152.0]]
+
+
+def test_camm_type_6_samples_without_fix_are_skipped(tmp_path):
+    samples = [camm_type_6(1.7e9, 0, 0.0, 0.0, 0.0),
+               camm_type_6(1.7e9 + 1, 3, 55.755826, 37.617299, 151.0),
+               camm_type_6(1.7e9 + 2, 0, 0.0, 0.0, 0.0)]
+
+    points = read(tmp_path, build_camm_mp4(samples, datetime(2024, 1, 2, 3, 4, 5)))
+    assert points == [[37.617299, 55.755826, 151.0]]
+
+
+def test_synthetic_videos_round_trip(tmp_path):
+    track = [[37.617299, 55.755826, 150.0], [37.61731, 55.75584, 149.0]]
+    write_mp4(str(tmp_path / Reader().get_settings()["Default filename"]), track,
+              datetime(2024, 1, 2, 3, 4, 5))
+    assert [list(point) for point in QuickTimeReader(str(tmp_path)).extract().points] == track
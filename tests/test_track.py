@@ -0,0 +1,63 @@
+"""
+Track tests
+
+Serializations are checked against EWKB spelled out byte by byte, with
+NumPy and with the struct/array fallback of the encoder
+
+© 2024 Kirill Romashchenko
+"""
+import pickle
+import pytest
+from lib import wkb_encoder
+from lib.track import Track
+
+# Little-endian (01) LineString with SRID (02000020), SRID 4326 (E6100000),
+# two points (02000000): (1.0, 2.0) and (3.0, 4.0)
+LINESTRING_EWKB = bytes.fromhex('0102000020E610000002000000'
+                                '000000000000F03F' '0000000000000040'
+                                '0000000000000840' '0000000000001040')
+# Little-endian (01) Point with SRID (01000020), SRID 4326 (E6100000), (1.0, 2.0)
+POINT_EWKB = bytes.fromhex('0101000020E6100000' '000000000000F03F' '0000000000000040')
+
+
+@pytest.fixture(params=['numpy', 'struct'])
+def encoder(request, monkeypatch):
+    """Encodes with NumPy or, with NumPy hidden, with struct and array"""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(wkb_encoder, 'numpy', None)
+    return request.param
+
+
+def test_to_wkb_matches_known_bytes(encoder):
+    track = Track.from_points([[1.0, 2.0, 100], [3.0, 4.0, 101]], alias='VID')
+
+    assert track.to_wkb() == LINESTRING_EWKB
+    assert track.to_wkb(srid=3857)[5:9] == (3857).to_bytes(4, 'little')
+    assert track[1:].to_wkb()[9:13] == (1).to_bytes(4, 'little')
+
+
+def test_point_wkbs_match_known_bytes(encoder):
+    track = Track.from_points([[1.0, 2.0, 100], [3.0, 4.0, 101]], alias='VID')
+    points = track.point_wkbs()
+
+    assert len(points) == 2 * wkb_encoder.WKBEncoder.point_size
+    assert points[:25] == POINT_EWKB
+    assert points[25:] == POINT_EWKB[:9] + LINESTRING_EWKB[-16:]
+
+
+def test_copy_buffer_rows(encoder):
+    track = Track.from_points([[1.0, 2.0, 100]], alias='VID')
+
+    assert track.copy_buffer(identifier='a\tb', suffix='\t2024-05-01') ==\
+        b'a\\tb\t1.0\t2.0\t100\t' + POINT_EWKB.hex().encode() + b'\t2024-05-01\n'
+
+
+def test_slices_share_columns_and_pickle():
+    track = Track.from_points([[30.5, 50.4, 120.5], [30.6, 50.5, 121.5]], alias='VID')
+    tail = track[1:]
+    track.longitudes[1] = 31.0
+
+    assert tail[0] == (31.0, 50.5, 121.5)
+    assert pickle.loads(pickle.dumps(tail)) == tail
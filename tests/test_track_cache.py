@@ -0,0 +1,75 @@
+"""
+Track cache tests
+
+© 2024 Kirill Romashchenko
+"""
+import os
+from lib.track import Track
+from lib.track_cache import TrackCache
+
+
+def track(points: int) -> Track:
+    return Track.from_points([[30.5, 50.4 + index * 1e-5, 120] for index in range(points)],
+                             alias='VID')
+
+
+def test_relative_directory_is_resolved_against_the_package(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = TrackCache(directory='cache_test_relative')
+    try:
+        package_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        assert cache.directory == os.path.join(package_folder, 'cache_test_relative')
+        assert not os.path.exists(tmp_path / 'cache_test_relative')
+    finally:
+        os.rmdir(cache.directory)
+
+
+def test_puts_within_the_cap_do_not_scan(tmp_path, monkeypatch):
+    cache = TrackCache(directory=str(tmp_path), max_size=10 * 1024)
+    scans = []
+    scan = cache.scan
+    monkeypatch.setattr(cache, 'scan', lambda: scans.append(1) or scan())
+
+    for index in range(4):
+        cache.put(f"{index:02d}key", track(10))
+    assert len(scans) == 1  # Running size is initialized once
+
+    cache.put('00key', track(10))  # Rewritten entry's size isn't counted twice
+    assert len(scans) == 1
+    assert cache.totals[cache.directory] == scan()[1]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = TrackCache(directory=str(tmp_path), max_size=3 * 1024)
+    for index in range(4):
+        cache.put(f"{index:02d}key", track(40))  # ~1 KB each
+        os.utime(cache.path(f"{index:02d}key"), (index, index))
+
+    assert cache.get('00key') is None
+    assert len(cache.get('03key')) == 40
+    assert cache.totals[cache.directory] <= cache.max_size
+
+
+def test_truncated_entries_are_misses_and_removed(tmp_path):
+    cache = TrackCache(directory=str(tmp_path))
+    cache.put('00key', track(10))
+    cache.put('01key', track(10))
+    with open(cache.path('00key'), 'r+b') as cached:
+        cached.truncate(cache.header.size + 20)  # Alias and part of the longitudes
+    open(cache.path('01key'), 'wb').close()
+
+    for key in ('00key', '01key'):
+        assert cache.get(key) is None
+        assert not os.path.exists(cache.path(key))
+
+
+def test_extraction_goes_on_without_a_creatable_cache(tmp_path, monkeypatch):
+    from lib.exif_extractor import EXIFExtractor
+    from lib.settings_reader import Reader
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('Read-only file system')
+
+    (tmp_path / Reader().get_settings()["Default filename"]).write_bytes(b'')
+    monkeypatch.setattr(os, 'makedirs', read_only)
+    assert EXIFExtractor(input_path=str(tmp_path)).cache is None